@@ -3,7 +3,7 @@ CREATES NGO Accounting System
 Application de comptabilité pour ONG - Conforme SYSCOHADA
 """
 
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, send_file, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, send_file, send_from_directory, g, session, make_response
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_wtf.csrf import CSRFProtect
@@ -12,9 +12,24 @@ from werkzeug.utils import secure_filename
 from datetime import datetime, date, timedelta
 from decimal import Decimal
 from functools import wraps
+from collections import defaultdict
 import os
+import csv
 import json
+import click
+import hashlib
+import hmac
+import secrets
+import time
+import atexit
+import signal
+import sys
+import queue
+import threading
+import importlib.util
 import shutil
+import mimetypes
+from urllib.parse import quote
 import glob as glob_module
 from io import BytesIO
 import smtplib
@@ -31,6 +46,41 @@ try:
 except ImportError:
     RATE_LIMITING_ENABLED = False
 
+# SECURITY: Hachage argon2id des mots de passe (optionnel, repli sur pbkdf2 werkzeug)
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import VerificationError, InvalidHashError
+    ARGON2_ENABLED = True
+except ImportError:
+    ARGON2_ENABLED = False
+
+# PERFORMANCE: Cache applicatif (optionnel)
+try:
+    from flask_caching import Cache
+    CACHING_ENABLED = True
+except ImportError:
+    CACHING_ENABLED = False
+
+# PERFORMANCE: Sérialiseur JSON natif pour le journal d'audit (optionnel)
+try:
+    import orjson
+    ORJSON_ENABLED = True
+except ImportError:
+    ORJSON_ENABLED = False
+
+# PERFORMANCE: Lecteur Excel natif pour l'import (optionnel, repli sur openpyxl)
+try:
+    from python_calamine import CalamineWorkbook
+    CALAMINE_ENABLED = True
+except ImportError:
+    CALAMINE_ENABLED = False
+# Repli de l'import Excel ; import différé dans lire_lignes_import
+OPENPYXL_ENABLED = importlib.util.find_spec('openpyxl') is not None
+
+# PERFORMANCE: Rendu PDF des rapports (optionnel) ; seule la présence du paquet est
+# testée au démarrage, l'import (lourd, via reportlab) est différé au premier PDF
+XHTML2PDF_ENABLED = importlib.util.find_spec('xhtml2pdf') is not None
+
 app = Flask(__name__)
 
 # SECURITY: Secret key configuration
@@ -56,11 +106,36 @@ def inject_app_urls():
 
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///ngo_accounting.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+
+def serialiser_json(valeurs):
+    """Sérialiseur des colonnes JSON : compact, Decimal, dates... en texte"""
+    if ORJSON_ENABLED:
+        return orjson.dumps(valeurs, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(valeurs, separators=(',', ':'), default=str)
+
+
+# PERFORMANCE: lots explicites pour les insert executemany (init_db, import Excel)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'insertmanyvalues_page_size': 1000,
+    'json_serializer': serialiser_json,
+}
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    # Pool serveur (PostgreSQL) : connexions réutilisées, vérifiées avant usage et
+    # renouvelées avant les coupures d'inactivité côté serveur/proxy
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update(
+        pool_size=10,
+        max_overflow=20,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        pool_use_lifo=True,
+    )
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
+# Derrière nginx : location interne servant UPLOAD_FOLDER (ex. /internal-uploads/), voir DEPLOYMENT.md
+app.config['UPLOADS_ACCEL_PREFIX'] = os.environ.get('UPLOADS_ACCEL_PREFIX')
 
-# Create upload folder if not exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Le dossier d'upload est créé à la première écriture (ensure_upload_dir), pas à l'import
 
 # =============================================================================
 # ORGANIZATION INFO
@@ -86,8 +161,13 @@ db = SQLAlchemy(app)
 csrf = CSRFProtect(app)
 
 # SECURITY: Enable SQLite foreign key enforcement
-from sqlalchemy import event
+from sqlalchemy import event, insert, tuple_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.engine import Engine
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import Session, load_only, joinedload, selectinload, object_session
+from sqlalchemy.orm.util import identity_key
 import sqlite3
 
 @event.listens_for(Engine, "connect")
@@ -114,19 +194,82 @@ else:
     limiter = None
 
 
+def rate_limit(limite, **kwargs):
+    """Appliquer une limite Flask-Limiter à une route, si le module est installé"""
+    if limiter is None:
+        return lambda f: f
+    return limiter.limit(limite, **kwargs)
+
+# PERFORMANCE: Initialize cache (Redis en production : CACHE_TYPE=RedisCache + CACHE_REDIS_URL)
+# Un SimpleCache vit dans chaque processus : les compteurs de génération qui périment
+# les agrégats n'y sont incrémentés que par le worker qui a écrit, les autres serviraient
+# des totaux périmés. Sans backend partagé, le cache n'est donc activé que pour un
+# processus unique (serveur de développement, ou WEB_CONCURRENCY=1).
+CACHE_PARTAGE = False
+if CACHING_ENABLED:
+    app.config['CACHE_TYPE'] = os.environ.get(
+        'CACHE_TYPE', 'RedisCache' if os.environ.get('CACHE_REDIS_URL') else 'SimpleCache'
+    )
+    app.config['CACHE_DEFAULT_TIMEOUT'] = 300
+    if os.environ.get('CACHE_REDIS_URL'):
+        app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL')
+    CACHE_PARTAGE = app.config['CACHE_TYPE'].rsplit('.', 1)[-1] not in ('SimpleCache', 'simple')
+    processus_unique = __name__ == '__main__' or os.environ.get('WEB_CONCURRENCY') == '1'
+    cache = Cache(app) if CACHE_PARTAGE or processus_unique else None
+else:
+    cache = None
+
+
+def cache_get_or_set(key, calcul, timeout=300):
+    """Retourne la valeur en cache, ou la calcule et la met en cache"""
+    if cache is None:
+        return calcul()
+    valeur = cache.get(key)
+    if valeur is None:
+        valeur = calcul()
+        cache.set(key, valeur, timeout=timeout)
+    return valeur
+
+
+def generation_cache(cle):
+    """Valeur courante d'un compteur de génération (0 s'il n'existe pas encore)"""
+    return (cache.get(cle) or 0) if cache is not None else 0
+
+
+def incrementer_generation(cle):
+    """Incrémenter un compteur de génération, ce qui périme les clés construites dessus"""
+    if cache is None:
+        return
+    if CACHE_PARTAGE:
+        # INCR atomique côté serveur, vu par tous les workers ; le compteur n'expire pas
+        cache.inc(cle)
+    else:
+        # SimpleCache.inc redonnerait au compteur le délai d'expiration par défaut
+        cache.set(cle, generation_cache(cle) + 1, timeout=0)
+
+
 # =============================================================================
 # DECORATORS
 # =============================================================================
 
 def role_required(roles):
     """Décorateur pour restreindre l'accès par rôle"""
+    roles = frozenset(roles)
+
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            if not current_user.is_authenticated:
+            # Résoudre le proxy current_user une seule fois
+            utilisateur = current_user._get_current_object()
+            if not utilisateur.is_authenticated:
                 flash('Veuillez vous connecter.', 'warning')
                 return redirect(url_for('login'))
-            if current_user.role not in roles:
+            role, actif = role_et_statut_verifies(utilisateur)
+            if not actif:
+                logout_user()
+                flash('Votre compte a été désactivé.', 'danger')
+                return redirect(url_for('login'))
+            if role not in roles:
                 flash('Vous n\'avez pas les permissions nécessaires.', 'danger')
                 return redirect(url_for('dashboard'))
             return f(*args, **kwargs)
@@ -134,23 +277,182 @@ def role_required(roles):
     return decorator
 
 
+def donnees_audit(table_name, record_id, action, old_values=None, new_values=None):
+    """Colonnes d'une entrée du journal d'audit pour la requête courante
+
+    Pour une modification (anciennes et nouvelles valeurs), seuls les champs
+    qui ont changé sont conservés.
+    """
+    if isinstance(old_values, dict) and isinstance(new_values, dict):
+        cles = [*new_values, *(k for k in old_values if k not in new_values)]
+        modifies = [k for k in cles if old_values.get(k) != new_values.get(k)]
+        old_values = {k: old_values.get(k) for k in modifies}
+        new_values = {k: new_values.get(k) for k in modifies}
+    return {
+        'table_name': table_name,
+        'record_id': record_id,
+        'action': action,
+        'old_values': old_values or None,
+        'new_values': new_values or None,
+        'user': current_user.email if current_user.is_authenticated else 'system',
+        'ip_address': request.remote_addr if request else None
+    }
+
+
 def log_audit(table_name, record_id, action, old_values=None, new_values=None):
-    """Enregistrer une action dans le journal d'audit"""
-    audit = AuditLog(
-        table_name=table_name,
-        record_id=record_id,
-        action=action,
-        old_values=json.dumps(old_values) if old_values else None,
-        new_values=json.dumps(new_values) if new_values else None,
-        user=current_user.email if current_user.is_authenticated else 'system',
-        ip_address=request.remote_addr if request else None
-    )
-    db.session.add(audit)
+    """Enregistrer une action dans le journal d'audit
+
+    Les entrées sont accumulées dans la session et insérées en un seul lot au
+    commit, dans la même transaction que les modifications qu'elles tracent.
+    """
+    audit = donnees_audit(table_name, record_id, action, old_values, new_values)
+    audit['timestamp'] = datetime.utcnow()
+    db.session.info.setdefault('audits', []).append(audit)
+
+
+@event.listens_for(Session, 'before_commit')
+def inserer_audits_en_attente(session):
+    """Insérer les audits de la transaction en un seul executemany"""
+    audits = session.info.pop('audits', None)
+    if audits:
+        session.execute(insert(AuditLog), audits)
+
+
+@event.listens_for(Session, 'after_rollback')
+def oublier_audits_en_attente(session):
+    session.info.pop('audits', None)
+
+
+@app.teardown_request
+def signaler_audits_non_ecrits(exc):
+    """Des audits encore en attente en fin de requête ne seront jamais écrits
+
+    C'est le cas d'un log_audit() appelé après le dernier commit : la perte est
+    journalisée plutôt que silencieuse.
+    """
+    audits = db.session.info.pop('audits', None)
+    if audits:
+        app.logger.error("%d entrée(s) d'audit non écrite(s), log_audit() sans commit ultérieur : %s",
+                         len(audits), ', '.join(f"{a['table_name']}/{a['action']}" for a in audits))
+
+
+# Audits hors transaction : file du processus vidée par un thread d'écriture
+AUDIT_FLUSH_INTERVAL = 0.1  # secondes entre deux lots
+_audits_en_file = queue.Queue()
+_ecrivain_audit = None
+_verrou_ecrivain_audit = threading.Lock()
+
+
+def log_audit_differe(table_name, record_id, action, old_values=None, new_values=None):
+    """Journaliser une action qui n'écrit rien d'autre en base (connexion, déconnexion...)
+
+    L'entrée est mise en file et insérée par lot en arrière-plan, sans commit
+    sur le chemin de la requête.
+    """
+    audit = donnees_audit(table_name, record_id, action, old_values, new_values)
+    audit['timestamp'] = datetime.utcnow()
+    _audits_en_file.put(audit)
+    demarrer_ecrivain_audit()
+
+
+def ecrire_audits_en_file():
+    """Insérer en un seul lot les audits en file"""
+    audits = []
+    while True:
+        try:
+            audits.append(_audits_en_file.get_nowait())
+        except queue.Empty:
+            break
+    if not audits:
+        return
+    with app.app_context():
+        try:
+            db.session.execute(insert(AuditLog), audits)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception("Échec de l'écriture du journal d'audit différé")
+
+
+def boucle_ecrivain_audit():
+    while True:
+        time.sleep(AUDIT_FLUSH_INTERVAL)
+        ecrire_audits_en_file()
+
+
+def demarrer_ecrivain_audit():
+    """Lancer le thread d'écriture au premier audit différé du processus
+
+    Démarrage paresseux plutôt qu'à l'import : chaque worker (après fork) a le sien.
+    """
+    global _ecrivain_audit
+    if _ecrivain_audit is not None and _ecrivain_audit.is_alive():
+        return
+    with _verrou_ecrivain_audit:
+        if _ecrivain_audit is None or not _ecrivain_audit.is_alive():
+            _ecrivain_audit = threading.Thread(target=boucle_ecrivain_audit, name='ecrivain-audit', daemon=True)
+            _ecrivain_audit.start()
+
+
+# Vider la file à l'arrêt du processus (le thread daemon est interrompu sans attendre).
+# SIGTERM sans gestionnaire tuerait le processus sans passer par atexit : il est converti
+# en sortie normale (gunicorn installe le sien, qui sort aussi proprement). Seul un arrêt
+# brutal (SIGKILL, OOM) perd les entrées de la file, au plus AUDIT_FLUSH_INTERVAL d'audits.
+atexit.register(ecrire_audits_en_file)
+if (threading.current_thread() is threading.main_thread()
+        and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL):
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+
+# PERFORMANCE: utilisateurs connectés gardés quelques secondes en mémoire (détachés
+# de la session) pour éviter un SELECT par requête authentifiée
+UTILISATEUR_CACHE_TTL = 30
+# Rôle et statut relus par role_required au plus toutes les N secondes : une désactivation
+# ou un changement de rôle fait dans un autre worker (qui ne vide que son propre cache)
+# s'applique ici au plus tard après ce délai
+ROLE_VERIFICATION_INTERVALLE = 10
+_utilisateurs_charges = {}  # id -> [expiration, utilisateur, dernière vérification rôle/statut]
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return Utilisateur.query.get(int(user_id))
+    uid = int(user_id)
+    maintenant = time.monotonic()
+    entree = _utilisateurs_charges.get(uid)
+    if entree and entree[0] > maintenant:
+        return entree[1]
+
+    user = db.session.get(Utilisateur, uid)
+    if user is not None:
+        db.session.expunge(user)
+        _utilisateurs_charges[uid] = [maintenant + UTILISATEUR_CACHE_TTL, user, maintenant]
+    return user
+
+
+def oublier_utilisateur_charge(user_id):
+    """Forcer le rechargement d'un utilisateur (rôle, mot de passe, déconnexion)"""
+    _utilisateurs_charges.pop(user_id, None)
+
+
+def role_et_statut_verifies(utilisateur):
+    """Rôle et statut actif de l'utilisateur chargé, relus en base si la dernière
+    vérification date de plus de ROLE_VERIFICATION_INTERVALLE secondes"""
+    maintenant = time.monotonic()
+    entree = _utilisateurs_charges.get(utilisateur.id)
+    if entree is not None and entree[1] is utilisateur:
+        if maintenant - entree[2] < ROLE_VERIFICATION_INTERVALLE:
+            return utilisateur.role, utilisateur.actif
+    else:
+        entree = None
+
+    role, actif = db.session.query(Utilisateur.role, Utilisateur.actif).filter_by(
+        id=utilisateur.id
+    ).one_or_none() or (None, False)
+    if (role, actif) != (utilisateur.role, utilisateur.actif):
+        oublier_utilisateur_charge(utilisateur.id)
+    elif entree is not None:
+        entree[2] = maintenant
+    return role, actif
 
 # =============================================================================
 # MODELS
@@ -196,6 +498,11 @@ class CompteComptable(db.Model):
     compte_parent_id = db.Column(db.Integer, db.ForeignKey('comptes.id'))
     actif = db.Column(db.Boolean, default=True)
 
+    __table_args__ = (
+        # Filtres classe = 6 des rapports : l'id suffit pour la jointure avec les lignes
+        db.Index('ix_compte_classe_id', 'classe', 'id'),
+    )
+
     # Relations
     compte_parent = db.relationship('CompteComptable', remote_side=[id], backref='sous_comptes')
     details_bancaires = db.relationship('CompteTresorerie', backref='compte_comptable', uselist=False)
@@ -273,6 +580,13 @@ class Bailleur(db.Model):
     devise_id = db.Column(db.Integer, db.ForeignKey('devises.id'))
     actif = db.Column(db.Boolean, default=True)
 
+    __table_args__ = (
+        # Bailleurs actifs (tableau de bord, formulaires)
+        db.Index('ix_bailleur_actif', 'actif',
+                 postgresql_where=db.text('actif = true'),
+                 sqlite_where=db.text('actif = 1')),
+    )
+
     # Relations
     devise = db.relationship('Devise')
     projets = db.relationship('Projet', back_populates='bailleur')
@@ -293,9 +607,17 @@ class Projet(db.Model):
     date_debut = db.Column(db.Date)
     date_fin = db.Column(db.Date)
     budget_total = db.Column(db.Numeric(15, 2), default=0)
+    # Somme des montant_prevu des lignes budgétaires, tenue à jour par les événements de LigneBudget
+    total_prevu = db.Column(db.Numeric(15, 2), default=0)
     devise_id = db.Column(db.Integer, db.ForeignKey('devises.id'))
     statut = db.Column(db.String(20), default='actif')  # actif, cloture, suspendu
 
+    __table_args__ = (
+        # Projets actifs (tableau de bord, alertes, formulaires). Partiel sous PostgreSQL
+        # seulement : SQLite n'utilise pas un index partiel pour un filtre paramétré (statut = ?)
+        db.Index('ix_projet_actif', 'statut', postgresql_where=db.text("statut = 'actif'")),
+    )
+
     # Relations
     bailleur = db.relationship('Bailleur', back_populates='projets')
     devise = db.relationship('Devise')
@@ -333,6 +655,11 @@ class LigneBudget(db.Model):
     cout_unitaire = db.Column(db.Numeric(15, 2), default=0)
     montant_prevu = db.Column(db.Numeric(15, 2), default=0)
 
+    __table_args__ = (
+        # Lignes d'un projet regroupées par catégorie (rapports bailleur)
+        db.Index('ix_ligne_budget_projet', 'projet_id', 'categorie_id'),
+    )
+
     # Relations
     projet = db.relationship('Projet', back_populates='lignes_budget')
     categorie = db.relationship('CategorieBudget')
@@ -355,6 +682,48 @@ class LigneBudget(db.Model):
         return self.montant_prevu or Decimal('0')
 
 
+def recalculer_total_prevu(connection, projet_id):
+    """Réaligner projets.total_prevu sur la somme des lignes budgétaires du projet"""
+    connection.execute(
+        db.update(Projet.__table__).where(Projet.id == projet_id).values(
+            total_prevu=db.select(db.func.coalesce(db.func.sum(LigneBudget.montant_prevu), 0))
+            .where(LigneBudget.projet_id == projet_id).scalar_subquery()
+        )
+    )
+
+
+def total_prevu_a_recalculer(connection, ligne, projet_ids):
+    for projet_id in projet_ids:
+        if projet_id is not None:
+            recalculer_total_prevu(connection, projet_id)
+    # L'objet Projet éventuellement chargé est périmé après le flush
+    object_session(ligne).info.setdefault('totaux_prevus_perimes', set()).update(projet_ids)
+
+
+@event.listens_for(LigneBudget, 'after_insert')
+@event.listens_for(LigneBudget, 'after_delete')
+def maj_total_prevu(mapper, connection, ligne):
+    total_prevu_a_recalculer(connection, ligne, {ligne.projet_id})
+
+
+@event.listens_for(LigneBudget, 'after_update')
+def maj_total_prevu_modifie(mapper, connection, ligne):
+    from sqlalchemy import inspect
+
+    attrs = inspect(ligne).attrs
+    if attrs.montant_prevu.history.has_changes() or attrs.projet_id.history.has_changes():
+        # Ligne déplacée : l'ancien projet est aussi à recalculer
+        total_prevu_a_recalculer(connection, ligne, {ligne.projet_id, *attrs.projet_id.history.deleted})
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def perimer_totaux_prevus(session, flush_context):
+    for projet_id in session.info.pop('totaux_prevus_perimes', ()):
+        projet = session.identity_map.get(identity_key(Projet, projet_id))
+        if projet is not None:
+            session.expire(projet, ['total_prevu'])
+
+
 class BudgetAnnee(db.Model):
     """Budget par année / Annual Budget Breakdown"""
     __tablename__ = 'budgets_annee'
@@ -410,6 +779,18 @@ class PieceComptable(db.Model):
     valide = db.Column(db.Boolean, default=False)
     date_creation = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_piece_date', 'date_piece'),
+        # Filtre exercice (+ validation) des rapports et de la clôture, et liste des écritures
+        # d'un exercice (ORDER BY date_piece DESC LIMIT) parcourue dans l'ordre, sans tri
+        db.Index('ix_piece_exercice_date', 'exercice_id', db.desc('date_piece'), 'valide'),
+        # Alerte « écritures non validées depuis 7 jours » : index partiel, réduit
+        # aux pièces en attente, que le comptage parcourt sans toucher la table
+        db.Index('ix_pieces_nonvalide', 'date_creation',
+                 postgresql_where=db.text('valide = false'),
+                 sqlite_where=db.text('valide = 0')),
+    )
+
     # Relations
     journal = db.relationship('Journal')
     exercice = db.relationship('ExerciceComptable', backref='pieces')
@@ -419,17 +800,52 @@ class PieceComptable(db.Model):
     def __repr__(self):
         return f'<Piece {self.numero} - {self.libelle}>'
 
-    @property
+    @hybrid_property
     def total_debit(self):
         return sum(l.debit or 0 for l in self.lignes)
 
-    @property
+    @total_debit.expression
+    def total_debit(cls):
+        """Total côté SQL (sous-requête), pour trier/filtrer sans charger les lignes"""
+        return db.select(db.func.coalesce(db.func.sum(LigneEcriture.debit), 0)).where(
+            LigneEcriture.piece_id == cls.id
+        ).scalar_subquery()
+
+    @hybrid_property
     def total_credit(self):
         return sum(l.credit or 0 for l in self.lignes)
 
-    @property
+    @total_credit.expression
+    def total_credit(cls):
+        return db.select(db.func.coalesce(db.func.sum(LigneEcriture.credit), 0)).where(
+            LigneEcriture.piece_id == cls.id
+        ).scalar_subquery()
+
+    @hybrid_property
     def est_equilibree(self):
-        return abs(self.total_debit - self.total_credit) < 0.01
+        # Décimal : pas de dérive flottante sur un équilibre débit/crédit
+        ecart = Decimal(str(self.total_debit)) - Decimal(str(self.total_credit))
+        return abs(ecart) < Decimal('0.01')
+
+    @est_equilibree.expression
+    def est_equilibree(cls):
+        """Équilibre côté SQL : filtrer les pièces (dés)équilibrées en une requête"""
+        return db.select(
+            db.func.abs(
+                db.func.coalesce(db.func.sum(LigneEcriture.debit), 0)
+                - db.func.coalesce(db.func.sum(LigneEcriture.credit), 0)
+            ) < Decimal('0.01')
+        ).where(LigneEcriture.piece_id == cls.id).correlate(cls).scalar_subquery()
+
+
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+    # Recherche ILIKE '%q%' de liste_ecritures servie par des index trigrammes (extension pg_trgm)
+    db.Index('ix_piece_numero_trgm', PieceComptable.numero,
+             postgresql_using='gin', postgresql_ops={'numero': 'gin_trgm_ops'})
+    db.Index('ix_piece_libelle_trgm', PieceComptable.libelle,
+             postgresql_using='gin', postgresql_ops={'libelle': 'gin_trgm_ops'})
+    db.Index('ix_piece_reference_trgm', PieceComptable.reference,
+             postgresql_using='gin', postgresql_ops={'reference': 'gin_trgm_ops'})
 
 
 class LigneEcriture(db.Model):
@@ -444,6 +860,20 @@ class LigneEcriture(db.Model):
     libelle = db.Column(db.String(200))
     debit = db.Column(db.Numeric(15, 2), default=0)
     credit = db.Column(db.Numeric(15, 2), default=0)
+    # Copie de pieces.exercice_id (événements ci-dessous) : agrégats d'un exercice sans passer par pieces
+    exercice_id = db.Column(db.Integer, db.ForeignKey('exercices.id'))
+
+    __table_args__ = (
+        # Agrégats bornés à un exercice (balance, états financiers)
+        db.Index('ix_ligne_exercice_compte', 'exercice_id', 'compte_id', postgresql_include=['debit', 'credit']),
+        # Soldes par compte à une date (réconciliation, petite caisse, trésorerie)
+        db.Index('ix_ligne_compte_piece', 'compte_id', 'piece_id'),
+        # Réalisé par ligne budgétaire (rapports bailleur, réconciliation analytique)
+        db.Index('ix_ligne_budget_compte', 'ligne_budget_id', 'compte_id', postgresql_include=['debit']),
+        # Lignes d'une pièce (chargement, équilibre, jointures depuis pieces) ; les agrégats
+        # par exercice passent par ix_ligne_exercice_compte, inutile de couvrir debit/credit ici
+        db.Index('ix_ligne_piece', 'piece_id'),
+    )
 
     # Relations
     piece = db.relationship('PieceComptable', back_populates='lignes')
@@ -455,6 +885,26 @@ class LigneEcriture(db.Model):
         return f'<Ligne {self.compte.numero if self.compte else ""} D:{self.debit} C:{self.credit}>'
 
 
+@event.listens_for(LigneEcriture, 'before_insert')
+def renseigner_exercice_ligne(mapper, connection, ligne):
+    if ligne.exercice_id is None:
+        piece = ligne.__dict__.get('piece')
+        ligne.exercice_id = piece.exercice_id if piece is not None else db.select(
+            PieceComptable.exercice_id
+        ).where(PieceComptable.id == ligne.piece_id).scalar_subquery()
+
+
+@event.listens_for(PieceComptable, 'after_update')
+def propager_exercice_piece(mapper, connection, piece):
+    from sqlalchemy import inspect
+
+    if inspect(piece).attrs.exercice_id.history.has_changes():
+        connection.execute(
+            db.update(LigneEcriture.__table__).where(LigneEcriture.piece_id == piece.id)
+            .values(exercice_id=piece.exercice_id)
+        )
+
+
 class ImputationAnalytique(db.Model):
     """Analytical Imputation / Ventilation analytique multi-projets
 
@@ -487,16 +937,28 @@ class AuditLog(db.Model):
     table_name = db.Column(db.String(50), nullable=False)
     record_id = db.Column(db.Integer)
     action = db.Column(db.String(20), nullable=False)  # CREATE, UPDATE, DELETE
-    old_values = db.Column(db.Text)    # JSON des anciennes valeurs
-    new_values = db.Column(db.Text)    # JSON des nouvelles valeurs
+    # JSON natif (JSONB sous PostgreSQL) : décodé par le pilote, interrogeable en SQL ;
+    # None stocké en NULL SQL et non en valeur JSON 'null'
+    old_values = db.Column(db.JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), 'postgresql'))
+    new_values = db.Column(db.JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), 'postgresql'))
     user = db.Column(db.String(100))
     ip_address = db.Column(db.String(45))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Pagination par clé (timestamp, id) du journal d'audit
+        db.Index('ix_audit_ts_id', 'timestamp', 'id'),
+    )
+
     def __repr__(self):
         return f'<AuditLog {self.table_name} {self.action} {self.timestamp}>'
 
 
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+    # Filtres de contenance (new_values @> '{"role": "directeur"}') servis par index
+    db.Index('ix_audit_newvals_gin', AuditLog.new_values, postgresql_using='gin')
+
+
 class PieceJustificative(db.Model):
     """Pièces justificatives / Supporting Documents
 
@@ -515,6 +977,12 @@ class PieceJustificative(db.Model):
     description = db.Column(db.String(255))
     date_upload = db.Column(db.DateTime, default=datetime.utcnow)
     uploaded_by = db.Column(db.String(100))
+    fichier_hash = db.Column(db.String(64))  # SHA-256 du contenu, calculé à l'upload
+
+    __table_args__ = (
+        # Un même document n'est attaché qu'une fois à une écriture
+        db.Index('ix_pj_piece_hash', 'piece_comptable_id', 'fichier_hash', unique=True),
+    )
 
     # Relations
     ligne_ecriture = db.relationship('LigneEcriture', backref='pieces_justificatives')
@@ -541,15 +1009,15 @@ class Utilisateur(UserMixin, db.Model):
 
     # Permissions par rôle
     ROLES_PERMISSIONS = {
-        'comptable': ['saisie_ecritures', 'voir_rapports', 'gerer_projets'],
-        'directeur': ['saisie_ecritures', 'voir_rapports', 'gerer_projets',
-                      'valider_ecritures', 'cloturer_exercice', 'gerer_utilisateurs'],
-        'auditeur': ['voir_rapports', 'voir_audit_trail', 'export_donnees']
+        'comptable': frozenset({'saisie_ecritures', 'voir_rapports', 'gerer_projets'}),
+        'directeur': frozenset({'saisie_ecritures', 'voir_rapports', 'gerer_projets',
+                                'valider_ecritures', 'cloturer_exercice', 'gerer_utilisateurs'}),
+        'auditeur': frozenset({'voir_rapports', 'voir_audit_trail', 'export_donnees'})
     }
 
     def has_permission(self, permission):
         """Vérifie si l'utilisateur a une permission donnée"""
-        return permission in self.ROLES_PERMISSIONS.get(self.role, [])
+        return permission in self.ROLES_PERMISSIONS.get(self.role, frozenset())
 
     def __repr__(self):
         return f'<Utilisateur {self.email} ({self.role})>'
@@ -669,12 +1137,17 @@ class Avance(db.Model):
     def __repr__(self):
         return f'<Avance {self.numero} {self.beneficiaire} {self.montant}>'
 
-    @property
+    @hybrid_property
     def est_en_retard(self):
         if self.statut == 'en_attente' and self.date_limite:
             return date.today() > self.date_limite
         return False
 
+    @est_en_retard.expression
+    def est_en_retard(cls):
+        """Même règle côté SQL, pour filtrer/compter sans charger les avances"""
+        return db.and_(cls.statut == 'en_attente', cls.date_limite < date.today())
+
     @property
     def jours_retard(self):
         if self.est_en_retard:
@@ -712,9 +1185,20 @@ class Immobilisation(db.Model):
     date_sortie = db.Column(db.Date)
     motif_sortie = db.Column(db.String(100))
     valeur_cession = db.Column(db.Numeric(15, 2))
+    # Matérialisés à chaque calcul d'amortissement (évite de sommer les lignes à l'affichage)
+    cumul_amortissement = db.Column(db.Numeric(15, 2), default=0)
+    valeur_nette_comptable = db.Column(
+        db.Numeric(15, 2),
+        default=lambda ctx: ctx.get_current_parameters()['valeur_acquisition']
+    )
     cree_par = db.Column(db.String(100))
     date_creation = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Registre filtré par statut et trié par code
+        db.Index('ix_immobilisation_statut_code', 'statut', 'code'),
+    )
+
     # Relations
     compte_immobilisation = db.relationship('CompteComptable', foreign_keys=[compte_immobilisation_id])
     compte_amortissement = db.relationship('CompteComptable', foreign_keys=[compte_amortissement_id])
@@ -730,22 +1214,22 @@ class Immobilisation(db.Model):
         'batiment': 20
     }
 
+    # Préfixes des codes d'immobilisation par catégorie
+    PREFIXES_CODE = {
+        'informatique': 'IT',
+        'vehicule': 'VH',
+        'mobilier': 'MB',
+        'batiment': 'BT'
+    }
+
     def __repr__(self):
         return f'<Immobilisation {self.code} {self.designation}>'
 
     @property
     def amortissement_annuel(self):
         if self.duree_amortissement and self.duree_amortissement > 0:
-            return float(self.valeur_acquisition) / self.duree_amortissement
-        return 0
-
-    @property
-    def cumul_amortissement(self):
-        return sum(float(l.dotation or 0) for l in self.lignes_amortissement)
-
-    @property
-    def valeur_nette_comptable(self):
-        return float(self.valeur_acquisition or 0) - self.cumul_amortissement
+            return Decimal(self.valeur_acquisition) / self.duree_amortissement
+        return Decimal(0)
 
 
 class LigneAmortissement(db.Model):
@@ -868,9 +1352,18 @@ class Fournisseur(db.Model):
     cree_par = db.Column(db.String(100))
     date_creation = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Liste des fournisseurs actifs triée par nom
+        db.Index('ix_fournisseur_actif_nom', 'actif', 'nom'),
+    )
+
     # Relations
     compte_comptable = db.relationship('CompteComptable')
 
+    # Champs texte éditables depuis le formulaire
+    CHAMPS_FORMULAIRE = ('nom', 'categorie', 'contact', 'telephone', 'email',
+                         'adresse', 'ville', 'ninea', 'notes')
+
     def __repr__(self):
         return f'<Fournisseur {self.code} - {self.nom}>'
 
@@ -885,6 +1378,24 @@ class Fournisseur(db.Model):
         return float(total or 0)
 
 
+# Autocomplétion par préfixe (filtre_prefixe) sur lower(nom) et lower(code), limitée aux
+# fournisseurs actifs ; text_pattern_ops pour que PostgreSQL serve LIKE 'xyz%' par l'index
+db.Index(
+    'ix_fournisseur_nom_prefixe',
+    db.func.lower(Fournisseur.nom).label('nom_lower'),
+    postgresql_ops={'nom_lower': 'text_pattern_ops'},
+    postgresql_where=Fournisseur.actif == True,
+    sqlite_where=Fournisseur.actif == True
+)
+db.Index(
+    'ix_fournisseur_code_prefixe',
+    db.func.lower(Fournisseur.code).label('code_lower'),
+    postgresql_ops={'code_lower': 'text_pattern_ops'},
+    postgresql_where=Fournisseur.actif == True,
+    sqlite_where=Fournisseur.actif == True
+)
+
+
 # =============================================================================
 # MODULES NOTES DE FRAIS & DEMANDES D'ACHAT
 # =============================================================================
@@ -1226,80 +1737,217 @@ class TrancheFinancement(db.Model):
 # HELPER FUNCTIONS
 # =============================================================================
 
+def get_exercice_ouvert():
+    """Exercice comptable ouvert, mémorisé pour la durée de la requête"""
+    if '_exercice_ouvert' not in g:
+        g._exercice_ouvert = ExerciceComptable.query.filter_by(cloture=False).first()
+    return g._exercice_ouvert
+
+
+def prochain_id(model):
+    """Prochain identifiant pour la numérotation (MAX(id) + 1, sans charger de ligne)"""
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+
+# Compteur des numéros de pièce sous PostgreSQL (créé par migrer_sequence_pieces)
+SEQUENCE_NUMERO_PIECE = db.Sequence('piece_numero_seq')
+
+
+def reserver_numeros_pieces(nombre):
+    """Réserver nombre compteurs consécutifs pour la numérotation des pièces
+
+    Sous PostgreSQL, ils sont tirés de la séquence piece_numero_seq en une requête :
+    uniques même pour deux saisies ou imports simultanés, sans lecture de la table.
+    SQLite, sans séquences et aux écritures sérialisées, garde MAX(id) + 1.
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return db.session.scalars(
+            db.select(SEQUENCE_NUMERO_PIECE.next_value()).select_from(db.func.generate_series(1, nombre))
+        ).all()
+    premier = prochain_id(PieceComptable)
+    return list(range(premier, premier + nombre))
+
+
+def prochain_numero_piece():
+    """Numéro PC<année><n> d'une nouvelle pièce (voir reserver_numeros_pieces)"""
+    return f"PC{datetime.now().year}{reserver_numeros_pieces(1)[0]:05d}"
+
+
+def somme_float(colonne):
+    """SUM renvoyé directement en flottant par la base
+
+    Réservé aux agrégats d'affichage (tableau de bord, alertes) : évite la conversion
+    Decimal puis float de chaque valeur. Les rapports comptables restent en Decimal.
+    """
+    return db.cast(db.func.sum(colonne), db.Float)
+
+
+def filtre_prefixe(colonne, prefixe):
+    """Condition « colonne commence par prefixe » sans tenir compte de la casse
+
+    Porte sur lower(colonne), pour qu'un index sur cette expression la serve : LIKE
+    'prefixe%' (% et _ échappés), que PostgreSQL sert par un index text_pattern_ops.
+    SQLite n'utilise jamais d'index pour un LIKE sur une expression : la plage
+    équivalente (comparaison binaire) lui est ajoutée. Son lower() ne traite que
+    l'ASCII, le préfixe est abaissé de la même façon.
+    """
+    expression = db.func.lower(colonne)
+    sqlite = db.session.get_bind().dialect.name == 'sqlite'
+    if sqlite:
+        prefixe = ''.join(c.lower() if c.isascii() else c for c in prefixe)
+    else:
+        prefixe = prefixe.lower()
+    motif = prefixe.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    condition = expression.like(motif, escape='\\')
+    if sqlite and prefixe:
+        borne = prefixe[:-1] + chr(ord(prefixe[-1]) + 1)
+        condition = db.and_(expression >= prefixe, expression < borne, condition)
+    return condition
+
+
+def realise_par_projet():
+    """Dépenses réalisées (débits classe 6) par projet, en une requête groupée
+
+    Le résultat est mis en cache avec le tableau de bord : toute modification
+    d'écriture ou de ligne budgétaire le périme, pour tous les workers (compteurs de
+    génération du cache partagé), et l'affichage ne ré-agrège pas les lignes d'écriture.
+    """
+    def calculer():
+        return dict(db.session.query(
+            LigneBudget.projet_id,
+            somme_float(LigneEcriture.debit)
+        ).join(LigneBudget, LigneEcriture.ligne_budget_id == LigneBudget.id).join(
+            CompteComptable, LigneEcriture.compte_id == CompteComptable.id
+        ).filter(
+            CompteComptable.classe == 6
+        ).group_by(LigneBudget.projet_id).all())
+
+    return cache_get_or_set(cle_cache_tableau_bord('realise_projets'), calculer)
+
+
+def prevu_par_projet():
+    """Montants prévus par projet (colonne total_prevu, maintenue à l'écriture)"""
+    return dict(db.session.query(Projet.id, db.cast(Projet.total_prevu, db.Float)).all())
+
+
+def comptes_de_prefixe(prefixe):
+    """Filtre numero LIKE 'prefixe%' écrit en intervalle
+
+    SQLite n'utilise pas d'index pour LIKE (insensible à la casse par défaut) ;
+    l'intervalle passe par l'index unique de comptes.numero.
+    """
+    suivant = prefixe[:-1] + chr(ord(prefixe[-1]) + 1)
+    return (CompteComptable.numero >= prefixe) & (CompteComptable.numero < suivant)
+
+
+def agregats_alertes(date_limite):
+    """Agrégats des alertes en un seul aller-retour (UNION ALL de requêtes étiquetées)
+
+    Chaque ligne vaut (type, cle, libelle, valeur) : 'prevu' par projet, 'solde'
+    par compte de classe 5, et les compteurs 'non_valide' et 'avance_retard'.
+    """
+    from sqlalchemy import literal, union_all
+
+    texte, entier, montant = db.String(), db.Integer(), db.Float()
+    sans_cle, sans_libelle = db.cast(db.null(), entier), db.cast(db.null(), texte)
+
+    prevus = db.select(
+        literal('prevu').label('type'), Projet.id.label('cle'), sans_libelle.label('libelle'),
+        db.cast(Projet.total_prevu, montant).label('valeur')
+    ).where(Projet.statut == 'actif')
+    soldes = db.select(
+        literal('solde'), CompteComptable.id, CompteComptable.numero + ' (' + CompteComptable.intitule + ')',
+        db.cast(db.func.coalesce(db.func.sum(LigneEcriture.debit), 0)
+                - db.func.coalesce(db.func.sum(LigneEcriture.credit), 0), montant)
+    ).join(
+        LigneEcriture, LigneEcriture.compte_id == CompteComptable.id
+    ).where(CompteComptable.classe == 5).group_by(CompteComptable.id)
+    non_valides = db.select(
+        literal('non_valide'), sans_cle, sans_libelle, db.cast(db.func.count(PieceComptable.id), montant)
+    ).where(PieceComptable.valide == False, PieceComptable.date_creation < date_limite)
+    avances = db.select(
+        literal('avance_retard'), sans_cle, sans_libelle, db.cast(db.func.count(Avance.id), montant)
+    ).where(Avance.est_en_retard)
+
+    return db.session.execute(union_all(prevus, soldes, non_valides, avances)).all()
+
+
+# Libellés des alertes, formatés à l'affichage à partir des champs de chaque alerte
+MESSAGES_ALERTES = {
+    'budget_80': "Projet {projet[code]}: {taux:.0f}% du budget consommé",
+    'ecritures_non_validees': "{nombre} écriture(s) non validée(s) depuis plus de 7 jours",
+    'solde_negatif': "Compte {compte}: solde négatif de {solde:,.0f} FCFA",
+    'avances_retard': "{nombre} avance(s) non justifiée(s) depuis plus de 7 jours (déduction salaire applicable)",
+}
+
+
+@app.template_filter('message_alerte')
+def message_alerte(alerte):
+    return MESSAGES_ALERTES[alerte['type']].format(**alerte)
+
+
 def generer_alertes():
-    """Génère les alertes système automatiques"""
+    """Génère les alertes système automatiques
+
+    Données seules (type, niveau et champs du message) : le texte est produit
+    à l'affichage par le filtre message_alerte.
+    """
     alertes = []
 
+    date_limite = datetime.utcnow() - timedelta(days=7)
+    agregats = defaultdict(list)
+    for type_agregat, cle, libelle, valeur in agregats_alertes(date_limite):
+        agregats[type_agregat].append((cle, libelle, valeur))
+
     # Alerte: Projets > 80% budget consommé
     projets = Projet.query.filter_by(statut='actif').all()
+    prevus = {cle: valeur for cle, _, valeur in agregats['prevu']}
+    realises = realise_par_projet()
     for projet in projets:
-        total_prevu = sum(float(l.montant_prevu or 0) for l in projet.lignes_budget)
+        total_prevu = float(prevus.get(projet.id) or 0)
         if total_prevu > 0:
-            total_realise = 0
-            for ligne in projet.lignes_budget:
-                realise = db.session.query(
-                    db.func.sum(LigneEcriture.debit)
-                ).join(CompteComptable).filter(
-                    (LigneEcriture.ligne_budget_id == ligne.id) &
-                    (CompteComptable.classe == 6)
-                ).scalar() or 0
-                total_realise += float(realise)
+            total_realise = float(realises.get(projet.id) or 0)
 
             taux = (total_realise / total_prevu) * 100
             if taux > 80:
                 alertes.append({
                     'type': 'budget_80',
                     'niveau': 'danger' if taux > 100 else 'warning',
-                    'message': f"Projet {projet.code}: {taux:.0f}% du budget consommé",
-                    'projet': projet
+                    'taux': taux,
+                    # Référence légère (pas d'objet ORM) : la liste est mise en cache
+                    'projet': {'id': projet.id, 'code': projet.code}
                 })
 
     # Alerte: Écritures non validées > 7 jours
-    date_limite = datetime.utcnow() - timedelta(days=7)
-    ecritures_non_validees = PieceComptable.query.filter(
-        PieceComptable.valide == False,
-        PieceComptable.date_creation < date_limite
-    ).count()
+    ecritures_non_validees = int(agregats['non_valide'][0][2])
     if ecritures_non_validees > 0:
         alertes.append({
             'type': 'ecritures_non_validees',
             'niveau': 'warning',
-            'message': f"{ecritures_non_validees} écriture(s) non validée(s) depuis plus de 7 jours",
+            'nombre': ecritures_non_validees,
             'projet': None
         })
 
     # Alerte: Solde bancaire négatif (comptes classe 5)
-    comptes_banque = db.session.query(
-        CompteComptable.numero,
-        CompteComptable.intitule,
-        db.func.sum(LigneEcriture.debit).label('total_debit'),
-        db.func.sum(LigneEcriture.credit).label('total_credit')
-    ).join(
-        LigneEcriture, LigneEcriture.compte_id == CompteComptable.id
-    ).filter(
-        CompteComptable.classe == 5
-    ).group_by(CompteComptable.id).all()
-
-    for compte in comptes_banque:
-        solde = float(compte.total_debit or 0) - float(compte.total_credit or 0)
+    for compte_id, compte, solde in sorted(agregats['solde'], key=lambda agregat: agregat[1]):
+        solde = float(solde)
         if solde < 0:
             alertes.append({
                 'type': 'solde_negatif',
                 'niveau': 'danger',
-                'message': f"Compte {compte.numero} ({compte.intitule}): solde négatif de {solde:,.0f} FCFA",
+                'compte_id': compte_id,
+                'compte': compte,
+                'solde': solde,
                 'projet': None
             })
 
     # Alerte: Avances non justifiées > 7 jours
-    avances_retard = Avance.query.filter(
-        Avance.statut == 'en_attente',
-        Avance.date_limite < date.today()
-    ).count()
+    avances_retard = int(agregats['avance_retard'][0][2])
     if avances_retard > 0:
         alertes.append({
             'type': 'avances_retard',
             'niveau': 'danger',
-            'message': f"{avances_retard} avance(s) non justifiée(s) depuis plus de 7 jours (déduction salaire applicable)",
+            'nombre': avances_retard,
             'projet': None
         })
 
@@ -1322,17 +1970,10 @@ def calculer_stats_dashboard():
     }
 
     # Calculer réalisé total
+    prevus, realises = prevu_par_projet(), realise_par_projet()
     for projet in projets:
-        projet_realise = 0
-        projet_prevu = sum(float(l.montant_prevu or 0) for l in projet.lignes_budget)
-        for ligne in projet.lignes_budget:
-            realise = db.session.query(
-                db.func.sum(LigneEcriture.debit)
-            ).join(CompteComptable).filter(
-                (LigneEcriture.ligne_budget_id == ligne.id) &
-                (CompteComptable.classe == 6)
-            ).scalar() or 0
-            projet_realise += float(realise)
+        projet_prevu = float(prevus.get(projet.id) or 0)
+        projet_realise = float(realises.get(projet.id) or 0)
 
         stats['total_realise'] += projet_realise
         if projet_prevu > 0:
@@ -1346,17 +1987,17 @@ def calculer_stats_dashboard():
 
     # Calculer solde banque (comptes 52x)
     solde_banque = db.session.query(
-        db.func.sum(LigneEcriture.debit) - db.func.sum(LigneEcriture.credit)
+        somme_float(LigneEcriture.debit) - somme_float(LigneEcriture.credit)
     ).join(CompteComptable).filter(
-        CompteComptable.numero.like('52%')
+        comptes_de_prefixe('52')
     ).scalar() or 0
     stats['solde_banque'] = float(solde_banque)
 
     # Calculer solde caisse (comptes 57x)
     solde_caisse = db.session.query(
-        db.func.sum(LigneEcriture.debit) - db.func.sum(LigneEcriture.credit)
+        somme_float(LigneEcriture.debit) - somme_float(LigneEcriture.credit)
     ).join(CompteComptable).filter(
-        CompteComptable.numero.like('57%')
+        comptes_de_prefixe('57')
     ).scalar() or 0
     stats['solde_caisse'] = float(solde_caisse)
 
@@ -1379,6 +2020,58 @@ def calculer_stats_dashboard():
 # ROUTES - AUTHENTICATION
 # =============================================================================
 
+# SECURITY: argon2id (profil par défaut d'argon2-cffi) : coût maîtrisé et résistant aux GPU.
+# ARGON2_TIME_COST / ARGON2_MEMORY_COST (Kio) / ARGON2_PARALLELISM ajustent le coût au
+# serveur ; les hash existants sont re-hachés à la connexion suivante (check_needs_rehash).
+_password_hasher = PasswordHasher(
+    time_cost=int(os.environ.get('ARGON2_TIME_COST', 3)),
+    memory_cost=int(os.environ.get('ARGON2_MEMORY_COST', 65536)),
+    parallelism=int(os.environ.get('ARGON2_PARALLELISM', 4)),
+) if ARGON2_ENABLED else None
+
+
+# Hash pré-calculé du mot de passe de développement 'admin123' (werkzeug scrypt) :
+# init_db n'a pas à payer la dérivation de clé. Re-haché en argon2 à la première
+# connexion ; ce mot de passe doit être changé dès la première connexion.
+_DEFAULT_ADMIN_PASSWORD = 'admin123'
+_DEFAULT_ADMIN_HASH = (
+    'scrypt:32768:8:1$wQVAfX3xvo8VYznw$3a709ebe8ccd64fb89ac4ce0ee2ceddcc8980a33a41728505c0e7e90'
+    'cd97ced9858a01a540a65fbc8be3805738ab352928f06447abab2e46d74a9fed24c3729d'
+)
+
+
+def hacher_mot_de_passe(password):
+    """Hacher un mot de passe (argon2id si disponible, sinon pbkdf2 werkzeug)"""
+    if _password_hasher is not None:
+        return _password_hasher.hash(password)
+    return generate_password_hash(password)
+
+
+def verifier_mot_de_passe(user, password):
+    """Vérifier le mot de passe d'un utilisateur
+
+    Les anciens hash pbkdf2 (ou argon2 aux paramètres obsolètes) sont re-hachés
+    à la volée ; le commit reste à la charge de l'appelant.
+    """
+    hash_actuel = user.password_hash
+    if hash_actuel and hash_actuel.startswith('$argon2'):
+        if _password_hasher is None:
+            return False
+        try:
+            _password_hasher.verify(hash_actuel, password)
+        except (VerificationError, InvalidHashError):
+            return False
+        if _password_hasher.check_needs_rehash(hash_actuel):
+            user.password_hash = _password_hasher.hash(password)
+        return True
+
+    if not check_password_hash(hash_actuel, password):
+        return False
+    if _password_hasher is not None:
+        user.password_hash = _password_hasher.hash(password)
+    return True
+
+
 # SECURITY: Simple in-memory rate limiting for login
 _login_attempts = {}  # {ip: [(timestamp, email), ...]}
 LOGIN_MAX_ATTEMPTS = 5
@@ -1434,14 +2127,13 @@ def login():
 
         user = Utilisateur.query.filter_by(email=email).first()
 
-        if user and user.actif and check_password_hash(user.password_hash, password):
+        if user and user.actif and verifier_mot_de_passe(user, password):
             clear_login_attempts(ip_address)  # Reset on success
             login_user(user, remember=request.form.get('remember'))
             user.derniere_connexion = datetime.utcnow()
             db.session.commit()
 
-            log_audit('utilisateurs', user.id, 'LOGIN')
-            db.session.commit()
+            log_audit_differe('utilisateurs', user.id, 'LOGIN')
 
             # SECURITY: Validate next parameter to prevent open redirect
             next_page = request.args.get('next')
@@ -1464,8 +2156,7 @@ def login():
         else:
             record_login_attempt(ip_address, email)
             flash('Email ou mot de passe incorrect.', 'danger')
-            log_audit('utilisateurs', None, 'LOGIN_FAILED', new_values={'email': email})
-            db.session.commit()
+            log_audit_differe('utilisateurs', None, 'LOGIN_FAILED', new_values={'email': email})
 
     return render_template('auth/login.html')
 
@@ -1492,8 +2183,8 @@ def portail():
 @login_required
 def logout():
     """Déconnexion"""
-    log_audit('utilisateurs', current_user.id, 'LOGOUT')
-    db.session.commit()
+    log_audit_differe('utilisateurs', current_user.id, 'LOGOUT')
+    oublier_utilisateur_charge(current_user.id)
     logout_user()
     flash('Vous avez été déconnecté.', 'info')
     return redirect(url_for('login'))
@@ -1523,7 +2214,7 @@ def nouveau_utilisateur():
                 email=email,
                 nom=request.form.get('nom'),
                 prenom=request.form.get('prenom'),
-                password_hash=generate_password_hash(request.form.get('password')),
+                password_hash=hacher_mot_de_passe(request.form.get('password')),
                 role=request.form.get('role', 'comptable'),
                 created_by=current_user.email
             )
@@ -1552,11 +2243,12 @@ def modifier_utilisateur(id):
         utilisateur.actif = request.form.get('actif') == 'on'
 
         if request.form.get('password'):
-            utilisateur.password_hash = generate_password_hash(request.form.get('password'))
+            utilisateur.password_hash = hacher_mot_de_passe(request.form.get('password'))
 
         new_values = {'email': utilisateur.email, 'role': utilisateur.role, 'actif': utilisateur.actif}
         log_audit('utilisateurs', id, 'UPDATE', old_values=old_values, new_values=new_values)
         db.session.commit()
+        oublier_utilisateur_charge(id)
 
         flash('Utilisateur modifié avec succès.', 'success')
         return redirect(url_for('liste_utilisateurs'))
@@ -1568,10 +2260,29 @@ def modifier_utilisateur(id):
 @login_required
 @role_required(['directeur', 'auditeur'])
 def audit_trail():
-    """Consulter le journal d'audit"""
-    page = request.args.get('page', 1, type=int)
-    logs = AuditLog.query.order_by(AuditLog.timestamp.desc()).paginate(page=page, per_page=50)
-    return render_template('admin/audit_trail.html', logs=logs)
+    """Consulter le journal d'audit
+
+    Pagination par clé sur (timestamp, id) : la page suivante part de la dernière
+    ligne affichée (?before_ts=...&before_id=...), sans OFFSET à parcourir.
+    """
+    par_page = 50
+    query = AuditLog.query
+    before_id = request.args.get('before_id', type=int)
+    try:
+        before_ts = datetime.fromisoformat(request.args.get('before_ts', ''))
+    except ValueError:
+        before_ts = None
+    if before_ts is not None and before_id is not None:
+        query = query.filter(tuple_(AuditLog.timestamp, AuditLog.id) < tuple_(before_ts, before_id))
+
+    logs = query.order_by(AuditLog.timestamp.desc(), AuditLog.id.desc()).limit(par_page + 1).all()
+    suivant = None
+    if len(logs) > par_page:
+        logs = logs[:par_page]
+        suivant = {'before_ts': logs[-1].timestamp.isoformat(), 'before_id': logs[-1].id}
+
+    return render_template('admin/audit_trail.html', logs=logs, suivant=suivant,
+                           premiere_page=before_ts is None)
 
 
 # =============================================================================
@@ -1582,14 +2293,16 @@ def audit_trail():
 @login_required
 def dashboard():
     """Tableau de bord principal"""
-    projets = Projet.query.filter_by(statut='actif').all()
-    bailleurs = Bailleur.query.filter_by(actif=True).all()
+    projets = Projet.query.options(joinedload(Projet.bailleur)).filter_by(statut='actif').all()
+    bailleurs = Bailleur.query.options(
+        selectinload(Bailleur.projets).load_only(Projet.id)
+    ).filter_by(actif=True).all()
 
-    # Statistiques améliorées
-    stats = calculer_stats_dashboard()
-
-    # Alertes
-    alertes = generer_alertes()
+    # Statistiques améliorées et alertes, recalculées seulement après une modification
+    # des données sous-jacentes (ou changement de jour : retards, écritures du mois)
+    jour = date.today().isoformat()
+    stats = cache_get_or_set(cle_cache_tableau_bord('stats', jour), calculer_stats_dashboard)
+    alertes = cache_get_or_set(cle_cache_tableau_bord('alertes', jour), generer_alertes)
 
     return render_template('dashboard.html',
                           projets=projets,
@@ -1689,7 +2402,11 @@ def api_category_distribution():
 @login_required
 def liste_bailleurs():
     """Liste des bailleurs"""
-    bailleurs = Bailleur.query.all()
+    # Devise et nombre de projets affichés par ligne : chargés en lot
+    bailleurs = Bailleur.query.options(
+        joinedload(Bailleur.devise),
+        selectinload(Bailleur.projets).load_only(Projet.id)
+    ).all()
     return render_template('bailleurs/liste.html', bailleurs=bailleurs)
 
 
@@ -1777,8 +2494,8 @@ def nouveau_financement():
             type_affectation=request.form.get('type_affectation', 'libre'),
             montant=Decimal(request.form['montant'].replace(',', '.').replace(' ', '')),
             devise_id=int(request.form['devise_id']) if request.form.get('devise_id') else None,
-            date_accord=datetime.strptime(request.form['date_accord'], '%Y-%m-%d').date() if request.form.get('date_accord') else None,
-            date_fin=datetime.strptime(request.form['date_fin'], '%Y-%m-%d').date() if request.form.get('date_fin') else None,
+            date_accord=date.fromisoformat(request.form['date_accord']) if request.form.get('date_accord') else None,
+            date_fin=date.fromisoformat(request.form['date_fin']) if request.form.get('date_fin') else None,
             notes=request.form.get('notes'),
             statut='actif'
         )
@@ -1803,17 +2520,17 @@ def nouveau_financement():
                     financement_id=financement.id,
                     numero=i,
                     montant_prevu=Decimal(montant_tranche.replace(',', '.').replace(' ', '')),
-                    date_prevue=datetime.strptime(date_tranche, '%Y-%m-%d').date() if date_tranche else None,
+                    date_prevue=date.fromisoformat(date_tranche) if date_tranche else None,
                     statut='attendu'
                 )
                 db.session.add(tranche)
 
-        db.session.commit()
         log_audit('financement', financement.id, 'CREATE', new_values={
             'reference': financement.reference,
             'bailleur': financement.bailleur.nom,
             'montant': str(financement.montant)
         })
+        db.session.commit()
 
         flash(f'Financement "{financement.reference}" créé avec succès', 'success')
         return redirect(url_for('detail_financement', id=financement.id))
@@ -1850,8 +2567,8 @@ def modifier_financement(id):
         financement.type_affectation = request.form.get('type_affectation', 'libre')
         financement.montant = Decimal(request.form['montant'].replace(',', '.').replace(' ', ''))
         financement.devise_id = int(request.form['devise_id']) if request.form.get('devise_id') else None
-        financement.date_accord = datetime.strptime(request.form['date_accord'], '%Y-%m-%d').date() if request.form.get('date_accord') else None
-        financement.date_fin = datetime.strptime(request.form['date_fin'], '%Y-%m-%d').date() if request.form.get('date_fin') else None
+        financement.date_accord = date.fromisoformat(request.form['date_accord']) if request.form.get('date_accord') else None
+        financement.date_fin = date.fromisoformat(request.form['date_fin']) if request.form.get('date_fin') else None
         financement.notes = request.form.get('notes')
         financement.statut = request.form.get('statut', 'actif')
 
@@ -1866,8 +2583,8 @@ def modifier_financement(id):
             financement.projet_id = None
             financement.affectation_libelle = None
 
-        db.session.commit()
         log_audit('financement', financement.id, 'UPDATE')
+        db.session.commit()
 
         flash('Financement modifié avec succès', 'success')
         return redirect(url_for('detail_financement', id=financement.id))
@@ -1920,7 +2637,7 @@ def ajouter_tranche(id):
         financement_id=financement.id,
         numero=dernier_numero + 1,
         montant_prevu=Decimal(request.form['montant_prevu'].replace(',', '.').replace(' ', '')),
-        date_prevue=datetime.strptime(request.form['date_prevue'], '%Y-%m-%d').date() if request.form.get('date_prevue') else None,
+        date_prevue=date.fromisoformat(request.form['date_prevue']) if request.form.get('date_prevue') else None,
         statut='attendu'
     )
 
@@ -1944,7 +2661,7 @@ def recevoir_tranche(id):
     else:
         tranche.montant_recu = tranche.montant_prevu
 
-    tranche.date_reception = datetime.strptime(request.form['date_reception'], '%Y-%m-%d').date() if request.form.get('date_reception') else date.today()
+    tranche.date_reception = date.fromisoformat(request.form['date_reception']) if request.form.get('date_reception') else date.today()
 
     # Statut: recu si montant complet, partiel sinon
     if tranche.montant_recu >= tranche.montant_prevu:
@@ -1952,12 +2669,11 @@ def recevoir_tranche(id):
     else:
         tranche.statut = 'partiel'
 
-    db.session.commit()
-
     log_audit('tranche_financement', tranche.id, 'RECEPTION', new_values={
         'financement': tranche.financement.reference,
         'montant_recu': str(tranche.montant_recu)
     })
+    db.session.commit()
 
     flash(f'Tranche {tranche.numero} marquée comme reçue ({tranche.montant_recu})', 'success')
     return redirect(url_for('detail_financement', id=tranche.financement_id))
@@ -2008,19 +2724,21 @@ def tableau_bord_revenus():
             'recu': sum(f.montant_recu for f in fins)
         }
 
+    today = date.today()
+
     # Tranches en retard
     tranches_retard = TrancheFinancement.query.join(Financement).filter(
         Financement.statut == 'actif',
         TrancheFinancement.statut.in_(['attendu', 'retard']),
-        TrancheFinancement.date_prevue < date.today()
+        TrancheFinancement.date_prevue < today
     ).all()
 
     # Prochaines tranches attendues (30 jours)
-    date_limite = date.today() + timedelta(days=30)
+    date_limite = today + timedelta(days=30)
     prochaines_tranches = TrancheFinancement.query.join(Financement).filter(
         Financement.statut == 'actif',
         TrancheFinancement.statut == 'attendu',
-        TrancheFinancement.date_prevue >= date.today(),
+        TrancheFinancement.date_prevue >= today,
         TrancheFinancement.date_prevue <= date_limite
     ).order_by(TrancheFinancement.date_prevue).all()
 
@@ -2053,7 +2771,7 @@ def tableau_bord_revenus():
 @login_required
 def liste_projets():
     """Liste des projets"""
-    projets = Projet.query.all()
+    projets = Projet.query.options(joinedload(Projet.bailleur), joinedload(Projet.devise)).all()
     return render_template('projets/liste.html', projets=projets)
 
 
@@ -2071,8 +2789,8 @@ def nouveau_projet():
             nom=request.form['nom'],
             description=request.form.get('description'),
             bailleur_id=request.form.get('bailleur_id') or None,
-            date_debut=datetime.strptime(request.form['date_debut'], '%Y-%m-%d').date() if request.form.get('date_debut') else None,
-            date_fin=datetime.strptime(request.form['date_fin'], '%Y-%m-%d').date() if request.form.get('date_fin') else None,
+            date_debut=date.fromisoformat(request.form['date_debut']) if request.form.get('date_debut') else None,
+            date_fin=date.fromisoformat(request.form['date_fin']) if request.form.get('date_fin') else None,
             budget_total=request.form.get('budget_total') or 0,
             devise_id=request.form.get('devise_id') or None
         )
@@ -2287,8 +3005,15 @@ def plan_comptable():
 @login_required
 def liste_ecritures():
     """Liste des écritures comptables avec filtres et pagination"""
-    # Base query
-    query = PieceComptable.query
+    # Base query : journal et lignes (compte, projet, ligne budgétaire) chargés avec la page
+    query = PieceComptable.query.options(
+        joinedload(PieceComptable.journal),
+        selectinload(PieceComptable.lignes).options(
+            joinedload(LigneEcriture.compte),
+            joinedload(LigneEcriture.projet),
+            joinedload(LigneEcriture.ligne_budget)
+        )
+    )
 
     # Filtre par exercice
     exercice_id = request.args.get('exercice_id', type=int)
@@ -2344,21 +3069,14 @@ def liste_ecritures():
 @role_required(['comptable', 'directeur'])
 def nouvelle_ecriture():
     """Saisir une nouvelle écriture - Mode simplifié ou expert"""
-    journaux = Journal.query.all()
-    exercices = ExerciceComptable.query.filter_by(cloture=False).all()
-    comptes = CompteComptable.query.filter_by(actif=True).order_by(CompteComptable.numero).all()
-    projets = Projet.query.filter_by(statut='actif').all()
-    devises = Devise.query.all()
-
     if request.method == 'POST':
         operation_type = request.form.get('operation_type', 'expert')
 
         # Générer numéro de pièce
-        dernier = PieceComptable.query.order_by(PieceComptable.id.desc()).first()
-        numero = f"PC{datetime.now().year}{(dernier.id + 1 if dernier else 1):05d}"
+        numero = prochain_numero_piece()
 
         # Trouver l'exercice actif
-        exercice = ExerciceComptable.query.filter_by(cloture=False).first()
+        exercice = get_exercice_ouvert()
         if not exercice:
             flash("Aucun exercice comptable ouvert.", "danger")
             return redirect(url_for('nouvelle_ecriture'))
@@ -2373,7 +3091,7 @@ def nouvelle_ecriture():
                 return redirect(url_for('nouvelle_ecriture'))
 
             try:
-                date_piece = datetime.strptime(request.form['date_piece'], '%Y-%m-%d').date()
+                date_piece = date.fromisoformat(request.form['date_piece'])
             except ValueError:
                 flash('Format de date invalide.', 'danger')
                 return redirect(url_for('nouvelle_ecriture'))
@@ -2391,7 +3109,7 @@ def nouvelle_ecriture():
             journal_codes = {'depense': 'AC', 'recette': 'BQ', 'virement': 'OD', 'avance': 'CA'}
             journal = Journal.query.filter(Journal.code.like(f"{journal_codes.get(operation_type, 'OD')}%")).first()
             if not journal:
-                journal = journaux[0] if journaux else None
+                journal = Journal.query.first()
 
             piece = PieceComptable(
                 numero=numero,
@@ -2421,7 +3139,6 @@ def nouvelle_ecriture():
                     ligne_budget_id=ligne_budget_id
                 )
                 db.session.add(ligne_debit)
-                db.session.flush()
 
                 # Traiter ventilation multi-projets
                 ventilation_data = request.form.get('ventilation')
@@ -2439,7 +3156,7 @@ def nouvelle_ecriture():
                                     continue
                                 pct = Decimal(str(v['pourcentage']))
                                 imputation = ImputationAnalytique(
-                                    ligne_ecriture_id=ligne_debit.id,
+                                    ligne_ecriture=ligne_debit,
                                     projet_id=int(v['projet_id']),
                                     pourcentage=pct,
                                     montant=montant * pct / 100
@@ -2593,7 +3310,6 @@ def nouvelle_ecriture():
                     credit=0
                 )
                 db.session.add(ligne_salaires)
-                db.session.flush()
 
                 # Traiter ventilation multi-projets sur les salaires
                 ventilation_data = request.form.get('ventilation')
@@ -2603,7 +3319,7 @@ def nouvelle_ecriture():
                         if ventilations:
                             for v in ventilations:
                                 imputation = ImputationAnalytique(
-                                    ligne_ecriture_id=ligne_salaires.id,
+                                    ligne_ecriture=ligne_salaires,
                                     projet_id=int(v['projet_id']),
                                     pourcentage=Decimal(str(v['pourcentage'])),
                                     montant=Decimal(str(salaires_bruts * v['pourcentage'] / 100))
@@ -2657,7 +3373,7 @@ def nouvelle_ecriture():
         else:
             # SECURITY: Validate exercise is open and date is within bounds
             try:
-                date_piece = datetime.strptime(request.form['date_piece'], '%Y-%m-%d').date()
+                date_piece = date.fromisoformat(request.form['date_piece'])
             except ValueError:
                 flash('Format de date invalide.', 'danger')
                 return redirect(url_for('nouvelle_ecriture'))
@@ -2691,28 +3407,26 @@ def nouvelle_ecriture():
                 taux_change=request.form.get('taux_change') or 1
             )
             db.session.add(piece)
-            db.session.flush()
 
-            # Ajouter les lignes
+            # Ajouter les lignes : rattachées à la pièce en mémoire, insérées en un
+            # seul lot au commit avec elle (pas de flush intermédiaire)
             comptes_ids = request.form.getlist('compte_id[]')
             projets_ids = request.form.getlist('projet_id[]')
             debits = request.form.getlist('debit[]')
             credits = request.form.getlist('credit[]')
 
-            for i in range(len(comptes_ids)):
-                if comptes_ids[i]:
-                    ligne = LigneEcriture(
-                        piece_id=piece.id,
-                        compte_id=comptes_ids[i],
-                        projet_id=projets_ids[i] if i < len(projets_ids) and projets_ids[i] else None,
-                        libelle=request.form.get('libelle', ''),
-                        debit=float(debits[i]) if debits[i] else 0,
-                        credit=float(credits[i]) if credits[i] else 0
-                    )
-                    db.session.add(ligne)
+            piece.lignes = [
+                LigneEcriture(
+                    compte_id=comptes_ids[i],
+                    projet_id=projets_ids[i] if i < len(projets_ids) and projets_ids[i] else None,
+                    libelle=request.form.get('libelle', ''),
+                    debit=Decimal(debits[i] or 0),
+                    credit=Decimal(credits[i] or 0)
+                )
+                for i in range(len(comptes_ids)) if comptes_ids[i]
+            ]
 
-            # VALIDATION SYSCOHADA : Vérifier équilibre Débit = Crédit
-            db.session.flush()
+            # VALIDATION SYSCOHADA : Vérifier équilibre Débit = Crédit (avant toute écriture en base)
             if not piece.est_equilibree:
                 db.session.rollback()
                 flash("Écriture déséquilibrée - Total Débit ≠ Total Crédit. L'écriture n'a pas été enregistrée.", "danger")
@@ -2722,16 +3436,10 @@ def nouvelle_ecriture():
             flash(f'Écriture {numero} créée avec succès', 'success')
             return redirect(url_for('liste_ecritures'))
 
-    # Charger les lignes budgétaires pour le suivi budget
-    lignes_budget = LigneBudget.query.join(Projet).filter(Projet.statut == 'actif').all()
-
+    # Listes de référence (mises en cache), lignes budgétaires des projets actifs pour le suivi budget
     return render_template('comptabilite/ecriture_form.html',
-                         journaux=journaux,
-                         exercices=exercices,
-                         comptes=comptes,
-                         projets=projets,
-                         devises=devises,
-                         lignes_budget=lignes_budget,
+                         **referentiels_saisie(),
+                         lignes_budget=referentiel_lignes_budget(projets_actifs=True),
                          today=date.today().strftime('%Y-%m-%d'))
 
 
@@ -2739,7 +3447,17 @@ def nouvelle_ecriture():
 @login_required
 def detail_ecriture(id):
     """Détail d'une écriture comptable"""
-    piece = PieceComptable.query.get_or_404(id)
+    piece = PieceComptable.query.options(
+        joinedload(PieceComptable.journal),
+        joinedload(PieceComptable.exercice),
+        joinedload(PieceComptable.devise),
+        selectinload(PieceComptable.pieces_justificatives),
+        selectinload(PieceComptable.lignes).options(
+            joinedload(LigneEcriture.compte),
+            joinedload(LigneEcriture.projet),
+            selectinload(LigneEcriture.imputations_analytiques).joinedload(ImputationAnalytique.projet)
+        )
+    ).filter_by(id=id).first_or_404()
     return render_template('comptabilite/ecriture_detail.html', piece=piece)
 
 
@@ -2759,13 +3477,6 @@ def modifier_ecriture(id):
         flash('Impossible de modifier une écriture sur un exercice clôturé.', 'danger')
         return redirect(url_for('detail_ecriture', id=id))
 
-    journaux = Journal.query.all()
-    exercices = ExerciceComptable.query.filter_by(cloture=False).all()
-    comptes = CompteComptable.query.filter_by(actif=True).order_by(CompteComptable.numero).all()
-    projets = Projet.query.filter_by(statut='actif').all()
-    devises = Devise.query.all()
-    lignes_budget = LigneBudget.query.all()
-
     if request.method == 'POST':
         # Store old values for audit
         old_values = {
@@ -2776,7 +3487,7 @@ def modifier_ecriture(id):
 
         # Parse and validate date
         try:
-            new_date = datetime.strptime(request.form['date_piece'], '%Y-%m-%d').date()
+            new_date = date.fromisoformat(request.form['date_piece'])
         except ValueError:
             flash('Format de date invalide.', 'danger')
             return redirect(url_for('modifier_ecriture', id=id))
@@ -2799,18 +3510,16 @@ def modifier_ecriture(id):
 
         # Update piece
         piece.date_piece = new_date
-        piece.journal_id = request.form['journal_id']
-        piece.exercice_id = new_exercice_id
+        piece.journal_id = int(request.form['journal_id'])
+        piece.exercice_id = new_exercice.id
         piece.libelle = request.form['libelle']
         piece.reference = request.form.get('reference')
-        piece.devise_id = request.form.get('devise_id') or None
-        piece.taux_change = request.form.get('taux_change') or 1
-
-        # Delete existing lines
-        for ligne in piece.lignes:
-            db.session.delete(ligne)
+        piece.devise_id = int(request.form['devise_id']) if request.form.get('devise_id') else None
+        piece.taux_change = Decimal(request.form.get('taux_change') or 1)
 
-        # Add new lines
+        # Diff des lignes soumises avec les lignes existantes (clé : champ caché ligne_id[]) :
+        # mise à jour sur place, insertion des nouvelles, suppression (delete-orphan) des retirées
+        ligne_ids = request.form.getlist('ligne_id[]')
         comptes_ids = request.form.getlist('compte_id[]')
         projets_ids = request.form.getlist('projet_id[]')
         libelles = request.form.getlist('ligne_libelle[]')
@@ -2818,21 +3527,26 @@ def modifier_ecriture(id):
         credits = request.form.getlist('credit[]')
         lignes_budget_ids = request.form.getlist('ligne_budget_id[]')
 
+        existantes = {ligne.id: ligne for ligne in piece.lignes}
+        lignes = []
         for i in range(len(comptes_ids)):
-            if comptes_ids[i]:
-                ligne = LigneEcriture(
-                    piece_id=piece.id,
-                    compte_id=comptes_ids[i],
-                    projet_id=projets_ids[i] if projets_ids[i] else None,
-                    libelle=libelles[i] if i < len(libelles) else '',
-                    debit=Decimal(debits[i] or 0),
-                    credit=Decimal(credits[i] or 0),
-                    ligne_budget_id=lignes_budget_ids[i] if i < len(lignes_budget_ids) and lignes_budget_ids[i] else None
-                )
-                db.session.add(ligne)
-
-        # Validate balance
-        db.session.flush()
+            if not comptes_ids[i]:
+                continue
+            ligne_id = ligne_ids[i] if i < len(ligne_ids) else ''
+            ligne = existantes.pop(int(ligne_id), None) if ligne_id.isdigit() else None
+            if ligne is None:
+                ligne = LigneEcriture()
+            # Valeurs typées comme en base : un champ inchangé ne produit pas d'UPDATE
+            ligne.compte_id = int(comptes_ids[i])
+            ligne.projet_id = int(projets_ids[i]) if projets_ids[i] else None
+            ligne.libelle = libelles[i] if i < len(libelles) else ''
+            ligne.debit = Decimal(debits[i] or 0)
+            ligne.credit = Decimal(credits[i] or 0)
+            ligne.ligne_budget_id = int(lignes_budget_ids[i]) if i < len(lignes_budget_ids) and lignes_budget_ids[i] else None
+            lignes.append(ligne)
+        piece.lignes = lignes
+
+        # Validate balance (new lines, in memory)
         if not piece.est_equilibree:
             db.session.rollback()
             flash("Écriture déséquilibrée - Total Débit ≠ Total Crédit.", "danger")
@@ -2852,12 +3566,8 @@ def modifier_ecriture(id):
 
     return render_template('comptabilite/ecriture_edit.html',
                            piece=piece,
-                           journaux=journaux,
-                           exercices=exercices,
-                           comptes=comptes,
-                           projets=projets,
-                           devises=devises,
-                           lignes_budget=lignes_budget)
+                           **referentiels_saisie(),
+                           lignes_budget=referentiel_lignes_budget())
 
 
 @app.route('/comptabilite/ecritures/<int:id>/valider', methods=['POST'])
@@ -2915,14 +3625,13 @@ def dupliquer_ecriture(id):
     piece_origine = PieceComptable.query.get_or_404(id)
 
     # Vérifier qu'un exercice est ouvert
-    exercice = ExerciceComptable.query.filter_by(cloture=False).first()
+    exercice = get_exercice_ouvert()
     if not exercice:
         flash('Aucun exercice ouvert. Impossible de dupliquer.', 'danger')
         return redirect(url_for('detail_ecriture', id=id))
 
     # Générer nouveau numéro
-    dernier = PieceComptable.query.order_by(PieceComptable.id.desc()).first()
-    numero = f"PC{datetime.now().year}{(dernier.id + 1 if dernier else 1):05d}"
+    numero = prochain_numero_piece()
 
     # Créer la nouvelle pièce
     nouvelle_piece = PieceComptable(
@@ -2964,10 +3673,9 @@ def dupliquer_ecriture(id):
                 )
                 db.session.add(nouvelle_imp)
 
-    db.session.commit()
-
     log_audit('pieces', nouvelle_piece.id, 'CREATE',
               new_values={'duplique_de': piece_origine.numero})
+    db.session.commit()
 
     flash(f'Écriture dupliquée avec succès. Nouvelle écriture: {numero}', 'success')
     return redirect(url_for('modifier_ecriture', id=nouvelle_piece.id))
@@ -2978,15 +3686,21 @@ def dupliquer_ecriture(id):
 @role_required(['directeur'])
 def valider_lot_ecritures():
     """Valider plusieurs écritures en lot"""
-    ids = request.form.getlist('piece_ids')
-    count = 0
-
-    for piece_id in ids:
-        piece = PieceComptable.query.get(piece_id)
-        if piece and not piece.valide and piece.est_equilibree:
-            piece.valide = True
-            log_audit('pieces', piece.id, 'VALIDATE', new_values={'valide': True})
-            count += 1
+    ids = request.form.getlist('piece_ids', type=int)
+
+    # Un seul UPDATE pour le lot, équilibre vérifié en SQL : seules les pièces
+    # non validées et équilibrées sont modifiées, sans charger pièces ni lignes
+    valides = db.session.execute(
+        db.update(PieceComptable).where(
+            PieceComptable.id.in_(ids),
+            PieceComptable.valide == False,
+            PieceComptable.est_equilibree
+        ).values(valide=True).returning(PieceComptable.id),
+        execution_options={'synchronize_session': False}
+    ).scalars().all() if ids else []
+    for piece_id in valides:
+        log_audit('pieces', piece_id, 'VALIDATE', new_values={'valide': True})
+    count = len(valides)
 
     db.session.commit()
     flash(f'{count} écriture(s) validée(s) avec succès.', 'success')
@@ -2997,17 +3711,47 @@ def valider_lot_ecritures():
 # ROUTES - PIECES JUSTIFICATIVES
 # =============================================================================
 
-ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'gif'}
+ALLOWED_EXTENSIONS = frozenset({'pdf', 'png', 'jpg', 'jpeg', 'gif'})
+
+def extension_fichier(filename):
+    """Extension en minuscules, sans le point ('' si absente)"""
+    return os.path.splitext(filename)[1][1:].lower()
+
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return extension_fichier(filename) in ALLOWED_EXTENSIONS
+
+
+def enregistrer_fichier(fichier, filepath, taille_bloc=65536):
+    """Écrire un fichier uploadé par blocs et retourner son empreinte SHA-256
+
+    Une seule passe sur le flux : mémoire constante quelle que soit la taille du fichier.
+    """
+    empreinte = hashlib.sha256()
+    with open(filepath, 'wb') as sortie:
+        while bloc := fichier.stream.read(taille_bloc):
+            sortie.write(bloc)
+            empreinte.update(bloc)
+    return empreinte.hexdigest()
+
+
+# Dossiers d'upload déjà créés par ce processus (évite un makedirs à chaque upload)
+_ensured_dirs = set()
+
+def ensure_upload_dir(path):
+    """Crée le dossier d'upload une seule fois par processus"""
+    if path not in _ensured_dirs:
+        os.makedirs(path, exist_ok=True)
+        _ensured_dirs.add(path)
 
 
 @app.route('/comptabilite/ecritures/<int:id>/pieces-justificatives')
 @login_required
 def liste_pieces_justificatives(id):
     """Liste des pièces justificatives d'une écriture"""
-    piece = PieceComptable.query.get_or_404(id)
+    piece = PieceComptable.query.options(
+        selectinload(PieceComptable.pieces_justificatives)
+    ).filter_by(id=id).first_or_404()
     return render_template('comptabilite/pieces_justificatives.html', piece=piece)
 
 
@@ -3031,18 +3775,23 @@ def upload_piece_justificative(id):
     if fichier and allowed_file(fichier.filename):
         # Créer un nom de fichier sécurisé
         filename = secure_filename(fichier.filename)
-        # Ajouter un timestamp pour éviter les doublons
+        # Timestamp + suffixe aléatoire : deux uploads simultanés n'écrivent jamais le même fichier
         timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        filename = f"{piece.numero}_{timestamp}_{filename}"
+        filename = f"{piece.numero}_{timestamp}_{secrets.token_hex(4)}_{filename}"
 
         # Créer le dossier par année/mois si nécessaire
         year_month = piece.date_piece.strftime('%Y/%m')
         upload_path = os.path.join(app.config['UPLOAD_FOLDER'], year_month)
-        os.makedirs(upload_path, exist_ok=True)
+        ensure_upload_dir(upload_path)
 
-        # Sauvegarder le fichier
+        # Sauvegarder le fichier (empreinte calculée pendant l'écriture)
         filepath = os.path.join(upload_path, filename)
-        fichier.save(filepath)
+        fichier_hash = enregistrer_fichier(fichier, filepath)
+
+        if PieceJustificative.query.filter_by(piece_comptable_id=piece.id, fichier_hash=fichier_hash).first():
+            os.remove(filepath)
+            flash('Ce document est déjà attaché à cette écriture.', 'warning')
+            return redirect(url_for('detail_ecriture', id=id))
 
         # Créer l'enregistrement en base
         pj = PieceJustificative(
@@ -3051,13 +3800,21 @@ def upload_piece_justificative(id):
             numero_piece=request.form.get('numero_piece'),
             fichier_path=os.path.join(year_month, filename),
             fichier_nom=fichier.filename,
-            date_piece=datetime.strptime(request.form.get('date_piece'), '%Y-%m-%d').date() if request.form.get('date_piece') else None,
+            fichier_hash=fichier_hash,
+            date_piece=date.fromisoformat(request.form.get('date_piece')) if request.form.get('date_piece') else None,
             description=request.form.get('description'),
             uploaded_by=current_user.email
         )
         db.session.add(pj)
         log_audit('pieces_justificatives', None, 'CREATE', new_values={'fichier': filename, 'piece_id': piece.id})
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Même document envoyé en parallèle : l'index ix_pj_piece_hash a retenu l'autre upload
+            db.session.rollback()
+            os.remove(filepath)
+            flash('Ce document est déjà attaché à cette écriture.', 'warning')
+            return redirect(url_for('detail_ecriture', id=id))
 
         flash('Pièce justificative ajoutée avec succès.', 'success')
     else:
@@ -3066,6 +3823,21 @@ def upload_piece_justificative(id):
     return redirect(url_for('detail_ecriture', id=id))
 
 
+def servir_upload(real_path, clean_filename):
+    """Réponse de téléchargement d'un fichier uploadé, l'accès étant déjà vérifié
+
+    Avec UPLOADS_ACCEL_PREFIX, nginx envoie le fichier lui-même (X-Accel-Redirect,
+    sendfile) sans qu'il transite par Python. Sinon send_file avec ETag : un
+    fichier déjà téléchargé est servi en 304.
+    """
+    prefixe = app.config.get('UPLOADS_ACCEL_PREFIX')
+    if prefixe:
+        response = Response(mimetype=mimetypes.guess_type(real_path)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = prefixe.rstrip('/') + '/' + quote(clean_filename.replace(os.sep, '/'))
+        return response
+    return send_file(real_path, conditional=True, etag=True)
+
+
 @app.route('/uploads/<path:filename>')
 @login_required
 def uploaded_file(filename):
@@ -3096,7 +3868,7 @@ def uploaded_file(filename):
     # SECURITY: Verify user has access to this file (IDOR protection)
     # Privileged roles can access all files
     if current_user.role in ['comptable', 'directeur', 'auditeur']:
-        return send_file(real_path)
+        return servir_upload(real_path, clean_filename)
 
     # For regular users, verify they own the associated record
     # Check if this is a PieceJustificative they have access to
@@ -3109,7 +3881,7 @@ def uploaded_file(filename):
     # Check if this is a NoteFrais attachment they own
     note = NoteFrais.query.filter_by(justificatif=clean_filename).first()
     if note and note.employe_id == current_user.id:
-        return send_file(real_path)
+        return servir_upload(real_path, clean_filename)
 
     # No matching record or no access
     flash('Accès non autorisé à ce document.', 'danger')
@@ -3153,10 +3925,29 @@ def supprimer_piece_justificative(id):
 @login_required
 def liste_reconciliations():
     """Liste des réconciliations bancaires"""
-    reconciliations = ReconciliationBancaire.query.order_by(
+    page = request.args.get('page', 1, type=int)
+    # Ne charger que les colonnes affichées (pas les notes) et le compte en une jointure
+    pagination = ReconciliationBancaire.query.options(
+        load_only(
+            ReconciliationBancaire.id,
+            ReconciliationBancaire.compte_id,
+            ReconciliationBancaire.date_reconciliation,
+            ReconciliationBancaire.periode_debut,
+            ReconciliationBancaire.periode_fin,
+            ReconciliationBancaire.solde_releve,
+            ReconciliationBancaire.solde_comptable,
+            ReconciliationBancaire.ecart,
+            ReconciliationBancaire.statut
+        ),
+        joinedload(ReconciliationBancaire.compte).load_only(
+            CompteComptable.numero, CompteComptable.intitule
+        )
+    ).order_by(
         ReconciliationBancaire.date_reconciliation.desc()
-    ).all()
-    return render_template('comptabilite/reconciliations.html', reconciliations=reconciliations)
+    ).paginate(page=page, per_page=50, error_out=False)
+    return render_template('comptabilite/reconciliations.html',
+                          reconciliations=pagination.items,
+                          pagination=pagination)
 
 
 @app.route('/comptabilite/reconciliation-bancaire/nouvelle', methods=['GET', 'POST'])
@@ -3172,8 +3963,8 @@ def nouvelle_reconciliation():
 
     if request.method == 'POST':
         compte_id = request.form.get('compte_id')
-        periode_debut = datetime.strptime(request.form.get('periode_debut'), '%Y-%m-%d').date()
-        periode_fin = datetime.strptime(request.form.get('periode_fin'), '%Y-%m-%d').date()
+        periode_debut = date.fromisoformat(request.form.get('periode_debut'))
+        periode_fin = date.fromisoformat(request.form.get('periode_fin'))
         solde_releve = Decimal(request.form.get('solde_releve', '0'))
 
         # Calculer le solde comptable
@@ -3342,13 +4133,16 @@ def liste_avances():
     if beneficiaire:
         query = query.filter(Avance.beneficiaire.ilike(f'%{beneficiaire}%'))
 
-    avances = query.order_by(Avance.date_avance.desc()).all()
+    # Compter les avances en retard (sur l'ensemble filtré, pas seulement la page)
+    nb_retard = query.filter(Avance.est_en_retard).count()
 
-    # Compter les avances en retard
-    nb_retard = sum(1 for a in avances if a.est_en_retard)
+    # Pagination (50 par page)
+    page = request.args.get('page', 1, type=int)
+    pagination = query.order_by(Avance.date_avance.desc()).paginate(page=page, per_page=50, error_out=False)
 
     return render_template('comptabilite/avances.html',
-                          avances=avances,
+                          avances=pagination.items,
+                          pagination=pagination,
                           nb_retard=nb_retard)
 
 
@@ -3364,7 +4158,7 @@ def nouvelle_avance():
         derniere = Avance.query.order_by(Avance.id.desc()).first()
         numero = f"AV{datetime.now().year}{(derniere.id + 1 if derniere else 1):04d}"
 
-        date_avance = datetime.strptime(request.form.get('date_avance'), '%Y-%m-%d').date()
+        date_avance = date.fromisoformat(request.form.get('date_avance'))
 
         avance = Avance(
             numero=numero,
@@ -3575,17 +4369,17 @@ def pdf_inventaire_immobilisations():
         Immobilisation.statut == 'actif'
     ).order_by(Immobilisation.categorie, Immobilisation.code).all()
 
-    # Grouper par catégorie
+    # Grouper par catégorie et totaliser en une seule passe (en Decimal)
     immobilisations_par_categorie = {}
+    total_acquisition = total_amortissement = total_vnc = Decimal(0)
     for immo in immobilisations:
         cat = immo.categorie or 'Autre'
         if cat not in immobilisations_par_categorie:
             immobilisations_par_categorie[cat] = []
         immobilisations_par_categorie[cat].append(immo)
-
-    total_acquisition = sum(float(i.valeur_acquisition or 0) for i in immobilisations)
-    total_amortissement = sum(i.cumul_amortissement for i in immobilisations)
-    total_vnc = sum(i.valeur_nette_comptable for i in immobilisations)
+        total_acquisition += immo.valeur_acquisition or 0
+        total_amortissement += immo.cumul_amortissement or 0
+        total_vnc += immo.valeur_nette_comptable or 0
 
     today = date.today()
 
@@ -3674,7 +4468,9 @@ def pdf_certificat_non_facture():
 @role_required(['comptable', 'directeur'])
 def liste_journaux():
     """Liste des journaux comptables"""
-    journaux = Journal.query.order_by(Journal.code).all()
+    page = request.args.get('page', 1, type=int)
+    pagination = Journal.query.order_by(Journal.code).paginate(page=page, per_page=50, error_out=False)
+    journaux = pagination.items
 
     # Comptes de trésorerie pour l'affichage
     comptes_tresorerie = CompteComptable.query.filter(
@@ -3684,6 +4480,7 @@ def liste_journaux():
 
     return render_template('admin/journaux.html',
                           journaux=journaux,
+                          pagination=pagination,
                           comptes_tresorerie=comptes_tresorerie)
 
 
@@ -3842,7 +4639,7 @@ def details_compte_tresorerie(id):
         details.devise_id = request.form.get('devise_id') or None
         details.solde_ouverture = request.form.get('solde_ouverture') or 0
         if request.form.get('date_ouverture'):
-            details.date_ouverture = datetime.strptime(request.form['date_ouverture'], '%Y-%m-%d').date()
+            details.date_ouverture = date.fromisoformat(request.form['date_ouverture'])
         details.plafond = request.form.get('plafond') or None
         details.notes = request.form.get('notes')
 
@@ -3926,6 +4723,23 @@ def nouveau_compte_tresorerie():
 # ROUTES - FOURNISSEURS
 # =============================================================================
 
+def get_categories_fournisseurs():
+    """Catégories distinctes des fournisseurs actifs"""
+    categories = db.session.query(Fournisseur.categorie).filter(
+        Fournisseur.categorie.isnot(None),
+        Fournisseur.actif == True
+    ).distinct().all()
+    return [c[0] for c in categories if c[0]]
+
+
+def invalider_cache_fournisseurs():
+    """Invalider les catégories et les recherches de fournisseurs en cache"""
+    if cache is not None:
+        cache.delete('fournisseurs:categories')
+    # Les clés de recherche incluent cette génération : l'incrémenter les périme toutes
+    incrementer_generation('fournisseurs:generation')
+
+
 @app.route('/fournisseurs')
 @login_required
 def liste_fournisseurs():
@@ -3945,17 +4759,16 @@ def liste_fournisseurs():
             )
         )
 
-    fournisseurs = query.order_by(Fournisseur.nom).all()
+    # Pagination (50 par page)
+    page = request.args.get('page', 1, type=int)
+    pagination = query.order_by(Fournisseur.nom).paginate(page=page, per_page=50, error_out=False)
 
     # Catégories disponibles
-    categories = db.session.query(Fournisseur.categorie).filter(
-        Fournisseur.categorie.isnot(None),
-        Fournisseur.actif == True
-    ).distinct().all()
-    categories = [c[0] for c in categories if c[0]]
+    categories = cache_get_or_set('fournisseurs:categories', get_categories_fournisseurs)
 
     return render_template('fournisseurs/liste.html',
-                          fournisseurs=fournisseurs,
+                          fournisseurs=pagination.items,
+                          pagination=pagination,
                           categories=categories)
 
 
@@ -3964,16 +4777,9 @@ def liste_fournisseurs():
 @role_required(['comptable', 'directeur'])
 def nouveau_fournisseur():
     """Créer un nouveau fournisseur"""
-    comptes_401 = CompteComptable.query.filter(
-        CompteComptable.numero.like('401%'),
-        CompteComptable.actif == True
-    ).order_by(CompteComptable.numero).all()
-
     if request.method == 'POST':
         # Générer code
-        dernier = Fournisseur.query.order_by(Fournisseur.id.desc()).first()
-        numero = (dernier.id + 1) if dernier else 1
-        code = f"FRN{numero:03d}"
+        code = f"FRN{prochain_id(Fournisseur):03d}"
 
         fournisseur = Fournisseur(
             code=code,
@@ -3991,13 +4797,22 @@ def nouveau_fournisseur():
         )
 
         db.session.add(fournisseur)
-        db.session.commit()
-
+        db.session.flush()
         log_audit('fournisseurs', fournisseur.id, 'CREATE', None, {'nom': fournisseur.nom})
+        db.session.commit()
+        invalider_cache_fournisseurs()
 
         flash(f'Fournisseur {fournisseur.nom} créé avec succès.', 'success')
         return redirect(url_for('liste_fournisseurs'))
 
+    # Listes du formulaire (GET uniquement)
+    comptes_401 = CompteComptable.query.options(
+        load_only(CompteComptable.id, CompteComptable.numero, CompteComptable.intitule)
+    ).filter(
+        CompteComptable.numero.like('401%'),
+        CompteComptable.actif == True
+    ).order_by(CompteComptable.numero).all()
+
     return render_template('fournisseurs/form.html', fournisseur=None, comptes_401=comptes_401)
 
 
@@ -4007,32 +4822,36 @@ def nouveau_fournisseur():
 def modifier_fournisseur(id):
     """Modifier un fournisseur"""
     fournisseur = Fournisseur.query.get_or_404(id)
-    comptes_401 = CompteComptable.query.filter(
-        CompteComptable.numero.like('401%'),
-        CompteComptable.actif == True
-    ).order_by(CompteComptable.numero).all()
-
     if request.method == 'POST':
-        old_values = {'nom': fournisseur.nom}
-
-        fournisseur.nom = request.form.get('nom')
-        fournisseur.categorie = request.form.get('categorie')
-        fournisseur.contact = request.form.get('contact')
-        fournisseur.telephone = request.form.get('telephone')
-        fournisseur.email = request.form.get('email')
-        fournisseur.adresse = request.form.get('adresse')
-        fournisseur.ville = request.form.get('ville')
-        fournisseur.ninea = request.form.get('ninea')
-        fournisseur.compte_comptable_id = request.form.get('compte_comptable_id') or None
-        fournisseur.notes = request.form.get('notes')
+        valeurs = {champ: request.form.get(champ) for champ in Fournisseur.CHAMPS_FORMULAIRE}
+        valeurs['compte_comptable_id'] = request.form.get('compte_comptable_id', type=int)
 
-        db.session.commit()
+        # Ne retenir que les champs réellement modifiés ('' et None sont équivalents)
+        changements = {
+            champ: valeur for champ, valeur in valeurs.items()
+            if (valeur or None) != (getattr(fournisseur, champ) or None)
+        }
+
+        if changements:
+            old_values = {champ: getattr(fournisseur, champ) for champ in changements}
+            for champ, valeur in changements.items():
+                setattr(fournisseur, champ, valeur)
 
-        log_audit('fournisseurs', fournisseur.id, 'UPDATE', old_values, {'nom': fournisseur.nom})
+            log_audit('fournisseurs', fournisseur.id, 'UPDATE', old_values, changements)
+            db.session.commit()
+            invalider_cache_fournisseurs()
 
         flash('Fournisseur mis à jour.', 'success')
         return redirect(url_for('liste_fournisseurs'))
 
+    # Listes du formulaire (GET uniquement)
+    comptes_401 = CompteComptable.query.options(
+        load_only(CompteComptable.id, CompteComptable.numero, CompteComptable.intitule)
+    ).filter(
+        CompteComptable.numero.like('401%'),
+        CompteComptable.actif == True
+    ).order_by(CompteComptable.numero).all()
+
     return render_template('fournisseurs/form.html', fournisseur=fournisseur, comptes_401=comptes_401)
 
 
@@ -4046,13 +4865,20 @@ def details_fournisseur(id):
     # ou liées au compte comptable du fournisseur
     ecritures = []
     if fournisseur.compte_comptable_id:
-        ecritures = LigneEcriture.query.filter(
+        ecritures = LigneEcriture.query.options(
+            selectinload(LigneEcriture.piece)
+        ).filter(
             LigneEcriture.compte_id == fournisseur.compte_comptable_id
         ).join(PieceComptable).order_by(PieceComptable.date_piece.desc()).limit(50).all()
 
-    # Calculer total
-    total_debit = sum(float(e.debit or 0) for e in ecritures)
-    total_credit = sum(float(e.credit or 0) for e in ecritures)
+    # Totaux calculés en SQL sur toutes les lignes du compte (pas seulement les 50 affichées)
+    total_debit = total_credit = 0
+    if fournisseur.compte_comptable_id:
+        total_debit, total_credit = db.session.query(
+            db.func.coalesce(db.func.sum(LigneEcriture.debit), 0),
+            db.func.coalesce(db.func.sum(LigneEcriture.credit), 0)
+        ).filter(LigneEcriture.compte_id == fournisseur.compte_comptable_id).one()
+        total_debit, total_credit = float(total_debit), float(total_credit)
 
     return render_template('fournisseurs/details.html',
                           fournisseur=fournisseur,
@@ -4068,9 +4894,9 @@ def supprimer_fournisseur(id):
     """Désactiver un fournisseur (soft delete)"""
     fournisseur = Fournisseur.query.get_or_404(id)
     fournisseur.actif = False
-    db.session.commit()
-
     log_audit('fournisseurs', fournisseur.id, 'DELETE', {'nom': fournisseur.nom}, None)
+    db.session.commit()
+    invalider_cache_fournisseurs()
 
     flash('Fournisseur supprimé.', 'success')
     return redirect(url_for('liste_fournisseurs'))
@@ -4084,20 +4910,23 @@ def api_search_fournisseurs():
     if len(q) < 2:
         return jsonify([])
 
-    fournisseurs = Fournisseur.query.filter(
-        Fournisseur.actif == True,
-        db.or_(
-            Fournisseur.nom.ilike(f'%{q}%'),
-            Fournisseur.code.ilike(f'%{q}%')
-        )
-    ).limit(10).all()
+    def rechercher():
+        # actif répété dans chaque branche : chacune est servie par son index partiel
+        fournisseurs = Fournisseur.query.filter(
+            db.or_(
+                db.and_(Fournisseur.actif == True, filtre_prefixe(Fournisseur.nom, q)),
+                db.and_(Fournisseur.actif == True, filtre_prefixe(Fournisseur.code, q))
+            )
+        ).limit(10).all()
+        return [{
+            'id': f.id,
+            'code': f.code,
+            'nom': f.nom,
+            'categorie': f.categorie
+        } for f in fournisseurs]
 
-    return jsonify([{
-        'id': f.id,
-        'code': f.code,
-        'nom': f.nom,
-        'categorie': f.categorie
-    } for f in fournisseurs])
+    generation = generation_cache('fournisseurs:generation')
+    return jsonify(cache_get_or_set(f'fournisseurs:search:{generation}:{q.lower()}', rechercher, timeout=60))
 
 
 # =============================================================================
@@ -4169,7 +4998,7 @@ def nouvelle_note_frais():
             employe_id=current_user.id,
             projet_id=request.form.get('projet_id') or None,
             ligne_budget_id=request.form.get('ligne_budget_id') or None,
-            date_depense=datetime.strptime(request.form.get('date_depense'), '%Y-%m-%d').date(),
+            date_depense=date.fromisoformat(request.form.get('date_depense')),
             montant=Decimal(request.form.get('montant')),
             categorie=request.form.get('categorie'),
             description=request.form.get('description'),
@@ -4188,21 +5017,21 @@ def nouvelle_note_frais():
                 from werkzeug.utils import secure_filename
                 filename = secure_filename(fichier.filename)
                 # Créer un nom unique
-                ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+                ext = extension_fichier(filename)
                 unique_filename = f"nf_{numero}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{ext}"
                 filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'notes_frais', unique_filename)
-                os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                ensure_upload_dir(os.path.dirname(filepath))
                 fichier.save(filepath)
                 note.justificatif = f"notes_frais/{unique_filename}"
 
         db.session.add(note)
-        db.session.commit()
-
+        db.session.flush()
         log_audit('notes_frais', note.id, 'CREATE', None, {
             'numero': note.numero,
             'montant': str(note.montant),
             'categorie': note.categorie
         })
+        db.session.commit()
 
         flash(f'Note de frais {numero} créée avec succès.', 'success')
         return redirect(url_for('detail_note_frais', id=note.id))
@@ -4253,7 +5082,7 @@ def modifier_note_frais(id):
 
         note.projet_id = request.form.get('projet_id') or None
         note.ligne_budget_id = request.form.get('ligne_budget_id') or None
-        note.date_depense = datetime.strptime(request.form.get('date_depense'), '%Y-%m-%d').date()
+        note.date_depense = date.fromisoformat(request.form.get('date_depense'))
         note.montant = Decimal(request.form.get('montant'))
         note.categorie = request.form.get('categorie')
         note.description = request.form.get('description')
@@ -4274,20 +5103,19 @@ def modifier_note_frais(id):
                     return redirect(url_for('modifier_note_frais', id=id))
                 from werkzeug.utils import secure_filename
                 filename = secure_filename(fichier.filename)
-                ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+                ext = extension_fichier(filename)
                 unique_filename = f"nf_{note.numero}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{ext}"
                 filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'notes_frais', unique_filename)
-                os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                ensure_upload_dir(os.path.dirname(filepath))
                 fichier.save(filepath)
                 note.justificatif = f"notes_frais/{unique_filename}"
 
-        db.session.commit()
-
         log_audit('notes_frais', note.id, 'UPDATE', old_values, {
             'montant': str(note.montant),
             'categorie': note.categorie,
             'description': note.description
         })
+        db.session.commit()
 
         flash('Note de frais modifiée avec succès.', 'success')
         return redirect(url_for('detail_note_frais', id=id))
@@ -4314,9 +5142,8 @@ def soumettre_note_frais(id):
 
     note.statut = 'soumis'
     note.date_soumission = datetime.utcnow()
-    db.session.commit()
-
     log_audit('notes_frais', note.id, 'UPDATE', {'statut': 'brouillon'}, {'statut': 'soumis'})
+    db.session.commit()
 
     flash(f'Note de frais {note.numero} soumise pour approbation.', 'success')
     return redirect(url_for('detail_note_frais', id=id))
@@ -4336,9 +5163,8 @@ def approuver_note_frais(id):
     note.statut = 'approuve'
     note.validateur_id = current_user.id
     note.date_validation = datetime.utcnow()
-    db.session.commit()
-
     log_audit('notes_frais', note.id, 'UPDATE', {'statut': 'soumis'}, {'statut': 'approuve'})
+    db.session.commit()
 
     flash(f'Note de frais {note.numero} approuvée.', 'success')
     return redirect(url_for('detail_note_frais', id=id))
@@ -4364,9 +5190,8 @@ def rejeter_note_frais(id):
     note.validateur_id = current_user.id
     note.date_validation = datetime.utcnow()
     note.motif_rejet = motif
-    db.session.commit()
-
     log_audit('notes_frais', note.id, 'UPDATE', {'statut': 'soumis'}, {'statut': 'rejete', 'motif': motif})
+    db.session.commit()
 
     flash(f'Note de frais {note.numero} rejetée.', 'warning')
     return redirect(url_for('detail_note_frais', id=id))
@@ -4385,9 +5210,8 @@ def rembourser_note_frais(id):
 
     note.statut = 'rembourse'
     note.date_remboursement = datetime.utcnow()
-    db.session.commit()
-
     log_audit('notes_frais', note.id, 'UPDATE', {'statut': 'approuve'}, {'statut': 'rembourse'})
+    db.session.commit()
 
     flash(f'Note de frais {note.numero} marquée comme remboursée.', 'success')
     return redirect(url_for('detail_note_frais', id=id))
@@ -4493,7 +5317,7 @@ def nouvelle_demande_achat():
             demandeur_id=current_user.id,
             projet_id=request.form.get('projet_id') or None,
             ligne_budget_id=request.form.get('ligne_budget_id') or None,
-            date_demande=datetime.strptime(request.form.get('date_demande'), '%Y-%m-%d').date(),
+            date_demande=date.fromisoformat(request.form.get('date_demande')),
             objet=request.form.get('objet'),
             description=request.form.get('description'),
             urgence=request.form.get('urgence', 'normal'),
@@ -4523,13 +5347,12 @@ def nouvelle_demande_achat():
         # Mettre à jour le montant estimé
         demande.montant_estime = Decimal(str(demande.montant_total))
 
-        db.session.commit()
-
         log_audit('demandes_achat', demande.id, 'CREATE', None, {
             'numero': demande.numero,
             'objet': demande.objet,
             'montant_estime': str(demande.montant_estime)
         })
+        db.session.commit()
 
         flash(f'Demande d\'achat {numero} créée avec succès.', 'success')
         return redirect(url_for('detail_demande_achat', id=demande.id))
@@ -4570,7 +5393,7 @@ def modifier_demande_achat(id):
 
         demande.projet_id = request.form.get('projet_id') or None
         demande.ligne_budget_id = request.form.get('ligne_budget_id') or None
-        demande.date_demande = datetime.strptime(request.form.get('date_demande'), '%Y-%m-%d').date()
+        demande.date_demande = date.fromisoformat(request.form.get('date_demande'))
         demande.objet = request.form.get('objet')
         demande.description = request.form.get('description')
         demande.urgence = request.form.get('urgence', 'normal')
@@ -4601,12 +5424,11 @@ def modifier_demande_achat(id):
 
         demande.montant_estime = Decimal(str(demande.montant_total))
 
-        db.session.commit()
-
         log_audit('demandes_achat', demande.id, 'UPDATE', old_values, {
             'objet': demande.objet,
             'montant_estime': str(demande.montant_estime)
         })
+        db.session.commit()
 
         flash('Demande d\'achat modifiée avec succès.', 'success')
         return redirect(url_for('detail_demande_achat', id=id))
@@ -4630,9 +5452,8 @@ def soumettre_demande_achat(id):
 
     demande.statut = 'soumis'
     demande.date_soumission = datetime.utcnow()
-    db.session.commit()
-
     log_audit('demandes_achat', demande.id, 'UPDATE', {'statut': 'brouillon'}, {'statut': 'soumis'})
+    db.session.commit()
 
     if demande.necessite_approbation_directeur:
         flash(f'Demande {demande.numero} soumise. Montant >= 500,000 FCFA : approbation du directeur requise.', 'info')
@@ -4661,9 +5482,8 @@ def approuver_demande_achat(id):
     demande.statut = 'approuve'
     demande.approbateur_id = current_user.id
     demande.date_approbation = datetime.utcnow()
-    db.session.commit()
-
     log_audit('demandes_achat', demande.id, 'UPDATE', {'statut': 'soumis'}, {'statut': 'approuve'})
+    db.session.commit()
 
     flash(f'Demande {demande.numero} approuvée. Vous pouvez maintenant générer un bon de commande.', 'success')
     return redirect(url_for('detail_demande_achat', id=id))
@@ -4689,9 +5509,8 @@ def rejeter_demande_achat(id):
     demande.approbateur_id = current_user.id
     demande.date_approbation = datetime.utcnow()
     demande.motif_rejet = motif
-    db.session.commit()
-
     log_audit('demandes_achat', demande.id, 'UPDATE', {'statut': 'soumis'}, {'statut': 'rejete', 'motif': motif})
+    db.session.commit()
 
     flash(f'Demande {demande.numero} rejetée.', 'warning')
     return redirect(url_for('detail_demande_achat', id=id))
@@ -4751,7 +5570,7 @@ def generer_bon_commande(id):
         demande_achat_id=demande.id,
         fournisseur_id=int(fournisseur_id),
         date_commande=date.today(),
-        date_livraison_prevue=datetime.strptime(request.form.get('date_livraison'), '%Y-%m-%d').date() if request.form.get('date_livraison') else None,
+        date_livraison_prevue=date.fromisoformat(request.form.get('date_livraison')) if request.form.get('date_livraison') else None,
         conditions_paiement=request.form.get('conditions_paiement'),
         adresse_livraison=request.form.get('adresse_livraison'),
         notes=request.form.get('notes'),
@@ -4780,13 +5599,12 @@ def generer_bon_commande(id):
     demande.statut = 'commande'
     demande.bon_commande_id = bon.id
 
-    db.session.commit()
-
     log_audit('bons_commande', bon.id, 'CREATE', None, {
         'numero': bon.numero,
         'demande': demande.numero,
         'montant_total': str(bon.montant_total)
     })
+    db.session.commit()
 
     flash(f'Bon de commande {numero} généré avec succès.', 'success')
     return redirect(url_for('detail_bon_commande', id=bon.id))
@@ -4843,9 +5661,8 @@ def livrer_bon_commande(id):
     statut = request.form.get('statut_livraison', 'livre')
     if statut in ['livre_partiel', 'livre']:
         bon.statut = statut
-        db.session.commit()
-
         log_audit('bons_commande', bon.id, 'UPDATE', {'statut': 'emis'}, {'statut': statut})
+        db.session.commit()
 
         flash(f'Bon de commande {bon.numero} marqué comme {statut.replace("_", " ")}.', 'success')
 
@@ -4870,15 +5687,21 @@ def liste_immobilisations():
     if statut:
         query = query.filter(Immobilisation.statut == statut)
 
-    immobilisations = query.order_by(Immobilisation.code).all()
+    # Pagination (50 par page) ; les totaux restent calculés sur toute la sélection
+    page = request.args.get('page', 1, type=int)
+    pagination = query.order_by(Immobilisation.code).paginate(page=page, per_page=50, error_out=False)
 
-    # Totaux
-    total_acquisition = sum(float(i.valeur_acquisition or 0) for i in immobilisations)
-    total_amortissement = sum(i.cumul_amortissement for i in immobilisations)
-    total_vnc = sum(i.valeur_nette_comptable for i in immobilisations)
+    # Totaux (agrégés en SQL sur la sélection filtrée)
+    total_acquisition, total_amortissement, total_vnc = (float(t) for t in query.with_entities(
+        db.func.coalesce(db.func.sum(Immobilisation.valeur_acquisition), 0),
+        db.func.coalesce(db.func.sum(Immobilisation.cumul_amortissement), 0),
+        db.func.coalesce(db.func.sum(Immobilisation.valeur_nette_comptable), 0)
+    ).one())
 
     return render_template('comptabilite/immobilisations.html',
-                          immobilisations=immobilisations,
+                          immobilisations=pagination.items,
+                          pagination=pagination,
+                          exercice=get_exercice_ouvert(),
                           total_acquisition=total_acquisition,
                           total_amortissement=total_amortissement,
                           total_vnc=total_vnc)
@@ -4889,21 +5712,17 @@ def liste_immobilisations():
 @role_required(['comptable', 'directeur'])
 def nouvelle_immobilisation():
     """Créer une nouvelle immobilisation"""
-    projets = Projet.query.filter_by(statut='actif').all()
-    comptes_immo = CompteComptable.query.filter(
-        CompteComptable.numero.like('2%'),
-        CompteComptable.actif == True
-    ).order_by(CompteComptable.numero).all()
-
     if request.method == 'POST':
         # Générer code
         categorie = request.form.get('categorie')
-        prefix = {'informatique': 'IT', 'vehicule': 'VH', 'mobilier': 'MB', 'batiment': 'BT'}.get(categorie, 'IM')
-        derniere = Immobilisation.query.filter(Immobilisation.code.like(f'{prefix}%')).order_by(Immobilisation.id.desc()).first()
+        prefix = Immobilisation.PREFIXES_CODE.get(categorie, 'IM')
+        dernier_code = db.session.query(Immobilisation.code).filter(
+            Immobilisation.code.like(f'{prefix}%')
+        ).order_by(Immobilisation.id.desc()).limit(1).scalar()
         num = 1
-        if derniere:
+        if dernier_code:
             try:
-                num = int(derniere.code[2:]) + 1
+                num = int(dernier_code[2:]) + 1
             except ValueError:
                 pass
         code = f"{prefix}{num:04d}"
@@ -4914,10 +5733,10 @@ def nouvelle_immobilisation():
             code=code,
             designation=request.form.get('designation'),
             categorie=categorie,
-            date_acquisition=datetime.strptime(request.form.get('date_acquisition'), '%Y-%m-%d').date(),
+            date_acquisition=date.fromisoformat(request.form.get('date_acquisition')),
             valeur_acquisition=Decimal(request.form.get('valeur_acquisition')),
             duree_amortissement=duree,
-            taux_amortissement=Decimal(str(100 / duree)) if duree > 0 else 0,
+            taux_amortissement=Decimal(100) / duree if duree > 0 else 0,
             compte_immobilisation_id=request.form.get('compte_immobilisation_id') or None,
             compte_amortissement_id=request.form.get('compte_amortissement_id') or None,
             compte_dotation_id=request.form.get('compte_dotation_id') or None,
@@ -4937,6 +5756,15 @@ def nouvelle_immobilisation():
         flash(f'Immobilisation {code} créée.', 'success')
         return redirect(url_for('liste_immobilisations'))
 
+    # Listes du formulaire (GET uniquement)
+    projets = Projet.query.filter_by(statut='actif').all()
+    comptes_immo = CompteComptable.query.options(
+        load_only(CompteComptable.id, CompteComptable.numero, CompteComptable.intitule)
+    ).filter(
+        CompteComptable.numero.like('2%'),
+        CompteComptable.actif == True
+    ).order_by(CompteComptable.numero).all()
+
     return render_template('comptabilite/immobilisation_form.html',
                           projets=projets,
                           comptes=comptes_immo,
@@ -4952,6 +5780,25 @@ def detail_immobilisation(id):
     return render_template('comptabilite/immobilisation_detail.html', immobilisation=immobilisation)
 
 
+def calculer_dotation(immobilisation, exercice):
+    """Dotation de l'exercice, nouveau cumul et VNC d'une immobilisation"""
+    # Colonnes Numeric : Decimal de bout en bout
+    dotation = immobilisation.amortissement_annuel
+    cumul_precedent = immobilisation.cumul_amortissement or Decimal(0)
+
+    # Prorata temporis si première année
+    if immobilisation.date_acquisition.year == exercice.annee:
+        mois_restants = 12 - immobilisation.date_acquisition.month + 1
+        dotation = dotation * mois_restants / 12
+
+    # Dernière année : la dotation ne dépasse pas la VNC restante (VNC jamais négative)
+    dotation = max(min(dotation, immobilisation.valeur_acquisition - cumul_precedent), Decimal(0))
+
+    cumul_nouveau = cumul_precedent + dotation
+    vnc = immobilisation.valeur_acquisition - cumul_nouveau
+    return dotation, cumul_nouveau, vnc
+
+
 @app.route('/comptabilite/immobilisations/<int:id>/calculer-amortissement', methods=['POST'])
 @login_required
 @role_required(['comptable', 'directeur'])
@@ -4964,33 +5811,26 @@ def calculer_amortissement(id):
         return redirect(url_for('detail_immobilisation', id=id))
 
     # Récupérer l'exercice en cours
-    exercice = ExerciceComptable.query.filter_by(cloture=False).first()
+    exercice = get_exercice_ouvert()
     if not exercice:
         flash('Aucun exercice ouvert.', 'danger')
         return redirect(url_for('detail_immobilisation', id=id))
 
     # Vérifier si déjà calculé pour cet exercice
-    existant = LigneAmortissement.query.filter_by(
-        immobilisation_id=id,
-        exercice_id=exercice.id
-    ).first()
+    # (ou pour un exercice postérieur, dont le cumul stocké tient déjà compte)
+    existant = LigneAmortissement.query.filter(
+        LigneAmortissement.immobilisation_id == id,
+        LigneAmortissement.annee >= exercice.annee
+    ).order_by(LigneAmortissement.annee.desc()).first()
 
     if existant:
-        flash('L\'amortissement a déjà été calculé pour cet exercice.', 'warning')
+        if existant.annee > exercice.annee:
+            flash(f'L\'immobilisation est déjà amortie sur l\'exercice {existant.annee}.', 'warning')
+        else:
+            flash('L\'amortissement a déjà été calculé pour cet exercice.', 'warning')
         return redirect(url_for('detail_immobilisation', id=id))
 
-    # Calculer la dotation
-    dotation = Decimal(str(immobilisation.amortissement_annuel))
-    cumul_precedent = Decimal(str(immobilisation.cumul_amortissement))
-    cumul_nouveau = cumul_precedent + dotation
-    vnc = Decimal(str(immobilisation.valeur_acquisition)) - cumul_nouveau
-
-    # Prorata temporis si première année
-    if immobilisation.date_acquisition.year == exercice.annee:
-        mois_restants = 12 - immobilisation.date_acquisition.month + 1
-        dotation = dotation * mois_restants / 12
-        cumul_nouveau = cumul_precedent + dotation
-        vnc = Decimal(str(immobilisation.valeur_acquisition)) - cumul_nouveau
+    dotation, cumul_nouveau, vnc = calculer_dotation(immobilisation, exercice)
 
     ligne_amort = LigneAmortissement(
         immobilisation_id=id,
@@ -5001,6 +5841,8 @@ def calculer_amortissement(id):
         valeur_nette=vnc
     )
     db.session.add(ligne_amort)
+    immobilisation.cumul_amortissement = cumul_nouveau
+    immobilisation.valeur_nette_comptable = vnc
 
     log_audit('lignes_amortissement', None, 'CREATE',
               new_values={'immobilisation': immobilisation.code, 'exercice': exercice.annee, 'dotation': str(dotation)})
@@ -5010,6 +5852,66 @@ def calculer_amortissement(id):
     return redirect(url_for('detail_immobilisation', id=id))
 
 
+@app.route('/comptabilite/exercices/<int:id>/amortir-tout', methods=['POST'])
+@login_required
+@role_required(['comptable', 'directeur'])
+def amortir_immobilisations(id):
+    """Calculer en une fois l'amortissement de toutes les immobilisations actives"""
+    exercice = ExerciceComptable.query.get_or_404(id)
+
+    if exercice.cloture:
+        flash('Cet exercice est clôturé.', 'danger')
+        return redirect(url_for('liste_immobilisations'))
+
+    # Dernière année amortie par immobilisation (une seule requête). Le cumul stocké
+    # est celui de cette année : un exercice antérieur ou déjà amorti est ignoré
+    derniere_annee = dict(db.session.query(
+        LigneAmortissement.immobilisation_id, db.func.max(LigneAmortissement.annee)
+    ).group_by(LigneAmortissement.immobilisation_id).all())
+
+    lignes = []
+    anterieures = 0
+    total_dotations = Decimal(0)
+    for immobilisation in Immobilisation.query.filter_by(statut='actif').all():
+        if immobilisation.date_acquisition.year > exercice.annee:
+            continue
+        if immobilisation.id in derniere_annee and derniere_annee[immobilisation.id] >= exercice.annee:
+            if derniere_annee[immobilisation.id] > exercice.annee:
+                anterieures += 1
+            continue
+        if immobilisation.valeur_nette_comptable is not None and immobilisation.valeur_nette_comptable <= 0:
+            continue
+
+        dotation, cumul_nouveau, vnc = calculer_dotation(immobilisation, exercice)
+        lignes.append({
+            'immobilisation_id': immobilisation.id,
+            'exercice_id': exercice.id,
+            'annee': exercice.annee,
+            'dotation': dotation,
+            'cumul': cumul_nouveau,
+            'valeur_nette': vnc
+        })
+        immobilisation.cumul_amortissement = cumul_nouveau
+        immobilisation.valeur_nette_comptable = vnc
+        total_dotations += dotation
+
+    if anterieures:
+        flash(f'{anterieures} immobilisation(s) déjà amortie(s) sur un exercice postérieur à {exercice.annee} : ignorée(s).', 'warning')
+
+    if not lignes:
+        flash(f'Aucune immobilisation à amortir pour {exercice.annee}.', 'info')
+        return redirect(url_for('liste_immobilisations'))
+
+    # Un seul INSERT groupé et une seule transaction
+    db.session.execute(insert(LigneAmortissement), lignes)
+    log_audit('lignes_amortissement', None, 'CREATE',
+              new_values={'exercice': exercice.annee, 'nb_immobilisations': len(lignes), 'total_dotations': str(total_dotations)})
+    db.session.commit()
+
+    flash(f'Amortissement {exercice.annee} calculé pour {len(lignes)} immobilisation(s): {total_dotations:,.0f} FCFA', 'success')
+    return redirect(url_for('liste_immobilisations'))
+
+
 @app.route('/comptabilite/immobilisations/<int:id>/sortie', methods=['GET', 'POST'])
 @login_required
 @role_required(['directeur'])
@@ -5023,7 +5925,7 @@ def sortie_immobilisation(id):
 
     if request.method == 'POST':
         immobilisation.statut = request.form.get('motif_sortie')  # cede ou rebut
-        immobilisation.date_sortie = datetime.strptime(request.form.get('date_sortie'), '%Y-%m-%d').date()
+        immobilisation.date_sortie = date.fromisoformat(request.form.get('date_sortie'))
         immobilisation.motif_sortie = request.form.get('motif_sortie')
         if request.form.get('valeur_cession'):
             immobilisation.valeur_cession = Decimal(request.form.get('valeur_cession'))
@@ -5101,9 +6003,33 @@ def download_import_template():
     wb.save(output)
     output.seek(0)
 
-    return Response(output.read(),
-                   mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                   headers={'Content-Disposition': 'attachment; filename=template_import_ecritures.xlsx'})
+    return send_file(output, as_attachment=True, download_name='template_import_ecritures.xlsx',
+                    mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+
+def lire_lignes_import(stream):
+    """Lignes de données (8 colonnes, sans l'en-tête) d'un fichier d'import .xlsx
+
+    Utilise python-calamine s'il est installé, sinon openpyxl en lecture seule.
+    """
+    if CALAMINE_ENABLED:
+        lignes = iter(CalamineWorkbook.from_filelike(stream).get_sheet_by_index(0).iter_rows())
+        next(lignes, None)  # En-tête
+        for row in lignes:
+            # calamine renvoie '' pour une cellule vide et des float pour tous les nombres
+            row = [None if v == '' else int(v) if isinstance(v, float) and v.is_integer() else v
+                   for v in row[:8]]
+            yield tuple(row) + (None,) * (8 - len(row))
+        return
+
+    from openpyxl import load_workbook
+
+    # Lecture en flux (read_only) directement depuis le fichier uploadé, sans copie en mémoire
+    wb = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        yield from wb.active.iter_rows(min_row=2, max_col=8, values_only=True)
+    finally:
+        wb.close()
 
 
 @app.route('/comptabilite/import/upload', methods=['POST'])
@@ -5120,17 +6046,11 @@ def upload_import_ecritures():
         flash('Veuillez sélectionner un fichier .xlsx', 'danger')
         return redirect(url_for('import_ecritures_page'))
 
-    try:
-        from openpyxl import load_workbook
-        from io import BytesIO
-    except ImportError:
+    if not (CALAMINE_ENABLED or OPENPYXL_ENABLED):
         flash("openpyxl n'est pas installé.", "danger")
         return redirect(url_for('import_ecritures_page'))
 
-    wb = load_workbook(BytesIO(fichier.read()))
-    ws = wb.active
-
-    exercice = ExerciceComptable.query.filter_by(cloture=False).first()
+    exercice = get_exercice_ouvert()
     if not exercice:
         flash('Aucun exercice ouvert.', 'danger')
         return redirect(url_for('import_ecritures_page'))
@@ -5141,7 +6061,7 @@ def upload_import_ecritures():
 
     # Regrouper les lignes par date+journal+libelle+reference
     ecritures = {}
-    for row_num, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
+    for row_num, row in enumerate(lire_lignes_import(fichier.stream), start=2):
         if not row[0]:  # Skip empty rows
             continue
 
@@ -5159,7 +6079,19 @@ def upload_import_ecritures():
             'credit': float(credit) if credit else 0
         })
 
-    # Créer les pièces
+    # Précharger journaux, comptes et projets référencés (une requête par table)
+    journal_codes = {key[1] for key in ecritures}
+    compte_nums = {l['compte_num'] for lignes in ecritures.values() for l in lignes if l['compte_num']}
+    projet_codes = {l['projet_code'] for lignes in ecritures.values() for l in lignes if l['projet_code']}
+
+    journaux = {j.code: j for j in Journal.query.filter(Journal.code.in_(journal_codes)).all()}
+    comptes = {c.numero: c for c in CompteComptable.query.filter(CompteComptable.numero.in_(compte_nums)).all()}
+    projets = {p.code: p.id for p in Projet.query.filter(Projet.code.in_(projet_codes)).all()} if projet_codes else {}
+
+    annee_courante = datetime.now().year
+
+    # Valider chaque écriture avant toute insertion (une pièce déséquilibrée est simplement écartée)
+    pieces_a_creer = []
     for (date_str, journal_code, libelle, reference), lignes in ecritures.items():
         try:
             # Parser la date
@@ -5169,71 +6101,80 @@ def upload_import_ecritures():
                 date_piece = date_str
 
             # Trouver le journal
-            journal = Journal.query.filter_by(code=journal_code).first()
+            journal = journaux.get(journal_code)
             if not journal:
                 erreurs.append(f"Ligne {lignes[0]['row']}: Journal '{journal_code}' introuvable")
                 continue
 
-            # Générer numéro
-            dernier = PieceComptable.query.order_by(PieceComptable.id.desc()).first()
-            numero = f"IMP{datetime.now().year}{(dernier.id + 1 if dernier else 1):05d}"
-
-            piece = PieceComptable(
-                numero=numero,
-                date_piece=date_piece,
-                journal_id=journal.id,
-                exercice_id=exercice.id,
-                libelle=libelle,
-                reference=reference
-            )
-            db.session.add(piece)
-            db.session.flush()
-
+            lignes_valides = []
             total_debit = 0
             total_credit = 0
 
             for ligne_data in lignes:
                 # Trouver le compte
-                compte = CompteComptable.query.filter_by(numero=ligne_data['compte_num']).first()
+                compte = comptes.get(ligne_data['compte_num'])
                 if not compte:
                     erreurs.append(f"Ligne {ligne_data['row']}: Compte '{ligne_data['compte_num']}' introuvable")
                     continue
 
-                # Trouver le projet si spécifié
-                projet_id = None
-                if ligne_data['projet_code']:
-                    projet = Projet.query.filter_by(code=ligne_data['projet_code']).first()
-                    if projet:
-                        projet_id = projet.id
-
-                ligne = LigneEcriture(
-                    piece_id=piece.id,
-                    compte_id=compte.id,
-                    projet_id=projet_id,
-                    libelle=libelle,
-                    debit=ligne_data['debit'],
-                    credit=ligne_data['credit']
-                )
-                db.session.add(ligne)
+                lignes_valides.append({
+                    'compte_id': compte.id,
+                    'projet_id': projets.get(ligne_data['projet_code']),
+                    'libelle': libelle,
+                    'debit': ligne_data['debit'],
+                    'credit': ligne_data['credit']
+                })
                 total_debit += ligne_data['debit']
                 total_credit += ligne_data['credit']
-                lignes_creees += 1
 
             # Vérifier équilibre
             if abs(total_debit - total_credit) > 0.01:
                 erreurs.append(f"Écriture du {date_piece}: Déséquilibrée (D={total_debit:,.0f} C={total_credit:,.0f})")
-                db.session.rollback()
                 continue
 
-            pieces_creees += 1
+            piece = {
+                'date_piece': date_piece,
+                'journal_id': journal.id,
+                'exercice_id': exercice.id,
+                'libelle': libelle,
+                'reference': reference
+            }
+            pieces_a_creer.append((piece, lignes_valides))
 
         except Exception as e:
             erreurs.append(f"Erreur: {str(e)}")
             continue
 
-    if pieces_creees > 0:
+    if pieces_a_creer:
+        # Numéros réservés en une requête pour les seules pièces retenues
+        piece_rows = [piece for piece, _ in pieces_a_creer]
+        for piece, n in zip(piece_rows, reserver_numeros_pieces(len(piece_rows))):
+            piece['numero'] = f"IMP{annee_courante}{n:05d}"
+        if db.engine.dialect.insert_executemany_returning_sort_by_parameter_order:
+            # Un seul INSERT ... RETURNING id pour toutes les pièces (PostgreSQL, SQLite >= 3.35)
+            piece_ids = db.session.scalars(
+                insert(PieceComptable).returning(PieceComptable.id, sort_by_parameter_order=True),
+                piece_rows
+            ).all()
+        else:
+            pieces = [PieceComptable(**row) for row in piece_rows]
+            db.session.add_all(pieces)
+            db.session.flush()
+            piece_ids = [piece.id for piece in pieces]
+
+        # Puis un INSERT groupé pour toutes les lignes
+        ligne_rows = [
+            dict(ligne, piece_id=piece_id, exercice_id=piece['exercice_id'])
+            for piece_id, (piece, lignes_valides) in zip(piece_ids, pieces_a_creer)
+            for ligne in lignes_valides
+        ]
+        if ligne_rows:
+            db.session.execute(LigneEcriture.__table__.insert(), ligne_rows)
         db.session.commit()
 
+        pieces_creees = len(pieces_a_creer)
+        lignes_creees = len(ligne_rows)
+
     if erreurs:
         for err in erreurs[:10]:  # Limiter à 10 erreurs affichées
             flash(err, 'warning')
@@ -5382,14 +6323,13 @@ def generer_ecriture_modele(id):
     """Générer une écriture à partir d'un modèle"""
     modele = ModeleEcriture.query.get_or_404(id)
 
-    exercice = ExerciceComptable.query.filter_by(cloture=False).first()
+    exercice = get_exercice_ouvert()
     if not exercice:
         flash('Aucun exercice ouvert.', 'danger')
         return redirect(url_for('liste_modeles_ecritures'))
 
     # Générer numéro
-    dernier = PieceComptable.query.order_by(PieceComptable.id.desc()).first()
-    numero = f"PC{datetime.now().year}{(dernier.id + 1 if dernier else 1):05d}"
+    numero = prochain_numero_piece()
 
     piece = PieceComptable(
         numero=numero,
@@ -5532,13 +6472,13 @@ def cloturer_exercice(id):
         flash('Cet exercice est déjà clôturé.', 'warning')
         return redirect(url_for('liste_exercices'))
 
-    # Vérifications avant clôture
-    ecritures_non_validees = PieceComptable.query.filter_by(
-        exercice_id=id,
-        valide=False
-    ).count()
-
     if request.method == 'POST':
+        # Vérifications avant clôture
+        ecritures_non_validees = PieceComptable.query.filter_by(
+            exercice_id=id,
+            valide=False
+        ).count()
+
         if ecritures_non_validees > 0 and not request.form.get('force'):
             flash(f'Il reste {ecritures_non_validees} écriture(s) non validée(s).', 'danger')
             return redirect(url_for('cloturer_exercice', id=id))
@@ -5547,20 +6487,16 @@ def cloturer_exercice(id):
         exercice.cloture = True
 
         # Calculer le résultat de l'exercice
-        # Produits (classe 7) - Charges (classe 6)
-        produits = db.session.query(
-            db.func.sum(LigneEcriture.credit) - db.func.sum(LigneEcriture.debit)
-        ).join(CompteComptable).join(PieceComptable).filter(
-            CompteComptable.classe == 7,
-            PieceComptable.exercice_id == id
-        ).scalar() or 0
-
-        charges = db.session.query(
-            db.func.sum(LigneEcriture.debit) - db.func.sum(LigneEcriture.credit)
-        ).join(CompteComptable).join(PieceComptable).filter(
-            CompteComptable.classe == 6,
-            PieceComptable.exercice_id == id
-        ).scalar() or 0
+        # Produits (classe 7) - Charges (classe 6), en un seul agrégat sur les lignes de l'exercice
+        produits, charges = db.session.query(
+            db.func.sum(db.case((CompteComptable.classe == 7, LigneEcriture.credit - LigneEcriture.debit), else_=0)),
+            db.func.sum(db.case((CompteComptable.classe == 6, LigneEcriture.debit - LigneEcriture.credit), else_=0))
+        ).join(CompteComptable).filter(
+            CompteComptable.classe.in_([6, 7]),
+            LigneEcriture.exercice_id == id
+        ).one()
+        produits = produits or 0
+        charges = charges or 0
 
         resultat = float(produits) - float(charges)
 
@@ -5574,20 +6510,21 @@ def cloturer_exercice(id):
         flash(f'Exercice {exercice.annee} clôturé. Résultat: {resultat:,.0f} FCFA', 'success')
         return redirect(url_for('liste_exercices'))
 
-    # Statistiques pour la page de confirmation
+    # Statistiques pour la page de confirmation (une seule requête pièces + lignes)
+    nb_ecritures, nb_non_validees, total_debit, total_credit = db.session.query(
+        db.func.count(db.distinct(PieceComptable.id)),
+        db.func.count(db.distinct(db.case((PieceComptable.valide == False, PieceComptable.id)))),
+        db.func.sum(LigneEcriture.debit),
+        db.func.sum(LigneEcriture.credit)
+    ).select_from(PieceComptable).outerjoin(LigneEcriture).filter(
+        PieceComptable.exercice_id == id
+    ).one()
+
     stats = {
-        'nb_ecritures': PieceComptable.query.filter_by(exercice_id=id).count(),
-        'nb_non_validees': ecritures_non_validees,
-        'total_debit': db.session.query(
-            db.func.sum(LigneEcriture.debit)
-        ).join(PieceComptable).filter(
-            PieceComptable.exercice_id == id
-        ).scalar() or 0,
-        'total_credit': db.session.query(
-            db.func.sum(LigneEcriture.credit)
-        ).join(PieceComptable).filter(
-            PieceComptable.exercice_id == id
-        ).scalar() or 0
+        'nb_ecritures': nb_ecritures,
+        'nb_non_validees': nb_non_validees,
+        'total_debit': total_debit or 0,
+        'total_credit': total_credit or 0
     }
 
     return render_template('admin/cloture_exercice.html', exercice=exercice, stats=stats)
@@ -5597,13 +6534,41 @@ def cloturer_exercice(id):
 # ROUTES - MOT DE PASSE OUBLIE
 # =============================================================================
 
-import secrets
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+# Tokens de réinitialisation signés et horodatés (itsdangerous) : aucun stockage serveur,
+# valides sur tous les workers. Le token embarque une empreinte du hash du mot de passe :
+# dès que le mot de passe change, tous les tokens émis auparavant deviennent invalides.
+RESET_TOKEN_TTL = 3600
+_reset_serializer = URLSafeTimedSerializer(app.secret_key, salt='pwreset')
 
-# Stockage temporaire des tokens (en production, utiliser Redis ou la BD)
-password_reset_tokens = {}
+
+def _empreinte_mot_de_passe(user):
+    return hashlib.sha256((user.password_hash or '').encode()).hexdigest()[:16]
+
+
+def generer_token_reset(user):
+    """Token de réinitialisation signé pour un utilisateur"""
+    return _reset_serializer.dumps({'id': user.id, 'mdp': _empreinte_mot_de_passe(user)})
+
+
+def lire_token_reset(token):
+    """Retourne l'utilisateur du token, ou None s'il est invalide, expiré ou déjà utilisé"""
+    try:
+        donnees = _reset_serializer.loads(token, max_age=RESET_TOKEN_TTL)
+    except BadSignature:  # Inclut SignatureExpired
+        return None
+    if not isinstance(donnees, dict):
+        return None
+    user = db.session.get(Utilisateur, donnees.get('id'))
+    if user is None or not hmac.compare_digest(_empreinte_mot_de_passe(user), str(donnees.get('mdp', ''))):
+        return None
+    return user
 
 
 @app.route('/mot-de-passe-oublie', methods=['GET', 'POST'])
+@rate_limit("5/hour;20/day", methods=['POST'],
+            key_func=lambda: (request.form.get('email') or '').lower() or request.remote_addr)
 def mot_de_passe_oublie():
     """Demande de réinitialisation de mot de passe"""
     if current_user.is_authenticated:
@@ -5615,11 +6580,7 @@ def mot_de_passe_oublie():
 
         if user and user.actif:
             # Générer un token
-            token = secrets.token_urlsafe(32)
-            password_reset_tokens[token] = {
-                'user_id': user.id,
-                'expires': datetime.utcnow() + timedelta(hours=1)
-            }
+            token = generer_token_reset(user)
 
             # En production, envoyer un email avec le lien
             reset_url = url_for('reinitialiser_mot_de_passe', token=token, _external=True)
@@ -5628,8 +6589,7 @@ def mot_de_passe_oublie():
             flash(f'Un lien de réinitialisation a été généré. En production, il serait envoyé par email.', 'info')
             flash(f'Lien (dev): {reset_url}', 'warning')
 
-            log_audit('utilisateurs', user.id, 'PASSWORD_RESET_REQUEST')
-            db.session.commit()
+            log_audit_differe('utilisateurs', user.id, 'PASSWORD_RESET_REQUEST')
         else:
             # Ne pas révéler si l'email existe ou non (sécurité)
             flash('Si cette adresse email est associée à un compte, un lien de réinitialisation a été envoyé.', 'info')
@@ -5640,22 +6600,18 @@ def mot_de_passe_oublie():
 
 
 @app.route('/reinitialiser-mot-de-passe/<token>', methods=['GET', 'POST'])
+@rate_limit("10/minute", methods=['POST'])
 def reinitialiser_mot_de_passe(token):
     """Réinitialisation du mot de passe avec token"""
     if current_user.is_authenticated:
         return redirect(url_for('dashboard'))
 
     # Vérifier le token
-    token_data = password_reset_tokens.get(token)
-    if not token_data or token_data['expires'] < datetime.utcnow():
+    user = lire_token_reset(token)
+    if user is None:
         flash('Ce lien de réinitialisation est invalide ou a expiré.', 'danger')
         return redirect(url_for('mot_de_passe_oublie'))
 
-    user = Utilisateur.query.get(token_data['user_id'])
-    if not user:
-        flash('Utilisateur introuvable.', 'danger')
-        return redirect(url_for('login'))
-
     if request.method == 'POST':
         password = request.form.get('password')
         password_confirm = request.form.get('password_confirm')
@@ -5665,12 +6621,10 @@ def reinitialiser_mot_de_passe(token):
         elif password != password_confirm:
             flash('Les mots de passe ne correspondent pas.', 'danger')
         else:
-            user.password_hash = generate_password_hash(password)
+            user.password_hash = hacher_mot_de_passe(password)
             log_audit('utilisateurs', user.id, 'PASSWORD_RESET_COMPLETE')
             db.session.commit()
-
-            # Supprimer le token utilisé
-            del password_reset_tokens[token]
+            oublier_utilisateur_charge(user.id)
 
             flash('Votre mot de passe a été réinitialisé avec succès. Vous pouvez maintenant vous connecter.', 'success')
             return redirect(url_for('login'))
@@ -5680,6 +6634,7 @@ def reinitialiser_mot_de_passe(token):
 
 @app.route('/changer-mot-de-passe', methods=['GET', 'POST'])
 @login_required
+@rate_limit("10/minute", methods=['POST'])
 def changer_mot_de_passe():
     """Changer son propre mot de passe"""
     if request.method == 'POST':
@@ -5687,16 +6642,19 @@ def changer_mot_de_passe():
         new_password = request.form.get('new_password')
         confirm_password = request.form.get('confirm_password')
 
-        if not check_password_hash(current_user.password_hash, current_password):
+        # current_user est détaché (cache de load_user) : modifier l'instance de la session
+        utilisateur = db.session.get(Utilisateur, current_user.id)
+        if not verifier_mot_de_passe(utilisateur, current_password):
             flash('Mot de passe actuel incorrect.', 'danger')
         elif len(new_password) < 6:
             flash('Le nouveau mot de passe doit contenir au moins 6 caractères.', 'danger')
         elif new_password != confirm_password:
             flash('Les nouveaux mots de passe ne correspondent pas.', 'danger')
         else:
-            current_user.password_hash = generate_password_hash(new_password)
-            log_audit('utilisateurs', current_user.id, 'PASSWORD_CHANGE')
+            utilisateur.password_hash = hacher_mot_de_passe(new_password)
+            log_audit('utilisateurs', utilisateur.id, 'PASSWORD_CHANGE')
             db.session.commit()
+            oublier_utilisateur_charge(utilisateur.id)
             flash('Votre mot de passe a été changé avec succès.', 'success')
             return redirect(url_for('dashboard'))
 
@@ -5716,14 +6674,195 @@ def rapports():
     return render_template('rapports/index.html', projets=projets, exercices=exercices)
 
 
+# =============================================================================
+# CACHE DES RAPPORTS COMPTABLES
+# =============================================================================
+
+def cle_cache_rapports(*parties):
+    """Clé de cache d'un rapport, périmée dès qu'une écriture est modifiée"""
+    generation = generation_cache('rapports:generation')
+    return ':'.join(['rapports', str(generation)] + [str(p) for p in parties])
+
+
+def invalider_cache_rapports():
+    """Invalider la balance et les états financiers en cache"""
+    # Les clés des rapports incluent cette génération : l'incrémenter les périme toutes
+    incrementer_generation('rapports:generation')
+
+
+def cle_cache_tableau_bord(*parties):
+    """Clé de cache du tableau de bord : périmée par les écritures et par les
+    projets, lignes budgétaires, avances et bailleurs"""
+    generation = generation_cache('tableau_bord:generation')
+    return cle_cache_rapports('tableau_bord', generation, *parties)
+
+
+def invalider_cache_tableau_bord():
+    """Invalider les statistiques et alertes du tableau de bord en cache"""
+    incrementer_generation('tableau_bord:generation')
+
+
+def cle_cache_referentiels(*parties):
+    """Clé de cache des listes de référence, périmée dès qu'une de leurs tables est modifiée"""
+    generation = generation_cache('referentiels:generation')
+    return ':'.join(['referentiels', str(generation)] + [str(p) for p in parties])
+
+
+def invalider_cache_referentiels():
+    """Invalider les listes de référence des formulaires de saisie"""
+    incrementer_generation('referentiels:generation')
+
+
+def lignes_referentiel(cle, requete):
+    """Lignes d'une requête de référence, en dictionnaires (sérialisables) mis en cache"""
+    return cache_get_or_set(
+        cle_cache_referentiels(cle),
+        lambda: [dict(ligne) for ligne in db.session.execute(requete).mappings()]
+    )
+
+
+def referentiels_saisie():
+    """Journaux, exercices ouverts, comptes et projets actifs, devises des formulaires d'écriture"""
+    return {
+        'journaux': lignes_referentiel('journaux', db.select(
+            Journal.id, Journal.code, Journal.nom
+        ).order_by(Journal.id)),
+        'exercices': lignes_referentiel('exercices_ouverts', db.select(
+            ExerciceComptable.id, ExerciceComptable.annee
+        ).where(ExerciceComptable.cloture == False).order_by(ExerciceComptable.id)),
+        'comptes': lignes_referentiel('comptes_actifs', db.select(
+            CompteComptable.id, CompteComptable.numero, CompteComptable.intitule, CompteComptable.classe
+        ).where(CompteComptable.actif == True).order_by(CompteComptable.numero)),
+        'projets': lignes_referentiel('projets_actifs', db.select(
+            Projet.id, Projet.code, Projet.nom
+        ).where(Projet.statut == 'actif').order_by(Projet.id)),
+        'devises': lignes_referentiel('devises', db.select(
+            Devise.id, Devise.code
+        ).order_by(Devise.id)),
+    }
+
+
+def referentiel_lignes_budget(projets_actifs=False):
+    """Lignes budgétaires proposées à l'imputation (toutes, ou celles des projets actifs)"""
+    requete = db.select(
+        LigneBudget.id, LigneBudget.projet_id, LigneBudget.code, LigneBudget.intitule, LigneBudget.montant_prevu
+    ).order_by(LigneBudget.id)
+    if projets_actifs:
+        requete = requete.join(Projet).where(Projet.statut == 'actif')
+    return lignes_referentiel(f'lignes_budget:{int(projets_actifs)}', requete)
+
+
+# Tables dont la modification périme les rapports / le tableau de bord / les listes de référence en cache
+TABLES_RAPPORTS = frozenset({'pieces', 'lignes_ecriture'})
+TABLES_TABLEAU_BORD = frozenset({'projets', 'lignes_budget', 'avances', 'bailleurs'})
+TABLES_REFERENTIELS = frozenset({'journaux', 'exercices', 'comptes', 'projets', 'devises', 'lignes_budget'})
+
+
+def marquer_tables_modifiees(session, tables):
+    if tables & TABLES_RAPPORTS:
+        session.info['ecritures_modifiees'] = True
+    if tables & TABLES_TABLEAU_BORD:
+        session.info['tableau_bord_modifie'] = True
+    if tables & TABLES_REFERENTIELS:
+        session.info['referentiels_modifies'] = True
+
+
+def etag_rapport(*parties):
+    """ETag d'une page de rapport, ou None si la page ne doit pas être servie en 304
+
+    Dépend de la génération des rapports (toute écriture la change), des paramètres,
+    de l'utilisateur et du token CSRF de session ; renouvelé toutes les 30 minutes pour
+    que le token CSRF embarqué dans la page reste valide. Sans cache, pas de compteur
+    de génération commun aux workers : aucun ETag, la page est toujours rendue.
+    """
+    if cache is None or '_flashes' in session:
+        return None
+    brut = ':'.join(str(p) for p in (
+        cle_cache_rapports(*parties), current_user.get_id(),
+        session.get('csrf_token'), int(time.time() // 1800)
+    ))
+    return hashlib.sha256(brut.encode()).hexdigest()
+
+
+def rapport_non_modifie(etag):
+    """Le client possède déjà cette version du rapport (If-None-Match)"""
+    return etag is not None and request.if_none_match.contains(etag)
+
+
+def reponse_rapport(etag, html=None):
+    """Réponse d'un rapport avec son ETag ; 304 sans corps si html n'est pas fourni"""
+    response = make_response(html) if html is not None else Response(status=304)
+    if etag is not None:
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@event.listens_for(Session, 'after_flush')
+def marquer_ecritures_modifiees(session, flush_context):
+    """Repérer les flush touchant des tables dont dépendent les agrégats en cache"""
+    marquer_tables_modifiees(session, {
+        getattr(obj, '__tablename__', None) for obj in (*session.new, *session.dirty, *session.deleted)
+    })
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def marquer_ecritures_modifiees_dml(orm_execute_state):
+    """Repérer les INSERT/UPDATE/DELETE en masse (ex: import) sur ces mêmes tables"""
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None:
+            marquer_tables_modifiees(orm_execute_state.session, {table.name})
+
+
+@event.listens_for(Session, 'after_commit')
+def invalider_rapports_apres_commit(session):
+    if session.info.pop('ecritures_modifiees', False):
+        invalider_cache_rapports()
+    if session.info.pop('tableau_bord_modifie', False):
+        invalider_cache_tableau_bord()
+    if session.info.pop('referentiels_modifies', False):
+        invalider_cache_referentiels()
+
+
+@event.listens_for(Session, 'after_rollback')
+def oublier_ecritures_modifiees(session):
+    session.info.pop('ecritures_modifiees', None)
+    session.info.pop('tableau_bord_modifie', None)
+    session.info.pop('referentiels_modifies', None)
+
+
+def pieces_filtrees_cte(exercice_id=None, inclure_non_validees=False):
+    """CTE des ids de pièces retenues par un rapport (exercice, validation)
+
+    Restreindre les pièces d'abord laisse le planificateur utiliser ix_piece_exercice_date
+    puis agréger uniquement les lignes de ce sous-ensemble.
+    """
+    query = db.session.query(PieceComptable.id)
+    # SECURITY: Par défaut, n'inclure que les écritures validées
+    if not inclure_non_validees:
+        query = query.filter(PieceComptable.valide == True)
+    if exercice_id:
+        query = query.filter(PieceComptable.exercice_id == exercice_id)
+    return query.cte('pieces_filtrees')
+
+
 @app.route('/rapports/balance')
 @login_required
 def balance_generale():
     """Balance générale"""
     exercice_id = request.args.get('exercice_id')
     inclure_non_validees = request.args.get('inclure_non_validees', 'false') == 'true'
+    exercices = ExerciceComptable.query.order_by(ExerciceComptable.annee.desc()).all()
 
-    # Requête pour calculer les soldes par compte
+    # Page inchangée depuis la dernière visite : 304 sans recalcul ni rendu
+    etag = etag_rapport('balance-page', exercice_id, int(inclure_non_validees),
+                        [(e.id, e.annee) for e in exercices])
+    if rapport_non_modifie(etag):
+        return reponse_rapport(etag)
+
+    # Requête pour calculer les soldes par compte sur les pièces retenues
+    pieces = pieces_filtrees_cte(exercice_id, inclure_non_validees)
     query = db.session.query(
         CompteComptable.numero,
         CompteComptable.intitule,
@@ -5732,35 +6871,35 @@ def balance_generale():
     ).join(
         LigneEcriture, LigneEcriture.compte_id == CompteComptable.id
     ).join(
-        PieceComptable, PieceComptable.id == LigneEcriture.piece_id
-    )
-
-    # SECURITY: Par défaut, n'inclure que les écritures validées
-    if not inclure_non_validees:
-        query = query.filter(PieceComptable.valide == True)
-
+        pieces, pieces.c.id == LigneEcriture.piece_id
+    ).group_by(CompteComptable.id).order_by(CompteComptable.numero)
     if exercice_id:
-        query = query.filter(PieceComptable.exercice_id == exercice_id)
-
-    query = query.group_by(CompteComptable.id).order_by(CompteComptable.numero)
-
-    balance = []
-    for row in query.all():
-        debit = float(row.total_debit or 0)
-        credit = float(row.total_credit or 0)
-        solde_debit = debit - credit if debit > credit else 0
-        solde_credit = credit - debit if credit > debit else 0
-        balance.append({
-            'numero': row.numero,
-            'intitule': row.intitule,
-            'debit': debit,
-            'credit': credit,
-            'solde_debit': solde_debit,
-            'solde_credit': solde_credit
-        })
+        # Lignes de l'exercice lues directement par ix_ligne_exercice_compte
+        query = query.filter(LigneEcriture.exercice_id == exercice_id)
+
+    def calculer_balance():
+        balance = []
+        for row in query.all():
+            debit = float(row.total_debit or 0)
+            credit = float(row.total_credit or 0)
+            solde_debit = debit - credit if debit > credit else 0
+            solde_credit = credit - debit if credit > debit else 0
+            balance.append({
+                'numero': row.numero,
+                'intitule': row.intitule,
+                'debit': debit,
+                'credit': credit,
+                'solde_debit': solde_debit,
+                'solde_credit': solde_credit
+            })
+        return balance
 
-    exercices = ExerciceComptable.query.order_by(ExerciceComptable.annee.desc()).all()
-    return render_template('rapports/balance.html', balance=balance, exercices=exercices, exercice_id=exercice_id)
+    balance = cache_get_or_set(
+        cle_cache_rapports('balance', exercice_id, int(inclure_non_validees)), calculer_balance
+    )
+    return reponse_rapport(etag, render_template(
+        'rapports/balance.html', balance=balance, exercices=exercices, exercice_id=exercice_id
+    ))
 
 
 # =============================================================================
@@ -5839,8 +6978,8 @@ def parse_report_filters():
             date_filter_end = date(annee, mois + 1, 1) - timedelta(days=1)
     elif periode == 'custom' and date_debut_str and date_fin_str:
         try:
-            date_filter_start = datetime.strptime(date_debut_str, '%Y-%m-%d').date()
-            date_filter_end = datetime.strptime(date_fin_str, '%Y-%m-%d').date()
+            date_filter_start = date.fromisoformat(date_debut_str)
+            date_filter_end = date.fromisoformat(date_fin_str)
         except ValueError:
             pass  # Ignore invalid date format
 
@@ -5858,20 +6997,61 @@ def parse_report_filters():
     }
 
 
+def get_projet_rapport_or_404(id):
+    """Charge un projet avec ses lignes budgétaires, budgets annuels, bailleur et devise"""
+    return Projet.query.options(
+        selectinload(Projet.lignes_budget).selectinload(LigneBudget.budgets_annuels),
+        joinedload(Projet.bailleur),
+        joinedload(Projet.devise)
+    ).filter_by(id=id).first_or_404()
+
+
 def calculate_rapport_data(projet, filters):
     """Calculate report data with filters applied"""
-    categories = CategorieBudget.query.order_by(CategorieBudget.ordre).all()
+    categories = CategorieBudget.query.options(
+        load_only(CategorieBudget.id, CategorieBudget.nom, CategorieBudget.ordre)
+    ).order_by(CategorieBudget.ordre).all()
 
     # Filtrer les catégories si une catégorie spécifique est demandée
     if filters['categorie_id']:
         categories = [c for c in categories if c.id == filters['categorie_id']]
 
+    # Montants en Decimal de bout en bout, convertis uniquement à l'affichage
     rapport = []
-    total_prevu = 0
-    total_realise = 0
+    total_prevu = Decimal(0)
+    total_realise = Decimal(0)
+
+    # Réalisé (charges classe 6) de toutes les lignes du projet en une seule requête
+    query = db.session.query(
+        LigneEcriture.ligne_budget_id, db.func.coalesce(db.func.sum(LigneEcriture.debit), 0)
+    ).join(CompteComptable).join(
+        PieceComptable, LigneEcriture.piece_id == PieceComptable.id
+    ).filter(
+        LigneEcriture.ligne_budget_id.in_([l.id for l in projet.lignes_budget]),
+        CompteComptable.classe == 6
+    )
+
+    # Appliquer filtre de date si spécifié
+    if filters['date_filter_start'] and filters['date_filter_end']:
+        query = query.filter(
+            PieceComptable.date_piece >= filters['date_filter_start'],
+            PieceComptable.date_piece <= filters['date_filter_end']
+        )
+
+    # Mémorisé pour enchaîner rapport HTML puis export PDF/Excel sans recalcul
+    realises = cache_get_or_set(
+        cle_cache_rapports('projet', projet.id, filters['date_filter_start'], filters['date_filter_end']),
+        lambda: dict(query.group_by(LigneEcriture.ligne_budget_id).all()),
+        timeout=120
+    )
+
+    # Lignes du projet regroupées par catégorie en un seul passage
+    lignes_par_categorie = defaultdict(list)
+    for ligne in projet.lignes_budget:
+        lignes_par_categorie[ligne.categorie_id].append(ligne)
 
     for cat in categories:
-        lignes_cat = [l for l in projet.lignes_budget if l.categorie_id == cat.id]
+        lignes_cat = lignes_par_categorie.get(cat.id, [])
 
         # Si filtre ligne spécifique, ne garder que cette ligne
         if filters['ligne_budget_id']:
@@ -5883,44 +7063,26 @@ def calculate_rapport_data(projet, filters):
         cat_data = {
             'categorie': cat,
             'lignes': [],
-            'total_prevu': 0,
-            'total_realise': 0
+            'total_prevu': Decimal(0),
+            'total_realise': Decimal(0)
         }
 
         for ligne in lignes_cat:
-            # Requête réalisé avec jointure PieceComptable pour filtrer par date
-            query = db.session.query(
-                db.func.sum(LigneEcriture.debit)
-            ).join(CompteComptable).join(
-                PieceComptable, LigneEcriture.piece_id == PieceComptable.id
-            ).filter(
-                (LigneEcriture.ligne_budget_id == ligne.id) &
-                (CompteComptable.classe == 6)
-            )
-
-            # Appliquer filtre de date si spécifié
-            if filters['date_filter_start'] and filters['date_filter_end']:
-                query = query.filter(
-                    PieceComptable.date_piece >= filters['date_filter_start'],
-                    PieceComptable.date_piece <= filters['date_filter_end']
-                )
-
-            realise = query.scalar() or 0
-            realise = float(realise)
+            realise = realises.get(ligne.id, Decimal(0))
 
             # Si filtre par année et BudgetAnnee existe, utiliser le montant annuel
-            prevu = float(ligne.montant_prevu or 0)
+            prevu = ligne.montant_prevu or Decimal(0)
             if filters['periode'] == 'year' and filters['annee']:
                 budget_annee = ligne.get_montant_annee(filters['annee'])
                 if budget_annee > 0:
-                    prevu = float(budget_annee)
+                    prevu = budget_annee
 
             cat_data['lignes'].append({
                 'ligne': ligne,
                 'prevu': prevu,
                 'realise': realise,
                 'ecart': prevu - realise,
-                'taux': (realise / prevu * 100) if prevu > 0 else 0
+                'taux': (realise / prevu * 100) if prevu > 0 else Decimal(0)
             })
             cat_data['total_prevu'] += prevu
             cat_data['total_realise'] += realise
@@ -5936,7 +7098,7 @@ def calculate_rapport_data(projet, filters):
 @login_required
 def rapport_projet(id):
     """Rapport bailleur - Budget vs Réalisé avec filtres"""
-    projet = Projet.query.get_or_404(id)
+    projet = get_projet_rapport_or_404(id)
 
     # Parse filters
     filters = parse_report_filters()
@@ -5945,7 +7107,9 @@ def rapport_projet(id):
     rapport, total_prevu, total_realise = calculate_rapport_data(projet, filters)
 
     # Get all categories for filter dropdown
-    categories_all = CategorieBudget.query.order_by(CategorieBudget.ordre).all()
+    categories_all = CategorieBudget.query.options(
+        load_only(CategorieBudget.id, CategorieBudget.nom)
+    ).order_by(CategorieBudget.ordre).all()
 
     # Calculate available years for filter
     current_year = datetime.now().year
@@ -5985,18 +7149,28 @@ def rapport_projet(id):
                           ligne_nom=ligne_nom)
 
 
+def html_vers_pdf(html):
+    """Convertir un rapport HTML en PDF (xhtml2pdf)
+
+    Retourne None si la conversion échoue. Suppose XHTML2PDF_ENABLED.
+    """
+    from xhtml2pdf import pisa
+
+    pdf_buffer = BytesIO()
+    if pisa.CreatePDF(html, dest=pdf_buffer).err:
+        return None
+    return pdf_buffer.getvalue()
+
+
 @app.route('/rapports/projet/<int:id>/pdf')
 @login_required
 def export_projet_pdf(id):
     """Export PDF du rapport bailleur avec filtres"""
-    try:
-        from xhtml2pdf import pisa
-        from io import BytesIO
-    except ImportError:
+    if not XHTML2PDF_ENABLED:
         flash("xhtml2pdf n'est pas installé. Utilisez: pip install xhtml2pdf", "danger")
         return redirect(url_for('rapport_projet', id=id))
 
-    projet = Projet.query.get_or_404(id)
+    projet = get_projet_rapport_or_404(id)
 
     # Parse filters (same as rapport_projet)
     filters = parse_report_filters()
@@ -6025,12 +7199,11 @@ def export_projet_pdf(id):
                           ligne_nom=ligne_nom)
 
     try:
-        pdf_buffer = BytesIO()
-        pisa_status = pisa.CreatePDF(html, dest=pdf_buffer)
-        if pisa_status.err:
+        pdf = html_vers_pdf(html)
+        if pdf is None:
             flash("Erreur lors de la génération PDF.", "danger")
             return redirect(url_for('rapport_projet', id=id))
-        pdf_buffer.seek(0)
+        pdf_buffer = BytesIO(pdf)
     except Exception as e:
         flash(f"Erreur lors de la génération PDF: {str(e)}", "danger")
         return redirect(url_for('rapport_projet', id=id))
@@ -6044,9 +7217,10 @@ def export_projet_pdf(id):
     elif filters['periode'] == 'month' and filters['annee'] and filters['mois']:
         filename_suffix = f"_{filters['annee']}-{filters['mois']:02d}"
 
-    return Response(pdf_buffer.getvalue(),
-                   mimetype='application/pdf',
-                   headers={'Content-Disposition': f'attachment; filename=rapport_{projet.code}{filename_suffix}_{date.today()}.pdf'})
+    return send_file(pdf_buffer,
+                     mimetype='application/pdf',
+                     as_attachment=True,
+                     download_name=f'rapport_{projet.code}{filename_suffix}_{date.today()}.pdf')
 
 
 @app.route('/rapports/projet/<int:id>/excel')
@@ -6055,13 +7229,13 @@ def export_projet_excel(id):
     """Export Excel du rapport bailleur avec filtres"""
     try:
         from openpyxl import Workbook
-        from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
+        from openpyxl.styles import Font, PatternFill, Border, Side, NamedStyle
         from io import BytesIO
     except ImportError:
         flash("openpyxl n'est pas installé. Utilisez: pip install openpyxl", "danger")
         return redirect(url_for('rapport_projet', id=id))
 
-    projet = Projet.query.get_or_404(id)
+    projet = get_projet_rapport_or_404(id)
 
     # Parse filters (same as rapport_projet)
     filters = parse_report_filters()
@@ -6125,6 +7299,15 @@ def export_projet_excel(id):
     else:
         row = 6
 
+    # Styles nommés partagés par les lignes de données (résolus une seule fois par le classeur)
+    style_texte = NamedStyle(name='rapport_texte', border=thin_border)
+    style_montant = NamedStyle(name='rapport_montant', border=thin_border, number_format='#,##0')
+    style_taux = NamedStyle(name='rapport_taux', border=thin_border, number_format='0.0%')
+    style_categorie = NamedStyle(name='rapport_categorie', border=thin_border, fill=cat_fill, font=Font(bold=True))
+    for style in (style_texte, style_montant, style_taux, style_categorie):
+        wb.add_named_style(style)
+    styles_ligne = ('rapport_texte', 'rapport_texte', 'rapport_montant', 'rapport_montant', 'rapport_montant', 'rapport_taux')
+
     # En-têtes tableau
     headers = ['Code', 'Description', 'Budget prévu', 'Réalisé', 'Écart', 'Taux (%)']
     for col, header in enumerate(headers, 1):
@@ -6132,38 +7315,27 @@ def export_projet_excel(id):
         cell.font = header_font
         cell.border = thin_border
 
-    row += 1
-
-    # Données du rapport (déjà filtrées)
+    # Données du rapport (déjà filtrées), une ligne ajoutée par append
     for cat_data in rapport:
-        cat = cat_data['categorie']
-
         # Ligne catégorie
-        ws.cell(row=row, column=1, value=cat.nom).font = Font(bold=True)
-        ws.cell(row=row, column=1).fill = cat_fill
-        for col in range(1, 7):
-            ws.cell(row=row, column=col).fill = cat_fill
-            ws.cell(row=row, column=col).border = thin_border
-        row += 1
+        ws.append([cat_data['categorie'].nom, None, None, None, None, None])
+        for cell in ws[ws.max_row]:
+            cell.style = 'rapport_categorie'
 
         for item in cat_data['lignes']:
             ligne = item['ligne']
-            prevu = item['prevu']
-            realise = item['realise']
-            taux = item['taux'] / 100  # Convert to decimal for Excel percentage format
-
-            ws.cell(row=row, column=1, value=ligne.code).border = thin_border
-            ws.cell(row=row, column=2, value=ligne.intitule).border = thin_border
-            ws.cell(row=row, column=3, value=prevu).border = thin_border
-            ws.cell(row=row, column=3).number_format = '#,##0'
-            ws.cell(row=row, column=4, value=realise).border = thin_border
-            ws.cell(row=row, column=4).number_format = '#,##0'
-            ws.cell(row=row, column=5, value=prevu - realise).border = thin_border
-            ws.cell(row=row, column=5).number_format = '#,##0'
-            ws.cell(row=row, column=6, value=taux).border = thin_border
-            ws.cell(row=row, column=6).number_format = '0.0%'
-
-            row += 1
+            ws.append([
+                ligne.code,
+                ligne.intitule,
+                item['prevu'],
+                item['realise'],
+                item['prevu'] - item['realise'],
+                item['taux'] / 100  # Convert to decimal for Excel percentage format
+            ])
+            for cell, style in zip(ws[ws.max_row], styles_ligne):
+                cell.style = style
+
+    row = ws.max_row + 1
 
     # Total général
     row += 1
@@ -6222,9 +7394,10 @@ def export_projet_excel(id):
     elif filters['periode'] == 'month' and filters['annee'] and filters['mois']:
         filename_suffix = f"_{filters['annee']}-{filters['mois']:02d}"
 
-    return Response(output.read(),
-                   mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                   headers={'Content-Disposition': f'attachment; filename=rapport_{projet.code}{filename_suffix}_{date.today()}.xlsx'})
+    return send_file(output,
+                     mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                     as_attachment=True,
+                     download_name=f'rapport_{projet.code}{filename_suffix}_{date.today()}.xlsx')
 
 
 @app.route('/rapports/reconciliation')
@@ -6239,7 +7412,7 @@ def reconciliation_analytique():
 
     # Total charges classe 6 (comptabilité générale)
     total_compta_generale = db.session.query(
-        db.func.sum(LigneEcriture.debit)
+        db.func.coalesce(db.func.sum(LigneEcriture.debit), 0)
     ).join(CompteComptable).join(PieceComptable).filter(
         CompteComptable.classe == 6
     )
@@ -6247,40 +7420,40 @@ def reconciliation_analytique():
         total_compta_generale = total_compta_generale.filter(
             PieceComptable.exercice_id == exercice_id
         )
-    total_compta_generale = float(total_compta_generale.scalar() or 0)
-
-    # Total par projet (analytique)
-    projets_data = []
-    total_analytique = 0
-
-    for projet in Projet.query.all():
-        projet_total = 0
-        for ligne in projet.lignes_budget:
-            realise = db.session.query(
-                db.func.sum(LigneEcriture.debit)
-            ).join(CompteComptable).filter(
-                (LigneEcriture.ligne_budget_id == ligne.id) &
-                (CompteComptable.classe == 6)
-            ).scalar() or 0
-            projet_total += float(realise)
-
-        if projet_total > 0:
-            projets_data.append({
-                'projet': projet,
-                'total': projet_total
-            })
-            total_analytique += projet_total
+    total_compta_generale = total_compta_generale.scalar()
+
+    # Total par projet (analytique), via la ligne budgétaire, en une seule requête
+    totaux = dict(db.session.query(
+        LigneBudget.projet_id, db.func.sum(LigneEcriture.debit)
+    ).join(
+        LigneEcriture, LigneEcriture.ligne_budget_id == LigneBudget.id
+    ).join(
+        CompteComptable, LigneEcriture.compte_id == CompteComptable.id
+    ).filter(
+        CompteComptable.classe == 6
+    ).group_by(LigneBudget.projet_id).all())
+
+    projets_ids = [projet_id for projet_id, total in totaux.items() if total and total > 0]
+    projets = Projet.query.options(
+        load_only(Projet.id, Projet.code, Projet.nom, Projet.bailleur_id),
+        joinedload(Projet.bailleur).load_only(Bailleur.nom)
+    ).filter(
+        Projet.id.in_(projets_ids)
+    ).order_by(Projet.id).all() if projets_ids else []
+
+    projets_data = [{'projet': projet, 'total': totaux[projet.id]} for projet in projets]
+    total_analytique = sum((item['total'] for item in projets_data), Decimal(0))
 
     # Écart de réconciliation
     ecart = total_compta_generale - total_analytique
 
     # Charges non imputées (sans ligne_budget_id)
     charges_non_imputees = db.session.query(
-        db.func.sum(LigneEcriture.debit)
+        db.func.coalesce(db.func.sum(LigneEcriture.debit), 0)
     ).join(CompteComptable).filter(
         CompteComptable.classe == 6,
         LigneEcriture.ligne_budget_id == None
-    ).scalar() or 0
+    ).scalar()
 
     return render_template('rapports/reconciliation.html',
                           exercices=exercices,
@@ -6289,7 +7462,7 @@ def reconciliation_analytique():
                           total_analytique=total_analytique,
                           projets_data=projets_data,
                           ecart=ecart,
-                          charges_non_imputees=float(charges_non_imputees))
+                          charges_non_imputees=charges_non_imputees)
 
 
 @app.route('/rapports/etats-financiers')
@@ -6302,6 +7475,11 @@ def etats_financiers():
     if not exercice_id and exercices:
         exercice_id = exercices[0].id
 
+    # Page inchangée depuis la dernière visite : 304 sans recalcul ni rendu
+    etag = etag_rapport('etats-page', exercice_id, [(e.id, e.annee) for e in exercices])
+    if rapport_non_modifie(etag):
+        return reponse_rapport(etag)
+
     # Calculer Actif (classes 2-5)
     actif = calculer_soldes_classe([2, 3, 4, 5], exercice_id, 'actif')
 
@@ -6316,62 +7494,57 @@ def etats_financiers():
 
     resultat = sum(p['solde'] for p in produits) - sum(c['solde'] for c in charges)
 
-    return render_template('rapports/etats_financiers.html',
+    return reponse_rapport(etag, render_template('rapports/etats_financiers.html',
                          actif=actif,
                          passif=passif,
                          charges=charges,
                          produits=produits,
                          resultat=resultat,
                          exercices=exercices,
-                         exercice_id=exercice_id)
+                         exercice_id=exercice_id))
 
 
 def calculer_soldes_classe(classes, exercice_id=None, type_solde=None, inclure_non_validees=False):
     """Calculer les soldes pour une classe de comptes
     SECURITY: Par défaut, n'inclut que les écritures validées
     """
-    query = db.session.query(
-        CompteComptable.numero,
-        CompteComptable.intitule,
-        db.func.sum(LigneEcriture.debit).label('total_debit'),
-        db.func.sum(LigneEcriture.credit).label('total_credit')
-    ).join(
-        LigneEcriture, LigneEcriture.compte_id == CompteComptable.id
-    ).join(
-        PieceComptable, PieceComptable.id == LigneEcriture.piece_id
-    ).filter(
-        CompteComptable.classe.in_(classes)
-    )
-
-    # SECURITY: Par défaut, n'inclure que les écritures validées pour états financiers
-    if not inclure_non_validees:
-        query = query.filter(PieceComptable.valide == True)
-
-    if exercice_id:
-        query = query.filter(PieceComptable.exercice_id == exercice_id)
+    def calculer():
+        pieces = pieces_filtrees_cte(exercice_id, inclure_non_validees)
 
-    query = query.group_by(CompteComptable.id).order_by(CompteComptable.numero)
-
-    resultats = []
-    for row in query.all():
-        debit = float(row.total_debit or 0)
-        credit = float(row.total_credit or 0)
-
-        if type_solde == 'actif':
-            solde = debit - credit
-        elif type_solde == 'passif':
-            solde = credit - debit
-        else:
-            solde = debit - credit
-
-        if abs(solde) > 0.01:
-            resultats.append({
-                'numero': row.numero,
-                'intitule': row.intitule,
-                'solde': solde
-            })
+        # Solde débiteur calculé en SQL ; les comptes soldés sont écartés par HAVING
+        solde = (
+            db.func.coalesce(db.func.sum(LigneEcriture.debit), 0) -
+            db.func.coalesce(db.func.sum(LigneEcriture.credit), 0)
+        )
+        query = db.session.query(
+            CompteComptable.numero,
+            CompteComptable.intitule,
+            solde.label('solde')
+        ).join(
+            LigneEcriture, LigneEcriture.compte_id == CompteComptable.id
+        ).join(
+            pieces, pieces.c.id == LigneEcriture.piece_id
+        ).filter(
+            CompteComptable.classe.in_(classes)
+        ).group_by(CompteComptable.id).having(
+            db.func.abs(solde) > 0.01
+        ).order_by(CompteComptable.numero)
+        if exercice_id:
+            query = query.filter(LigneEcriture.exercice_id == exercice_id)
+
+        # Passif : solde créditeur (crédit - débit)
+        signe = -1 if type_solde == 'passif' else 1
+        return [{
+            'numero': row.numero,
+            'intitule': row.intitule,
+            'solde': signe * float(row.solde)
+        } for row in query.all()]
 
-    return resultats
+    return cache_get_or_set(
+        cle_cache_rapports('soldes', ','.join(str(c) for c in classes), exercice_id,
+                           type_solde, int(inclure_non_validees)),
+        calculer
+    )
 
 
 # =============================================================================
@@ -6567,7 +7740,7 @@ def creer_backup():
     if error:
         flash(f'Erreur lors de la sauvegarde: {error}', 'danger')
     else:
-        log_audit('backup', None, 'CREATE', new_values={'filename': backup['filename']})
+        log_audit_differe('backup', None, 'CREATE', new_values={'filename': backup['filename']})
         flash(f'Sauvegarde créée: {backup["filename"]}', 'success')
 
     return redirect(url_for('liste_backups'))
@@ -6582,7 +7755,7 @@ def telecharger_backup(filename):
     for folder in [BACKUP_MANUAL_FOLDER, BACKUP_DAILY_FOLDER, BACKUP_WEEKLY_FOLDER]:
         filepath = os.path.join(folder, os.path.basename(filename))
         if os.path.exists(filepath):
-            log_audit('backup', None, 'DOWNLOAD', new_values={'filename': filename})
+            log_audit_differe('backup', None, 'DOWNLOAD', new_values={'filename': filename})
             return send_file(filepath, as_attachment=True,
                            download_name=f'creates_{filename}')
 
@@ -6599,7 +7772,7 @@ def supprimer_backup(filename):
         filepath = os.path.join(folder, os.path.basename(filename))
         if os.path.exists(filepath):
             os.remove(filepath)
-            log_audit('backup', None, 'DELETE', new_values={'filename': filename})
+            log_audit_differe('backup', None, 'DELETE', new_values={'filename': filename})
             flash(f'Sauvegarde supprimée: {filename}', 'success')
             return redirect(url_for('liste_backups'))
 
@@ -6636,7 +7809,7 @@ def restaurer_backup(filename):
         # Restaurer
         shutil.copy2(backup_path, db_path)
 
-        log_audit('backup', None, 'RESTORE', new_values={
+        log_audit_differe('backup', None, 'RESTORE', new_values={
             'restored_from': filename,
             'pre_restore_backup': pre_restore_backup['filename'] if pre_restore_backup else None
         })
@@ -6674,12 +7847,13 @@ def config_backup():
         config.email_destinataire = request.form.get('email_destinataire', '').strip()
         config.actif = request.form.get('actif') == 'on'
 
-        db.session.commit()
+        db.session.flush()
         log_audit('config_backup', config.id, 'UPDATE', new_values={
             'smtp_server': config.smtp_server,
             'smtp_user': config.smtp_user,
             'actif': config.actif
         })
+        db.session.commit()
         flash('Configuration email sauvegardée', 'success')
         return redirect(url_for('liste_backups'))
 
@@ -6716,10 +7890,10 @@ def test_email_backup():
 
         if success:
             flash('Email de test envoyé avec succès! Vérifiez votre boîte de réception.', 'success')
-            log_audit('config_backup', config.id, 'TEST_EMAIL', new_values={'success': True})
+            log_audit_differe('config_backup', config.id, 'TEST_EMAIL', new_values={'success': True})
         else:
             flash(f'Erreur lors de l\'envoi: {message}', 'danger')
-            log_audit('config_backup', config.id, 'TEST_EMAIL', new_values={'success': False, 'error': message})
+            log_audit_differe('config_backup', config.id, 'TEST_EMAIL', new_values={'success': False, 'error': message})
     finally:
         # Supprimer le fichier test
         if os.path.exists(test_file):
@@ -6738,7 +7912,7 @@ def envoyer_backup_par_email(filename):
         if os.path.exists(filepath):
             success, message = envoyer_backup_email(filepath)
             if success:
-                log_audit('backup', None, 'EMAIL_SENT', new_values={'filename': filename})
+                log_audit_differe('backup', None, 'EMAIL_SENT', new_values={'filename': filename})
                 flash(f'Backup "{filename}" envoyé par email', 'success')
             else:
                 flash(f'Erreur envoi email: {message}', 'danger')
@@ -6784,18 +7958,41 @@ def export_donnees_excel():
     ws1.title = "Ecritures"
     ws1.append(['Numero', 'Date', 'Journal', 'Libelle', 'Reference', 'Total Debit', 'Total Credit', 'Valide', 'Exercice'])
 
-    ecritures = PieceComptable.query.order_by(PieceComptable.date_piece.desc()).all()
-    for e in ecritures:
+    # Totaux agrégés une seule fois par pièce (GROUP BY) et joints à une projection de
+    # colonnes : ni chargement paresseux des lignes, ni journal/exercice par pièce
+    totaux = (
+        db.select(
+            LigneEcriture.piece_id,
+            db.func.sum(LigneEcriture.debit).label('total_debit'),
+            db.func.sum(LigneEcriture.credit).label('total_credit'),
+        )
+        .group_by(LigneEcriture.piece_id)
+        .subquery()
+    )
+    ecritures = db.session.execute(
+        db.select(
+            PieceComptable.numero, PieceComptable.date_piece, Journal.code,
+            PieceComptable.libelle, PieceComptable.reference,
+            totaux.c.total_debit, totaux.c.total_credit,
+            PieceComptable.valide, ExerciceComptable.annee
+        )
+        .outerjoin(totaux, totaux.c.piece_id == PieceComptable.id)
+        .outerjoin(Journal, PieceComptable.journal_id == Journal.id)
+        .outerjoin(ExerciceComptable, PieceComptable.exercice_id == ExerciceComptable.id)
+        .order_by(PieceComptable.date_piece.desc())
+        .execution_options(yield_per=500)
+    )
+    for numero, date_piece, journal_code, libelle, reference, total_debit, total_credit, valide, annee in ecritures:
         ws1.append([
-            e.numero,
-            e.date_piece.strftime('%d/%m/%Y') if e.date_piece else '',
-            e.journal.code if e.journal else '',
-            e.libelle,
-            e.reference or '',
-            float(e.total_debit),
-            float(e.total_credit),
-            'Oui' if e.valide else 'Non',
-            e.exercice.annee if e.exercice else ''
+            numero,
+            date_piece.strftime('%d/%m/%Y') if date_piece else '',
+            journal_code or '',
+            libelle,
+            reference or '',
+            float(total_debit or 0),
+            float(total_credit or 0),
+            'Oui' if valide else 'Non',
+            annee or ''
         ])
     style_header(ws1)
 
@@ -6803,17 +8000,31 @@ def export_donnees_excel():
     ws2 = wb.create_sheet("Lignes Ecritures")
     ws2.append(['Piece', 'Date', 'Compte', 'Intitule Compte', 'Libelle', 'Projet', 'Debit', 'Credit'])
 
-    lignes = LigneEcriture.query.join(PieceComptable).order_by(PieceComptable.date_piece.desc()).all()
-    for l in lignes:
+    # Projection de colonnes lue par lots de 500 (curseur serveur sous PostgreSQL) :
+    # la mémoire reste constante quel que soit le nombre de lignes
+    lignes = db.session.execute(
+        db.select(
+            PieceComptable.numero, PieceComptable.date_piece,
+            CompteComptable.numero, CompteComptable.intitule,
+            LigneEcriture.libelle, Projet.code, LigneEcriture.debit, LigneEcriture.credit
+        )
+        .select_from(LigneEcriture)
+        .join(PieceComptable, LigneEcriture.piece_id == PieceComptable.id)
+        .outerjoin(CompteComptable, LigneEcriture.compte_id == CompteComptable.id)
+        .outerjoin(Projet, LigneEcriture.projet_id == Projet.id)
+        .order_by(PieceComptable.date_piece.desc())
+        .execution_options(yield_per=500)
+    )
+    for numero, date_piece, compte_num, compte_intitule, libelle, projet_code, debit, credit in lignes:
         ws2.append([
-            l.piece.numero if l.piece else '',
-            l.piece.date_piece.strftime('%d/%m/%Y') if l.piece and l.piece.date_piece else '',
-            l.compte.numero if l.compte else '',
-            l.compte.intitule if l.compte else '',
-            l.libelle or '',
-            l.projet.code if l.projet else '',
-            float(l.debit) if l.debit else 0,
-            float(l.credit) if l.credit else 0
+            numero,
+            date_piece.strftime('%d/%m/%Y') if date_piece else '',
+            compte_num or '',
+            compte_intitule or '',
+            libelle or '',
+            projet_code or '',
+            float(debit) if debit else 0,
+            float(credit) if credit else 0
         ])
     style_header(ws2)
 
@@ -6883,11 +8094,19 @@ def export_donnees_excel():
     ws8 = wb.create_sheet("Balance")
     ws8.append(['Compte', 'Intitule', 'Total Debit', 'Total Credit', 'Solde Debiteur', 'Solde Crediteur'])
 
+    # Une seule agrégation GROUP BY compte plutôt que deux SUM par compte
+    totaux_comptes = {
+        compte_id: (debit, credit)
+        for compte_id, debit, credit in db.session.query(
+            LigneEcriture.compte_id,
+            db.func.sum(LigneEcriture.debit),
+            db.func.sum(LigneEcriture.credit),
+        ).group_by(LigneEcriture.compte_id)
+    }
     for c in comptes:
-        total_debit = db.session.query(db.func.sum(LigneEcriture.debit)).filter(
-            LigneEcriture.compte_id == c.id).scalar() or 0
-        total_credit = db.session.query(db.func.sum(LigneEcriture.credit)).filter(
-            LigneEcriture.compte_id == c.id).scalar() or 0
+        total_debit, total_credit = totaux_comptes.get(c.id, (0, 0))
+        total_debit = total_debit or 0
+        total_credit = total_credit or 0
         solde = float(total_debit) - float(total_credit)
         if total_debit or total_credit:
             ws8.append([
@@ -6903,7 +8122,7 @@ def export_donnees_excel():
     wb.save(output)
     output.seek(0)
 
-    log_audit('export', None, 'EXPORT_EXCEL', new_values={'type': 'full_backup'})
+    log_audit_differe('export', None, 'EXPORT_EXCEL', new_values={'type': 'full_backup'})
 
     filename = f'CREATES_Export_Complet_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
     return send_file(output, as_attachment=True, download_name=filename,
@@ -7089,221 +8308,229 @@ def telecharger_manuel():
 # INITIALISATION BASE DE DONNEES
 # =============================================================================
 
-def init_db():
-    """Initialiser la base de données avec les données de base"""
-    db.create_all()
+def creer_index_manquants(conn):
+    """Créer les index déclarés sur les modèles mais absents d'une base existante
 
-    # Vérifier si déjà initialisé
-    if Devise.query.first():
+    db.create_all() ne crée les index qu'avec les nouvelles tables.
+    """
+    from sqlalchemy.schema import CreateIndex
+
+    # IF NOT EXISTS plutôt que checkfirst : les index sur expression (lower(...))
+    # ne sont pas réfléchis par tous les dialectes
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+# Index remplacés par un autre, supprimés des bases existantes
+INDEX_OBSOLETES = ('ix_piece_exercice_valide', 'ix_piece_journal_date', 'ix_ligne_piece_compte',
+                   'ix_fournisseur_nom_lower')
+
+
+def supprimer_index_obsoletes(conn):
+    """Supprimer d'une base existante les index retirés des modèles"""
+    for nom in INDEX_OBSOLETES:
+        conn.execute(db.text(f'DROP INDEX IF EXISTS {nom}'))
+
+
+def migrer_amortissements_materialises(conn):
+    """Ajouter et remplir cumul_amortissement / valeur_nette_comptable sur une base existante"""
+    from sqlalchemy import inspect
+
+    colonnes = {c['name'] for c in inspect(conn).get_columns('immobilisations')}
+    if 'cumul_amortissement' in colonnes:
+        return
+
+    conn.execute(db.text('ALTER TABLE immobilisations ADD COLUMN cumul_amortissement NUMERIC(15, 2) DEFAULT 0'))
+    conn.execute(db.text('ALTER TABLE immobilisations ADD COLUMN valeur_nette_comptable NUMERIC(15, 2)'))
+    conn.execute(db.text(
+        'UPDATE immobilisations SET cumul_amortissement = COALESCE('
+        '(SELECT SUM(dotation) FROM lignes_amortissement'
+        ' WHERE lignes_amortissement.immobilisation_id = immobilisations.id), 0)'
+    ))
+    conn.execute(db.text(
+        'UPDATE immobilisations SET valeur_nette_comptable = valeur_acquisition - cumul_amortissement'
+    ))
+
+
+def migrer_audit_json(conn):
+    """Convertir old_values / new_values de TEXT en JSONB sur une base PostgreSQL existante
+
+    Sous SQLite le type JSON est stocké en texte : les lignes existantes se lisent telles quelles.
+    """
+    from sqlalchemy import inspect
+
+    if conn.dialect.name != 'postgresql' or 'audit_log' not in inspect(conn).get_table_names():
         return
+    colonnes = {c['name']: c['type'] for c in inspect(conn).get_columns('audit_log')}
+    if isinstance(colonnes['new_values'], JSONB):
+        return
+
+    for colonne in ('old_values', 'new_values'):
+        conn.execute(db.text(
+            f'ALTER TABLE audit_log ALTER COLUMN {colonne} TYPE JSONB USING {colonne}::jsonb'
+        ))
+
+
+def migrer_total_prevu(conn):
+    """Ajouter et remplir projets.total_prevu sur une base existante"""
+    from sqlalchemy import inspect
+
+    colonnes = {c['name'] for c in inspect(conn).get_columns('projets')}
+    if 'total_prevu' in colonnes:
+        return
+
+    conn.execute(db.text('ALTER TABLE projets ADD COLUMN total_prevu NUMERIC(15, 2) DEFAULT 0'))
+    conn.execute(db.text(
+        'UPDATE projets SET total_prevu = COALESCE('
+        '(SELECT SUM(montant_prevu) FROM lignes_budget'
+        ' WHERE lignes_budget.projet_id = projets.id), 0)'
+    ))
+
+
+def migrer_hash_pieces_justificatives(conn):
+    """Ajouter pieces_justificatives.fichier_hash sur une base existante
+
+    Les documents déjà attachés restent sans empreinte (NULL, hors contrôle de doublon).
+    """
+    from sqlalchemy import inspect
+
+    colonnes = {c['name'] for c in inspect(conn).get_columns('pieces_justificatives')}
+    if 'fichier_hash' in colonnes:
+        return
+
+    conn.execute(db.text('ALTER TABLE pieces_justificatives ADD COLUMN fichier_hash VARCHAR(64)'))
+
+
+def migrer_sequence_pieces(conn):
+    """Créer piece_numero_seq sur une base PostgreSQL, au-delà des numéros déjà attribués"""
+    from sqlalchemy.schema import CreateSequence
 
+    if conn.dialect.name != 'postgresql' or conn.dialect.has_sequence(conn, SEQUENCE_NUMERO_PIECE.name):
+        return
+
+    conn.execute(CreateSequence(SEQUENCE_NUMERO_PIECE))
+    # Les numéros précédents valaient MAX(id) + 1 au plus : la séquence repart après MAX(id)
+    conn.execute(db.text("SELECT setval('piece_numero_seq', (SELECT MAX(id) FROM pieces))"))
+
+
+def migrer_exercice_lignes(conn):
+    """Ajouter et remplir lignes_ecriture.exercice_id sur une base existante"""
+    from sqlalchemy import inspect
+
+    colonnes = {c['name'] for c in inspect(conn).get_columns('lignes_ecriture')}
+    if 'exercice_id' in colonnes:
+        return
+
+    conn.execute(db.text('ALTER TABLE lignes_ecriture ADD COLUMN exercice_id INTEGER REFERENCES exercices(id)'))
+    conn.execute(db.text(
+        'UPDATE lignes_ecriture SET exercice_id = '
+        '(SELECT exercice_id FROM pieces WHERE pieces.id = lignes_ecriture.piece_id)'
+    ))
+
+
+PLAN_COMPTABLE_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'plan_comptable.csv')
+
+
+def charger_plan_comptable():
+    """Lire le plan comptable SYSCOHADA de base (numero, intitule, classe, type_compte)
+
+    Le fichier étant édité à la main, les champs sont normalisés et un numéro
+    en double n'est retenu qu'une fois (contrainte d'unicité de comptes.numero).
+    """
+    comptes = {}
+    with open(PLAN_COMPTABLE_CSV, newline='', encoding='utf-8') as f:
+        lecteur = csv.reader(f)
+        next(lecteur)  # en-tête numero,intitule,classe,type_compte
+        for numero, intitule, classe, type_compte in lecteur:
+            numero = numero.strip()
+            if numero in comptes:
+                continue
+            comptes[numero] = {'numero': numero, 'intitule': intitule.strip(),
+                               'classe': int(classe), 'type_compte': type_compte.strip()}
+    return list(comptes.values())
+
+
+def init_db(creer_tables=True):
+    """Initialiser la base de données avec les données de base"""
+    # Déjà fait dans ce processus (tests, appels répétés) : aucune requête
+    if app.config.get('_DB_INIT_DONE'):
+        return
+
+    from sqlalchemy import inspect
+
+    # Schéma, index, migrations et données initiales dans une seule transaction
+    with db.engine.begin() as conn:
+        # Une seule lecture du catalogue ; create_all() vérifierait chaque table
+        tables_existantes = set(inspect(conn).get_table_names())
+        if conn.dialect.name == 'postgresql':
+            # Opérateurs des index trigrammes de recherche (gin_trgm_ops)
+            conn.execute(db.text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        if creer_tables and not tables_existantes.issuperset(db.metadata.tables):
+            db.metadata.create_all(conn)
+        # Colonnes ajoutées avant les index qui les couvrent
+        migrer_audit_json(conn)
+        migrer_exercice_lignes(conn)
+        migrer_hash_pieces_justificatives(conn)
+        supprimer_index_obsoletes(conn)
+        creer_index_manquants(conn)
+        migrer_amortissements_materialises(conn)
+        migrer_total_prevu(conn)
+        migrer_sequence_pieces(conn)
+
+        # Vérifier si déjà initialisé
+        if not conn.execute(db.select(Devise.id).limit(1)).first():
+            remplir_donnees_initiales(conn)
+    app.config['_DB_INIT_DONE'] = True
+
+
+def remplir_donnees_initiales(conn):
+    """Insérer devises, exercice, plan comptable, journaux, catégories et admin
+
+    Une requête executemany par table sur la connexion de init_db, sans objets
+    ORM ; le commit est celui de la transaction englobante.
+    """
     # Devises
     devises = [
-        Devise(code='XOF', nom='Franc CFA', symbole='FCFA', taux_base=1),
-        Devise(code='USD', nom='Dollar US', symbole='$', taux_base=600),
-        Devise(code='EUR', nom='Euro', symbole='€', taux_base=655),
-        Devise(code='CHF', nom='Franc Suisse', symbole='CHF', taux_base=700),
+        dict(code='XOF', nom='Franc CFA', symbole='FCFA', taux_base=1),
+        dict(code='USD', nom='Dollar US', symbole='$', taux_base=600),
+        dict(code='EUR', nom='Euro', symbole='€', taux_base=655),
+        dict(code='CHF', nom='Franc Suisse', symbole='CHF', taux_base=700),
     ]
-    db.session.add_all(devises)
+    conn.execute(insert(Devise), devises)
 
     # Exercice comptable
-    exercice = ExerciceComptable(
+    conn.execute(insert(ExerciceComptable), [dict(
         annee=2025,
         date_debut=date(2025, 1, 1),
         date_fin=date(2025, 12, 31)
-    )
-    db.session.add(exercice)
+    )])
 
     # Plan comptable SYSCOHADA pour ONG - Conforme aux normes
-    comptes = [
-        # Classe 1 - Capitaux propres (compte 19 supprimé - non standard SYSCOHADA)
-        CompteComptable(numero='10', intitule='Capital', classe=1, type_compte='passif'),
-        CompteComptable(numero='101', intitule='Capital social', classe=1, type_compte='passif'),
-        CompteComptable(numero='11', intitule='Réserves', classe=1, type_compte='passif'),
-        CompteComptable(numero='12', intitule='Report à nouveau', classe=1, type_compte='passif'),
-        CompteComptable(numero='13', intitule='Résultat de l\'exercice', classe=1, type_compte='passif'),
-        CompteComptable(numero='14', intitule='Subventions d\'investissement', classe=1, type_compte='passif'),
-        CompteComptable(numero='15', intitule='Provisions réglementées', classe=1, type_compte='passif'),
-        CompteComptable(numero='16', intitule='Emprunts et dettes', classe=1, type_compte='passif'),
-        CompteComptable(numero='17', intitule='Dettes de crédit-bail', classe=1, type_compte='passif'),
-        CompteComptable(numero='18', intitule='Dettes liées à des participations', classe=1, type_compte='passif'),
-
-        # Classe 2 - Immobilisations
-        CompteComptable(numero='21', intitule='Immobilisations incorporelles', classe=2, type_compte='actif'),
-        CompteComptable(numero='211', intitule='Frais de développement', classe=2, type_compte='actif'),
-        CompteComptable(numero='212', intitule='Brevets, licences', classe=2, type_compte='actif'),
-        CompteComptable(numero='22', intitule='Terrains', classe=2, type_compte='actif'),
-        CompteComptable(numero='23', intitule='Bâtiments', classe=2, type_compte='actif'),
-        CompteComptable(numero='24', intitule='Matériel et outillage', classe=2, type_compte='actif'),
-        CompteComptable(numero='241', intitule='Matériel industriel', classe=2, type_compte='actif'),
-        CompteComptable(numero='244', intitule='Matériel informatique', classe=2, type_compte='actif'),
-        CompteComptable(numero='245', intitule='Matériel de transport', classe=2, type_compte='actif'),
-        CompteComptable(numero='246', intitule='Mobilier de bureau', classe=2, type_compte='actif'),
-        CompteComptable(numero='28', intitule='Amortissements', classe=2, type_compte='actif'),
-        CompteComptable(numero='281', intitule='Amort. immobilisations incorporelles', classe=2, type_compte='actif'),
-        CompteComptable(numero='284', intitule='Amort. matériel', classe=2, type_compte='actif'),
-
-        # Classe 3 - Stocks
-        CompteComptable(numero='31', intitule='Stocks de matières premières', classe=3, type_compte='actif'),
-        CompteComptable(numero='32', intitule='Stocks fournitures', classe=3, type_compte='actif'),
-        CompteComptable(numero='38', intitule='Stocks en cours de route', classe=3, type_compte='actif'),
-        CompteComptable(numero='39', intitule='Dépréciations des stocks', classe=3, type_compte='actif'),
-
-        # Classe 4 - Tiers
-        CompteComptable(numero='40', intitule='Fournisseurs', classe=4, type_compte='passif'),
-        CompteComptable(numero='401', intitule='Fournisseurs locaux', classe=4, type_compte='passif'),
-        CompteComptable(numero='402', intitule='Fournisseurs étrangers', classe=4, type_compte='passif'),
-        CompteComptable(numero='41', intitule='Clients et bailleurs', classe=4, type_compte='actif'),
-        CompteComptable(numero='411', intitule='Bailleurs de fonds', classe=4, type_compte='actif'),
-        # Sous-comptes par bailleur
-        CompteComptable(numero='4111', intitule='Bailleur - Nitidae', classe=4, type_compte='actif'),
-        CompteComptable(numero='4112', intitule='Bailleur - GIUB', classe=4, type_compte='actif'),
-        CompteComptable(numero='4113', intitule='Bailleur - AFD', classe=4, type_compte='actif'),
-        CompteComptable(numero='4114', intitule='Bailleur - Union Européenne', classe=4, type_compte='actif'),
-        CompteComptable(numero='4119', intitule='Autres bailleurs', classe=4, type_compte='actif'),
-        CompteComptable(numero='42', intitule='Personnel', classe=4, type_compte='passif'),
-        CompteComptable(numero='421', intitule='Personnel - Rémunérations dues', classe=4, type_compte='passif'),
-        CompteComptable(numero='422', intitule='Personnel - Avances et acomptes', classe=4, type_compte='actif'),
-        CompteComptable(numero='43', intitule='Organismes sociaux', classe=4, type_compte='passif'),
-        CompteComptable(numero='431', intitule='Sécurité sociale (CSS)', classe=4, type_compte='passif'),
-        CompteComptable(numero='432', intitule='Caisse de retraite (IPRES)', classe=4, type_compte='passif'),
-        CompteComptable(numero='433', intitule='Mutuelles santé (IPM)', classe=4, type_compte='passif'),
-        CompteComptable(numero='44', intitule='État et collectivités', classe=4, type_compte='passif'),
-        CompteComptable(numero='441', intitule='État - Impôt sur les bénéfices', classe=4, type_compte='passif'),
-        CompteComptable(numero='442', intitule='État - TVA collectée', classe=4, type_compte='passif'),
-        CompteComptable(numero='443', intitule='État - TVA déductible', classe=4, type_compte='actif'),
-        CompteComptable(numero='444', intitule='État - Retenues à la source (BRS)', classe=4, type_compte='passif'),
-        CompteComptable(numero='445', intitule='État - IRVM/IRCM', classe=4, type_compte='passif'),
-        CompteComptable(numero='446', intitule='État - Patente et CFCE', classe=4, type_compte='passif'),
-        CompteComptable(numero='47', intitule='Comptes transitoires', classe=4, type_compte='actif'),
-        CompteComptable(numero='471', intitule='Débiteurs divers', classe=4, type_compte='actif'),
-        CompteComptable(numero='472', intitule='Créditeurs divers', classe=4, type_compte='passif'),
-        CompteComptable(numero='48', intitule='Charges/Produits constatés d\'avance', classe=4, type_compte='passif'),
-
-        # Classe 5 - Trésorerie
-        CompteComptable(numero='52', intitule='Banques', classe=5, type_compte='actif'),
-        CompteComptable(numero='521', intitule='Banque compte principal', classe=5, type_compte='actif'),
-        # Sous-comptes par devise
-        CompteComptable(numero='5211', intitule='Banque XOF', classe=5, type_compte='actif'),
-        CompteComptable(numero='5212', intitule='Banque USD', classe=5, type_compte='actif'),
-        CompteComptable(numero='5213', intitule='Banque CHF', classe=5, type_compte='actif'),
-        CompteComptable(numero='5214', intitule='Banque EUR', classe=5, type_compte='actif'),
-        CompteComptable(numero='522', intitule='Banque compte projet', classe=5, type_compte='actif'),
-        CompteComptable(numero='53', intitule='Établissements financiers', classe=5, type_compte='actif'),
-        CompteComptable(numero='57', intitule='Caisse', classe=5, type_compte='actif'),
-        CompteComptable(numero='571', intitule='Caisse siège', classe=5, type_compte='actif'),
-        CompteComptable(numero='572', intitule='Caisse terrain', classe=5, type_compte='actif'),
-        CompteComptable(numero='58', intitule='Virements internes', classe=5, type_compte='actif'),
-
-        # Classe 6 - Charges
-        CompteComptable(numero='60', intitule='Achats', classe=6, type_compte='charge'),
-        CompteComptable(numero='601', intitule='Achats fournitures bureau', classe=6, type_compte='charge'),
-        CompteComptable(numero='602', intitule='Achats fournitures terrain', classe=6, type_compte='charge'),
-        CompteComptable(numero='603', intitule='Achats consommables', classe=6, type_compte='charge'),
-        CompteComptable(numero='604', intitule='Achats matières premières', classe=6, type_compte='charge'),
-        CompteComptable(numero='605', intitule='Achats équipements', classe=6, type_compte='charge'),
-        CompteComptable(numero='61', intitule='Transports', classe=6, type_compte='charge'),
-        CompteComptable(numero='611', intitule='Transport personnel', classe=6, type_compte='charge'),
-        CompteComptable(numero='612', intitule='Transport matériel', classe=6, type_compte='charge'),
-        CompteComptable(numero='613', intitule='Transport aérien', classe=6, type_compte='charge'),
-        CompteComptable(numero='62', intitule='Services extérieurs', classe=6, type_compte='charge'),
-        CompteComptable(numero='621', intitule='Locations immobilières', classe=6, type_compte='charge'),
-        CompteComptable(numero='622', intitule='Locations matériel/véhicules', classe=6, type_compte='charge'),
-        CompteComptable(numero='623', intitule='Entretien et réparations', classe=6, type_compte='charge'),
-        CompteComptable(numero='624', intitule='Honoraires et consultants', classe=6, type_compte='charge'),
-        CompteComptable(numero='625', intitule='Déplacements et missions', classe=6, type_compte='charge'),
-        CompteComptable(numero='6251', intitule='Frais de déplacement local', classe=6, type_compte='charge'),
-        CompteComptable(numero='6252', intitule='Frais de mission international', classe=6, type_compte='charge'),
-        CompteComptable(numero='6253', intitule='Hébergement', classe=6, type_compte='charge'),
-        CompteComptable(numero='6254', intitule='Per diem', classe=6, type_compte='charge'),
-        CompteComptable(numero='626', intitule='Télécommunications', classe=6, type_compte='charge'),
-        CompteComptable(numero='6261', intitule='Téléphone et internet', classe=6, type_compte='charge'),
-        CompteComptable(numero='6262', intitule='Courrier et affranchissement', classe=6, type_compte='charge'),
-        CompteComptable(numero='627', intitule='Services bancaires', classe=6, type_compte='charge'),
-        CompteComptable(numero='628', intitule='Assurances', classe=6, type_compte='charge'),
-        CompteComptable(numero='63', intitule='Autres services', classe=6, type_compte='charge'),
-        CompteComptable(numero='631', intitule='Formation', classe=6, type_compte='charge'),
-        CompteComptable(numero='632', intitule='Ateliers et réunions', classe=6, type_compte='charge'),
-        CompteComptable(numero='633', intitule='Communication et publication', classe=6, type_compte='charge'),
-        CompteComptable(numero='634', intitule='Études et recherches', classe=6, type_compte='charge'),
-        CompteComptable(numero='635', intitule='Sous-traitance', classe=6, type_compte='charge'),
-        # Classe 64 - Impôts et taxes (détaillé pour le Sénégal)
-        CompteComptable(numero='64', intitule='Impôts et taxes', classe=6, type_compte='charge'),
-        CompteComptable(numero='641', intitule='Patente', classe=6, type_compte='charge'),
-        CompteComptable(numero='642', intitule='CFCE (Contribution Foncière)', classe=6, type_compte='charge'),
-        CompteComptable(numero='643', intitule='Taxes sur véhicules', classe=6, type_compte='charge'),
-        CompteComptable(numero='644', intitule='TVA non récupérable', classe=6, type_compte='charge'),
-        CompteComptable(numero='645', intitule='Droits d\'enregistrement', classe=6, type_compte='charge'),
-        CompteComptable(numero='646', intitule='Droits de douane', classe=6, type_compte='charge'),
-        CompteComptable(numero='647', intitule='Autres impôts et taxes', classe=6, type_compte='charge'),
-        CompteComptable(numero='65', intitule='Autres charges', classe=6, type_compte='charge'),
-        CompteComptable(numero='651', intitule='Pertes sur créances', classe=6, type_compte='charge'),
-        CompteComptable(numero='652', intitule='Pénalités et amendes', classe=6, type_compte='charge'),
-        CompteComptable(numero='66', intitule='Charges de personnel', classe=6, type_compte='charge'),
-        CompteComptable(numero='661', intitule='Salaires bruts', classe=6, type_compte='charge'),
-        CompteComptable(numero='6611', intitule='Salaires personnel permanent', classe=6, type_compte='charge'),
-        CompteComptable(numero='6612', intitule='Salaires personnel projet', classe=6, type_compte='charge'),
-        CompteComptable(numero='662', intitule='Indemnités et primes', classe=6, type_compte='charge'),
-        CompteComptable(numero='6621', intitule='Indemnité de logement', classe=6, type_compte='charge'),
-        CompteComptable(numero='6622', intitule='Indemnité de transport', classe=6, type_compte='charge'),
-        CompteComptable(numero='6623', intitule='Prime de rendement', classe=6, type_compte='charge'),
-        CompteComptable(numero='663', intitule='Charges sociales patronales', classe=6, type_compte='charge'),
-        CompteComptable(numero='6631', intitule='Cotisations CSS (employeur)', classe=6, type_compte='charge'),
-        CompteComptable(numero='6632', intitule='Cotisations IPRES (employeur)', classe=6, type_compte='charge'),
-        CompteComptable(numero='6633', intitule='Cotisations IPM (employeur)', classe=6, type_compte='charge'),
-        CompteComptable(numero='664', intitule='Charges sociales salariales', classe=6, type_compte='charge'),
-        CompteComptable(numero='67', intitule='Charges financières', classe=6, type_compte='charge'),
-        CompteComptable(numero='671', intitule='Intérêts des emprunts', classe=6, type_compte='charge'),
-        CompteComptable(numero='672', intitule='Pertes de change', classe=6, type_compte='charge'),
-        CompteComptable(numero='68', intitule='Dotations amortissements et provisions', classe=6, type_compte='charge'),
-        CompteComptable(numero='681', intitule='Dotations aux amortissements', classe=6, type_compte='charge'),
-        CompteComptable(numero='682', intitule='Dotations aux provisions', classe=6, type_compte='charge'),
-        CompteComptable(numero='69', intitule='Charges exceptionnelles', classe=6, type_compte='charge'),
-
-        # Classe 7 - Produits
-        CompteComptable(numero='70', intitule='Ventes et prestations', classe=7, type_compte='produit'),
-        CompteComptable(numero='701', intitule='Ventes de services', classe=7, type_compte='produit'),
-        CompteComptable(numero='702', intitule='Prestations de conseil', classe=7, type_compte='produit'),
-        CompteComptable(numero='74', intitule='Subventions d\'exploitation', classe=7, type_compte='produit'),
-        CompteComptable(numero='741', intitule='Subventions projets', classe=7, type_compte='produit'),
-        # Sous-comptes par projet
-        CompteComptable(numero='7411', intitule='Subvention projet LED', classe=7, type_compte='produit'),
-        CompteComptable(numero='7412', intitule='Subvention projet SOR4D', classe=7, type_compte='produit'),
-        CompteComptable(numero='7413', intitule='Subvention projet AMSANA', classe=7, type_compte='produit'),
-        CompteComptable(numero='7419', intitule='Subventions autres projets', classe=7, type_compte='produit'),
-        CompteComptable(numero='742', intitule='Subventions fonctionnement', classe=7, type_compte='produit'),
-        CompteComptable(numero='75', intitule='Autres produits', classe=7, type_compte='produit'),
-        CompteComptable(numero='751', intitule='Produits accessoires', classe=7, type_compte='produit'),
-        CompteComptable(numero='76', intitule='Produits financiers', classe=7, type_compte='produit'),
-        CompteComptable(numero='761', intitule='Intérêts bancaires', classe=7, type_compte='produit'),
-        CompteComptable(numero='762', intitule='Gains de change', classe=7, type_compte='produit'),
-        CompteComptable(numero='77', intitule='Produits exceptionnels', classe=7, type_compte='produit'),
-        CompteComptable(numero='78', intitule='Reprises amortissements et provisions', classe=7, type_compte='produit'),
-        CompteComptable(numero='79', intitule='Transferts de charges', classe=7, type_compte='produit'),
-    ]
-    db.session.add_all(comptes)
+    comptes = charger_plan_comptable()
+    conn.execute(insert(CompteComptable), comptes)
 
     # Journaux comptables
     journaux = [
-        Journal(code='AC', nom='Journal des Achats', type_journal='achat'),
-        Journal(code='BQ', nom='Journal de Banque', type_journal='banque'),
-        Journal(code='CA', nom='Journal de Caisse', type_journal='caisse'),
-        Journal(code='OD', nom='Opérations Diverses', type_journal='od'),
-        Journal(code='SAL', nom='Journal des Salaires', type_journal='od'),
+        dict(code='AC', nom='Journal des Achats', type_journal='achat'),
+        dict(code='BQ', nom='Journal de Banque', type_journal='banque'),
+        dict(code='CA', nom='Journal de Caisse', type_journal='caisse'),
+        dict(code='OD', nom='Opérations Diverses', type_journal='od'),
+        dict(code='SAL', nom='Journal des Salaires', type_journal='od'),
     ]
-    db.session.add_all(journaux)
+    conn.execute(insert(Journal), journaux)
 
     # Catégories budgétaires (basées sur vos budgets)
     categories = [
-        CategorieBudget(code='LABOR', nom='Personnel / Salaires', ordre=1),
-        CategorieBudget(code='TRAVEL', nom='Voyages et Déplacements', ordre=2),
-        CategorieBudget(code='SUPPLIES', nom='Fournitures et Équipements', ordre=3),
-        CategorieBudget(code='PROGRAM', nom='Coûts Programmes / Activités', ordre=4),
-        CategorieBudget(code='ADMIN', nom='Frais Administratifs', ordre=5),
-        CategorieBudget(code='OVERHEAD', nom='Frais Généraux / Indirect', ordre=6),
-        CategorieBudget(code='AUDIT', nom='Audit et Évaluation', ordre=7),
+        dict(code='LABOR', nom='Personnel / Salaires', ordre=1),
+        dict(code='TRAVEL', nom='Voyages et Déplacements', ordre=2),
+        dict(code='SUPPLIES', nom='Fournitures et Équipements', ordre=3),
+        dict(code='PROGRAM', nom='Coûts Programmes / Activités', ordre=4),
+        dict(code='ADMIN', nom='Frais Administratifs', ordre=5),
+        dict(code='OVERHEAD', nom='Frais Généraux / Indirect', ordre=6),
+        dict(code='AUDIT', nom='Audit et Évaluation', ordre=7),
     ]
-    db.session.add_all(categories)
+    conn.execute(insert(CategorieBudget), categories)
 
     # SECURITY: Create admin user only if explicitly enabled or in development
     create_admin = os.environ.get('CREATE_DEFAULT_ADMIN', 'false').lower() == 'true'
@@ -7316,42 +8543,81 @@ def init_db():
 
         if not admin_password:
             if is_development:
-                admin_password = 'admin123'
+                admin_password = _DEFAULT_ADMIN_PASSWORD
                 print("WARNING: Using default admin password. Set ADMIN_PASSWORD env var in production!")
             else:
                 print("ERROR: ADMIN_PASSWORD environment variable not set. Skipping admin creation.")
-                db.session.commit()
                 print("Base de données initialisée avec succès (sans utilisateur admin)!")
                 return
 
-        admin = Utilisateur(
+        conn.execute(insert(Utilisateur), [dict(
             email=admin_email,
             nom='Administrateur',
             prenom='CREATES',
-            password_hash=generate_password_hash(admin_password),
+            password_hash=(_DEFAULT_ADMIN_HASH if admin_password == _DEFAULT_ADMIN_PASSWORD
+                           else hacher_mot_de_passe(admin_password)),
             role='directeur',
             actif=True,
             created_by='system'
-        )
-        db.session.add(admin)
-        db.session.commit()
+        )])
         print("Base de données initialisée avec succès!")
         print(f"Utilisateur admin créé: {admin_email}")
-        if admin_password == 'admin123':
+        if admin_password == _DEFAULT_ADMIN_PASSWORD:
             print("IMPORTANT: Changez le mot de passe par défaut immédiatement!")
     else:
-        db.session.commit()
         print("Base de données initialisée avec succès!")
         print("Note: Aucun utilisateur admin créé. Définir CREATE_DEFAULT_ADMIN=true pour en créer un.")
 
 
+@app.cli.command('init-db')
+@click.option('--create-tables/--no-create-tables', default=True,
+              help='Créer les tables manquantes (db.create_all) avant le remplissage')
+def init_db_command(create_tables):
+    """Initialiser la base : flask --app app init-db"""
+    init_db(creer_tables=create_tables)
+
+
+@app.cli.command('refresh-rapports')
+def refresh_rapports_command():
+    """Périmer les agrégats en cache (rapports, tableau de bord, listes de référence)"""
+    invalider_cache_rapports()
+    invalider_cache_tableau_bord()
+    invalider_cache_referentiels()
+
+
+@app.cli.command('verifier-totaux-prevus')
+@click.option('--corriger', is_flag=True, help='Réaligner les projets en écart')
+def verifier_totaux_prevus_command(corriger):
+    """Comparer projets.total_prevu à la somme des lignes budgétaires"""
+    sommes = db.select(
+        LigneBudget.projet_id, db.func.sum(LigneBudget.montant_prevu).label('somme')
+    ).group_by(LigneBudget.projet_id).subquery()
+    ecarts = db.session.execute(
+        db.select(Projet.id, Projet.code, Projet.total_prevu, db.func.coalesce(sommes.c.somme, 0))
+        .outerjoin(sommes, sommes.c.projet_id == Projet.id)
+        .where(db.func.coalesce(Projet.total_prevu, 0) != db.func.coalesce(sommes.c.somme, 0))
+    ).all()
+
+    for projet_id, code, stocke, somme in ecarts:
+        click.echo(f'{code}: total_prevu={stocke} / lignes={somme}')
+        if corriger:
+            recalculer_total_prevu(db.session.connection(), projet_id)
+    if corriger and ecarts:
+        db.session.commit()
+        invalider_cache_tableau_bord()
+    click.echo(f'{len(ecarts)} projet(s) en écart')
+
+
 # =============================================================================
 # MAIN
 # =============================================================================
 
 if __name__ == '__main__':
-    with app.app_context():
-        init_db()
+    # L'initialisation se fait avec `flask --app app init-db` ; FLASK_AUTO_INIT=1
+    # la relance au démarrage pour le développement
+    if os.environ.get('FLASK_AUTO_INIT') == '1':
+        with app.app_context():
+            init_db()
     # SECURITY: Debug mode disabled in production
     debug_mode = os.environ.get('FLASK_DEBUG', 'false').lower() == 'true'
     port = int(os.environ.get('PORT', 5001))
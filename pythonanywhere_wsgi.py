@@ -23,6 +23,12 @@ if project_folder not in sys.path:
 os.environ['FLASK_ENV'] = 'production'
 os.environ['SECRET_KEY'] = 'CHANGEZ_CE_SECRET_EN_PRODUCTION_123456789'
 
+# Cache des rapports : désactivé par défaut. Pour l'activer, soit un Redis partagé ...
+# os.environ['CACHE_TYPE'] = 'RedisCache'
+# os.environ['CACHE_REDIS_URL'] = 'redis://host:6379/0'
+# ... soit le cache en mémoire, uniquement si l'onglet "Web" indique un seul worker :
+# os.environ['WEB_CONCURRENCY'] = '1'
+
 # Importer l'application Flask
 from app import app as application
 
@@ -15,6 +15,9 @@ if ! python3 -c "import flask" 2>/dev/null; then
     pip3 install -r requirements.txt
 fi
 
+echo "Initialisation de la base de données..."
+flask --app app init-db
+
 echo "Démarrage du serveur..."
 echo ""
 echo "Ouvrez votre navigateur à l'adresse:"